@@ -1,16 +1,35 @@
 import datetime
-from typing import Optional, cast
+from contextlib import contextmanager
+from typing import Dict, List, Optional, cast
 
 import frappe
 from frappe.query_builder import DocType
+from frappe.query_builder.functions import Coalesce, Count
+from frappe.utils import cint
 from pypika import Order
 from pypika.queries import QueryBuilder
 from result import is_ok
 
-from ksa_compliance import logger
+from ksa_compliance import logger, zatca_circuit_breaker
 from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
+    DEFERRED_FIELDS,
     SalesInvoiceAdditionalFields,
+    prefetch_signed_xmls,
 )
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import (
+    ZATCABusinessSettings,
+)
+from ksa_compliance.ksa_compliance.doctype.zatca_egs.zatca_egs import ZATCAEGS
+from ksa_compliance.zatca_async_api import (
+    ReportInvoiceRequest,
+    ReportResponse,
+    report_invoices_sync,
+)
+
+INVOICE_DOCTYPES = ["Sales Invoice", "POS Invoice", "Payment Entry", "Journal Entry"]
+
+# Like the sync job timeout, so a lock left by a killed job expires by the next hourly run
+SYNC_LOCK_TIMEOUT_SECONDS = 3480
 
 
 @frappe.whitelist()
@@ -35,7 +54,103 @@ def sync_e_invoices(
     batch_size: int = 100,
     dry_run: bool = False,
 ):
+    """
+    Syncs pending invoices with ZATCA. The backlog is partitioned by company and EGS device (for precomputed
+    invoices), since each partition has its own credentials and hash chain. Partitions are spread over up to
+    'zatca_sync_concurrency' (site config) background jobs. With the default concurrency of 1, everything is
+    synced within the current job.
+    """
     prefix = "[Dry run] " if dry_run else ""
+    partitions = get_sync_partitions(check_date)
+    if not partitions:
+        logger.info(f"{prefix}Nothing to sync")
+        return
+
+    concurrency = max(1, cint(frappe.conf.get("zatca_sync_concurrency") or 1))
+    shards = [partitions[i::concurrency] for i in range(min(concurrency, len(partitions)))]
+    if len(shards) == 1:
+        sync_partitions(shards[0], check_date, batch_size, dry_run)
+        return
+
+    logger.info(f"{prefix}Syncing {len(partitions)} partitions in {len(shards)} parallel jobs")
+    for index, shard in enumerate(shards):
+        frappe.enqueue(
+            "ksa_compliance.background_jobs.sync_partitions",
+            partitions=shard,
+            check_date=check_date,
+            batch_size=batch_size,
+            dry_run=dry_run,
+            queue="long",
+            timeout=3480,  # 58 minutes, so that we can run it hourly
+            job_name=f"Sync E-Invoices ({index + 1}/{len(shards)})",
+            deduplicate=True,
+            job_id=f"Sync E-Invoices shard {index + 1}/{len(shards)}",
+        )
+
+
+def sync_partitions(
+    partitions: List[dict],
+    check_date: Optional[datetime.datetime | datetime.date] = None,
+    batch_size: int = 100,
+    dry_run: bool = False,
+):
+    # Shards are rebuilt on every run, and other syncs (e.g. after ZATCA recovers) can overlap a running one, so the
+    # same partition may come up in two jobs at once. Each partition is locked while it syncs, and a sync that finds
+    # it locked skips it rather than reporting the same invoices twice
+    for partition in partitions:
+        with _partition_lock(partition) as locked:
+            if not locked:
+                logger.info(
+                    f"[{_describe_partition(partition)}] Another sync is running for this partition, skipping it"
+                )
+                continue
+            sync_partition(partition, check_date, batch_size, dry_run)
+
+
+def get_partition_lock_key(partition: dict) -> str:
+    return frappe.cache().make_key(
+        f"zatca_sync|{partition['company']}|{partition['device_id'] or ''}"
+    )
+
+
+@contextmanager
+def _partition_lock(partition: dict):
+    """Yields whether [partition] was locked for this sync. If Redis can't be reached, the sync goes ahead unlocked"""
+    lock = frappe.cache().lock(
+        get_partition_lock_key(partition), timeout=SYNC_LOCK_TIMEOUT_SECONDS
+    )
+    try:
+        acquired = lock.acquire(blocking=False)
+    except Exception as e:
+        logger.warning(f"ZATCA sync lock unavailable, syncing without it: {e}")
+        yield True
+        return
+
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except Exception as e:
+                # The lock expired, so another sync may have taken it since
+                logger.warning(f"Error releasing ZATCA sync lock: {e}")
+
+
+def _describe_partition(partition: dict) -> str:
+    return (
+        f"{partition['company']}{'/' + partition['device_id'] if partition['device_id'] else ''}"
+    )
+
+
+def sync_partition(
+    partition: dict,
+    check_date: Optional[datetime.datetime | datetime.date] = None,
+    batch_size: int = 100,
+    dry_run: bool = False,
+):
+    prefix = "[Dry run] " if dry_run else ""
+    prefix += f"[{_describe_partition(partition)}] "
     logger.info(f"{prefix}Syncing with ZATCA in batches of {batch_size}")
     if check_date:
         logger.info(f"{prefix}Limiting sync to >= date: {check_date}")
@@ -48,54 +163,248 @@ def sync_e_invoices(
     #
     # If we kept the offset at 0, the loop would never terminate in dry_run mode because we never update status.
     #
-    # The solution is to use the creation date itself as an offset/filter. We sort by it ascending, so after every
-    # batch we can query for fields whose creation > the last creation in the previous batch
+    # The solution is to use the (creation, name) of the last record as a keyset. We sort by both ascending, so after
+    # every batch we can query for the fields that come after the last one in the previous batch. The name breaks ties
+    # between records created in the same instant, which a creation-only offset would skip
     if isinstance(check_date, datetime.date):
         offset = cast(
             Optional[datetime.datetime], datetime.datetime.combine(check_date, datetime.time.min)
         )
     else:
         offset = cast(Optional[datetime.datetime], check_date)
+    last_name = None
+
+    # Everything in a partition shares the same business settings and EGS, so they're only loaded once
+    settings = ZATCABusinessSettings.for_company(partition["company"])
+    egs = ZATCAEGS.for_device(partition["device_id"]) if partition["device_id"] else None
 
     while True:
-        query = build_query(offset, batch_size)
+        query = build_query(offset, batch_size, partition, last_name)
         additional_field_docs = query.run(as_dict=True)
         if not additional_field_docs:
             break
 
         logger.info(f"{prefix}Syncing {len(additional_field_docs)} after date/time {offset}")
-        offset = additional_field_docs[-1].creation
-
-        for doc in additional_field_docs:
-            try:
+        offset, last_name = additional_field_docs[-1].creation, additional_field_docs[-1].name
+        if dry_run:
+            for doc in additional_field_docs:
                 logger.info(f"{prefix}Submitting {doc.name}")
-                if dry_run:
-                    continue
+            continue
+
+        try:
+            adf_docs = load_additional_fields(
+                [doc.name for doc in additional_field_docs],
+                defer_large_fields=True,
+                prefetch_signed_xml=True,
+            )
+        except Exception:
+            logger.error(f"{prefix}Error loading batch after {offset}", exc_info=True)
+            return
+
+        reported = _report_concurrently(adf_docs, settings, egs, prefix)
+        stopped = False
+        for adf_doc in adf_docs:
+            # Invoices that were already reported concurrently still need their responses recorded
+            if stopped and adf_doc.name not in reported:
+                continue
 
-                adf_doc = cast(
-                    SalesInvoiceAdditionalFields,
-                    frappe.get_doc("Sales Invoice Additional Fields", doc.name),
+            try:
+                logger.info(f"{prefix}Submitting {adf_doc.name}")
+                result = adf_doc.submit_to_zatca(
+                    reported.get(adf_doc.name), settings=settings, egs=egs
                 )
-                result = adf_doc.submit_to_zatca()
                 message = result.ok_value if is_ok(result) else result.err_value
-                logger.info(f"{prefix}{doc.name}: {message}")
+                logger.info(f"{prefix}{adf_doc.name}: {message}")
                 frappe.db.commit()
             except Exception:
-                logger.error(f"{prefix}Error submitting {doc.name}", exc_info=True)
+                logger.error(f"{prefix}Error submitting {adf_doc.name}", exc_info=True)
                 frappe.db.rollback()
+                continue
+
+            # ZATCA is asking us to slow down, or is unreachable. The rest of this partition is left for the next run,
+            # which keeps the remaining invoices in order and doesn't burn through them with more 'Resend' attempts
+            if adf_doc.flags.zatca_status_code in (429, zatca_circuit_breaker.STATUS_CODE):
+                stopped = True
+
+        if stopped:
+            logger.warning(
+                f"{prefix}Rate limited by ZATCA or ZATCA is unreachable, stopping until the next sync"
+            )
+            return
 
     logger.info(f"{prefix}Sync Done")
 
 
-def build_query(check_date: Optional[datetime.datetime], limit: int) -> QueryBuilder:
-    batch_status = ["Ready For Batch", "Resend", "Corrected"]
+def load_additional_fields(
+    names: List[str], defer_large_fields: bool = False, prefetch_signed_xml: bool = False
+) -> List[SalesInvoiceAdditionalFields]:
+    """
+    Loads sales invoice additional fields in bulk, in the order of [names]. This is equivalent to calling
+    frappe.get_doc for each name, but uses one query for the parents and one per child table instead of one query
+    per document and child table.
+
+    With [defer_large_fields], the large text columns in [DEFERRED_FIELDS] aren't read. Each document reads them on
+    first access, and saving it before that leaves them untouched.
+
+    With [prefetch_signed_xml], the signed XMLs of all documents are read up front (see [prefetch_signed_xmls]), so
+    reporting and submitting them doesn't fetch and decompress each one separately.
+    """
+    doctype = "Sales Invoice Additional Fields"
+    fields = ["*"]
+    if defer_large_fields:
+        fields = [
+            column
+            for column in frappe.get_meta(doctype).get_valid_columns()
+            if column not in DEFERRED_FIELDS
+        ]
+    rows = {row.name: row for row in frappe.get_all(doctype, {"name": ["in", names]}, fields)}
+    for table_field in frappe.get_meta(doctype).get_table_fields():
+        for row in rows.values():
+            row[table_field.fieldname] = []
+        children = frappe.get_all(
+            table_field.options,
+            filters={
+                "parent": ["in", names],
+                "parenttype": doctype,
+                "parentfield": table_field.fieldname,
+            },
+            fields=["*"],
+            order_by="idx asc",
+        )
+        for child in children:
+            rows[child.parent][table_field.fieldname].append(child)
+
+    docs = []
+    for name in names:
+        if name not in rows:
+            continue
+        doc = cast(
+            SalesInvoiceAdditionalFields, frappe.get_doc({"doctype": doctype, **rows[name]})
+        )
+        if defer_large_fields:
+            doc.defer_fields(DEFERRED_FIELDS)
+        docs.append(doc)
+
+    if prefetch_signed_xml:
+        prefetch_signed_xmls(docs)
+    return docs
+
+
+def _report_concurrently(
+    adf_docs: List[SalesInvoiceAdditionalFields],
+    settings: Optional[ZATCABusinessSettings],
+    egs: Optional[ZATCAEGS],
+    prefix: str,
+) -> Dict[str, ReportResponse]:
+    """
+    Reports the simplified invoices in a batch concurrently when 'zatca_async_reporting_concurrency' (site config) is
+    set. Returns the ZATCA responses by name, for [submit_to_zatca] to record
+    """
+    concurrency = cint(frappe.conf.get("zatca_async_reporting_concurrency"))
+    if concurrency <= 1:
+        return {}
+
+    names_by_server: Dict[str, List[str]] = {}
+    requests_by_server: Dict[str, List[ReportInvoiceRequest]] = {}
+    for adf_doc in adf_docs:
+        try:
+            report_request = adf_doc.get_report_request(settings=settings, egs=egs)
+        except Exception:
+            logger.error(f"{prefix}Error preparing {adf_doc.name} for reporting", exc_info=True)
+            continue
+
+        if report_request:
+            server, request = report_request
+            names_by_server.setdefault(server, []).append(adf_doc.name)
+            requests_by_server.setdefault(server, []).append(request)
+
+    reported = {}
+    for server, requests in requests_by_server.items():
+        logger.info(f"{prefix}Reporting {len(requests)} simplified invoices concurrently")
+        responses = report_invoices_sync(server, requests, concurrency)
+        reported.update(zip(names_by_server[server], responses))
+    return reported
+
+
+def get_sync_partitions(
+    check_date: Optional[datetime.datetime | datetime.date] = None,
+) -> List[dict]:
+    """Returns the (company, device_id) partitions that have invoices pending sync, largest first"""
     doctype = DocType("Sales Invoice Additional Fields")
+    company = _get_company_field(doctype)
+    precomputed = DocType("ZATCA Precomputed Invoice")
     query = (
-        frappe.qb.from_(doctype)
-        .select(doctype.name, doctype.creation)
-        .where((doctype.integration_status.isin(batch_status)) & (doctype.docstatus == 0))
+        _join_invoices(frappe.qb.from_(doctype), doctype)
+        .left_join(precomputed)
+        .on(precomputed.name == doctype.precomputed_invoice)
+        .select(
+            company.as_("company"),
+            precomputed.device_id.as_("device_id"),
+            Count(doctype.name).as_("pending"),
+        )
+        .where(_pending_condition(doctype))
+        .groupby(company, precomputed.device_id)
+        .orderby(Count(doctype.name), order=Order.desc)
     )
     if check_date:
         query = query.where(doctype.creation > check_date)
-    query = query.orderby(doctype.creation, order=Order.asc).limit(limit)
+    return [
+        {"company": row.company, "device_id": row.device_id}
+        for row in query.run(as_dict=True)
+        if row.company
+    ]
+
+
+def build_query(
+    check_date: Optional[datetime.datetime],
+    limit: int,
+    partition: Optional[dict] = None,
+    last_name: Optional[str] = None,
+) -> QueryBuilder:
+    doctype = DocType("Sales Invoice Additional Fields")
+    query = frappe.qb.from_(doctype).select(doctype.name, doctype.creation)
+    if partition:
+        precomputed = DocType("ZATCA Precomputed Invoice")
+        query = (
+            _join_invoices(query, doctype)
+            .left_join(precomputed)
+            .on(precomputed.name == doctype.precomputed_invoice)
+            .where(_get_company_field(doctype) == partition["company"])
+        )
+        if partition["device_id"]:
+            query = query.where(precomputed.device_id == partition["device_id"])
+        else:
+            query = query.where(precomputed.device_id.isnull())
+
+    query = query.where(_pending_condition(doctype))
+    if check_date and last_name:
+        query = query.where(
+            (doctype.creation > check_date)
+            | ((doctype.creation == check_date) & (doctype.name > last_name))
+        )
+    elif check_date:
+        query = query.where(doctype.creation > check_date)
+    query = (
+        query.orderby(doctype.creation, order=Order.asc)
+        .orderby(doctype.name, order=Order.asc)
+        .limit(limit)
+    )
+    return query
+
+
+def _pending_condition(doctype: DocType):
+    batch_status = ["Ready For Batch", "Resend", "Corrected"]
+    return (doctype.integration_status.isin(batch_status)) & (doctype.docstatus == 0)
+
+
+def _join_invoices(query: QueryBuilder, doctype: DocType) -> QueryBuilder:
+    for invoice_doctype in INVOICE_DOCTYPES:
+        invoice = DocType(invoice_doctype)
+        query = query.left_join(invoice).on(
+            (invoice.name == doctype.sales_invoice) & (doctype.invoice_doctype == invoice_doctype)
+        )
     return query
+
+
+def _get_company_field(doctype: DocType):
+    return Coalesce(*[DocType(invoice_doctype).company for invoice_doctype in INVOICE_DOCTYPES])
@@ -0,0 +1,76 @@
+"""
+Benchmark for loading Sales Invoice Additional Fields in bulk, with and without deferring the large text columns
+([DEFERRED_FIELDS]). Run it with:
+
+    bench --site <site> execute ksa_compliance.benchmarks.siaf_loading.run --kwargs "{'documents': 500}"
+
+It loads the [documents] most recent additional fields the way the sync job and multi-document printing do, and
+prints the bytes read from the large columns, the peak Python memory and the average time per document. It only
+reads data.
+"""
+
+import time
+import tracemalloc
+
+import frappe
+
+from ksa_compliance.background_jobs import load_additional_fields
+from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
+    DEFERRED_FIELDS,
+)
+
+
+def run(documents: int = 500, repeat: int = 5) -> dict:
+    names = frappe.get_all(
+        "Sales Invoice Additional Fields",
+        order_by="creation desc",
+        limit=documents,
+        pluck="name",
+    )
+    if not names:
+        print("No Sales Invoice Additional Fields to load")
+        return {}
+
+    large_columns = " + ".join(f"IFNULL(LENGTH({column}), 0)" for column in DEFERRED_FIELDS)
+    large_bytes = frappe.db.sql(
+        f"SELECT SUM({large_columns}) FROM `tabSales Invoice Additional Fields` WHERE name IN %(names)s",
+        {"names": names},
+    )[0][0]
+
+    results = {}
+    for label, defer in (("eager", False), ("deferred", True)):
+        measurement = _measure(names, defer, repeat)
+        measurement["large_column_bytes"] = 0 if defer else int(large_bytes or 0)
+        results[label] = measurement
+
+    print(f"== Loading {len(names)} documents")
+    for label, measurement in results.items():
+        print(
+            f"  {label}: {measurement['ms_per_document']:.3f} ms/document, "
+            f"peak {measurement['peak_bytes_per_document'] / 1024:.1f} KiB/document, "
+            f"{measurement['large_column_bytes'] / len(names) / 1024:.1f} KiB/document read from large columns"
+        )
+    return results
+
+
+def _measure(names: list, defer: bool, repeat: int) -> dict:
+    # Warm up the meta and connection so the first run doesn't skew the timings
+    load_additional_fields(names[:1], defer_large_fields=defer)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        load_additional_fields(names, defer_large_fields=defer)
+    elapsed = (time.perf_counter() - start) * 1000 / repeat
+
+    tracemalloc.start()
+    try:
+        docs = load_additional_fields(names, defer_large_fields=defer)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del docs
+
+    return {
+        "ms_per_document": elapsed / len(names),
+        "peak_bytes_per_document": peak / len(names),
+    }
@@ -0,0 +1,118 @@
+"""
+Benchmark for the hot Sales Invoice Additional Fields queries, with and without the composite indexes added by
+[_2026_10_18_add_siaf_composite_indexes]. Run it with:
+
+    bench --site <site> execute ksa_compliance.benchmarks.siaf_queries.run --kwargs "{'rows': 500000}"
+
+It works on a seeded temporary copy of the table (same columns and single-column indexes), so it never touches real
+data and can run against production-like databases. It prints the query plans and average timings before and after
+adding the indexes. Requires MariaDB (for the sequence engine used to seed rows).
+"""
+
+import time
+from typing import List
+
+import frappe
+
+from ksa_compliance.patches._2026_10_18_add_siaf_composite_indexes import INDEXES
+
+_TABLE = "lava_bench_siaf"
+
+_QUERIES = {
+    "sync page": (
+        f"SELECT name, creation FROM {_TABLE} "
+        "WHERE integration_status IN ('Ready For Batch', 'Resend', 'Corrected') AND docstatus = 0 "
+        "ORDER BY creation, name LIMIT 100"
+    ),
+    "sync next page": (
+        f"SELECT name, creation FROM {_TABLE} "
+        "WHERE integration_status IN ('Ready For Batch', 'Resend', 'Corrected') AND docstatus = 0 "
+        "AND (creation > %(creation)s OR (creation = %(creation)s AND name > %(name)s)) "
+        "ORDER BY creation, name LIMIT 100"
+    ),
+    "latest for invoice": (
+        f"SELECT name FROM {_TABLE} WHERE sales_invoice = %(sales_invoice)s AND is_latest = 1"
+    ),
+    "last doc for invoice": (
+        f"SELECT name FROM {_TABLE} WHERE sales_invoice = %(sales_invoice)s "
+        "ORDER BY creation DESC LIMIT 1"
+    ),
+    "clear latest on insert": (
+        f"UPDATE {_TABLE} SET is_latest = 0 WHERE sales_invoice = %(sales_invoice)s"
+    ),
+}
+
+
+def run(rows: int = 200_000, pending_every: int = 100, repeat: int = 20) -> dict:
+    """
+    Seeds [rows] rows, one in every [pending_every] pending sync, and every invoice with two additional fields (the
+    older one not latest). Runs each query [repeat] times before and after adding the indexes.
+    """
+    frappe.db.sql_ddl(f"DROP TEMPORARY TABLE IF EXISTS {_TABLE}")
+    frappe.db.sql_ddl(f"CREATE TEMPORARY TABLE {_TABLE} LIKE `tabSales Invoice Additional Fields`")
+    for index_name, _ in INDEXES:
+        frappe.db.sql_ddl(f"DROP INDEX IF EXISTS {index_name} ON {_TABLE}")
+
+    # Creation advances every 10 rows, so page boundaries regularly fall between rows with the same timestamp
+    frappe.db.sql(
+        f"INSERT INTO {_TABLE} "
+        "(name, creation, modified, docstatus, integration_status, sales_invoice, invoice_doctype, is_latest) "
+        "SELECT CONCAT('BENCH-SIAF-', seq), "
+        "       TIMESTAMP('2024-01-01') + INTERVAL (seq DIV 10) SECOND, "
+        "       TIMESTAMP('2024-01-01') + INTERVAL (seq DIV 10) SECOND, "
+        f"      IF(seq % {int(pending_every)} = 0, 0, 1), "
+        f"      IF(seq % {int(pending_every)} = 0, 'Ready For Batch', 'Accepted'), "
+        "       CONCAT('BENCH-SINV-', seq DIV 2), 'Sales Invoice', seq % 2 "
+        f"FROM seq_1_to_{int(rows)}"
+    )
+    frappe.db.sql(f"ANALYZE TABLE {_TABLE}")
+
+    middle = frappe.db.sql(
+        f"SELECT name, creation FROM {_TABLE} WHERE docstatus = 0 ORDER BY creation, name "
+        "LIMIT 1 OFFSET %(offset)s",
+        {"offset": rows // pending_every // 2},
+        as_dict=True,
+    )[0]
+    params = {
+        "creation": middle.creation,
+        "name": middle.name,
+        "sales_invoice": f"BENCH-SINV-{rows // 4}",
+    }
+
+    try:
+        before = _measure(params, repeat)
+        for index_name, columns in INDEXES:
+            frappe.db.sql_ddl(f"CREATE INDEX {index_name} ON {_TABLE} ({columns})")
+        frappe.db.sql(f"ANALYZE TABLE {_TABLE}")
+        after = _measure(params, repeat)
+    finally:
+        frappe.db.sql_ddl(f"DROP TEMPORARY TABLE IF EXISTS {_TABLE}")
+        frappe.db.rollback()
+
+    results = {label: {"before": before[label], "after": after[label]} for label in _QUERIES}
+    for label, phases in results.items():
+        print(f"== {label}")
+        for phase, measurement in phases.items():
+            print(f"  {phase}: {measurement['ms']:.3f} ms")
+            for line in measurement["plan"]:
+                print(f"    {line}")
+    return results
+
+
+def _measure(params: dict, repeat: int) -> dict:
+    results = {}
+    for label, query in _QUERIES.items():
+        plan = frappe.db.sql(f"EXPLAIN {query}", params, as_dict=True)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            frappe.db.sql(query, params)
+        elapsed = (time.perf_counter() - start) * 1000 / repeat
+        results[label] = {"ms": elapsed, "plan": _format_plan(plan)}
+    return results
+
+
+def _format_plan(plan: List[dict]) -> List[str]:
+    return [
+        f"type={row.get('type')} key={row.get('key')} rows={row.get('rows')} extra={row.get('Extra')}"
+        for row in plan
+    ]
@@ -0,0 +1,52 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("rebuild-zatca-status-rollup")
+@click.option("--company", help="Only rebuild the totals of this company")
+@pass_context
+def rebuild_zatca_status_rollup(context, company=None):
+    """Recompute the ZATCA integration status totals used by the summary report and workspace cards"""
+    from ksa_compliance.ksa_compliance.doctype.zatca_integration_status_rollup.zatca_integration_status_rollup import (
+        rebuild,
+    )
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        rebuild(company)
+        frappe.db.commit()
+    finally:
+        frappe.destroy()
+
+
+@click.command("archive-zatca-records")
+@pass_context
+def archive_zatca_records(context):
+    """Move finalized ZATCA records older than zatca_archive_after_days to the archive, like the daily job does"""
+    from ksa_compliance.ksa_compliance.doctype.zatca_archived_record.zatca_archived_record import (
+        archive_old_records,
+    )
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        archive_old_records()
+    finally:
+        frappe.destroy()
+
+
+@click.command("zatca-cli-worker")
+@click.option("--socket", "socket_path", required=True, help="Unix socket to listen on")
+@click.option("--cli-path", required=True, help="Path of the ZATCA CLI to run commands with")
+def zatca_cli_worker(socket_path, cli_path):
+    """Serve ZATCA CLI commands over a unix socket. Set zatca_cli_daemon_socket to the same path to use it"""
+    from ksa_compliance.zatca_cli_worker import serve
+
+    serve(socket_path, cli_path)
+
+
+commands = [rebuild_zatca_status_rollup, archive_zatca_records, zatca_cli_worker]
@@ -0,0 +1,56 @@
+"""
+Files produced by background exports.
+
+Exports are too large to build in a web request, so jobs write them straight to the site's private files with
+[export_path], then [publish_export] attaches the file as a private File owned by the requesting user (the job runs
+as that user) and sends them a link to it.
+"""
+
+import os
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+import frappe
+
+from ksa_compliance import logger
+
+
+@contextmanager
+def export_path(prefix: str, extension: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yields the (file name, path) of a new private file. The file is deleted if the enclosed block fails, so a failed
+    export doesn't leave a partial file behind
+    """
+    file_name = f"{prefix}-{frappe.generate_hash(length=10)}.{extension}"
+    path = frappe.get_site_path("private", "files", file_name)
+    try:
+        yield file_name, path
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+def publish_export(file_name: str, user: str, message: str):
+    """
+    Attaches an exported file and notifies [user]. [message] is a translated message with a '{0}' placeholder for the
+    link to the file
+    """
+    file = frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": f"/private/files/{file_name}",
+            "is_private": 1,
+        }
+    )
+    file.insert()
+    frappe.db.commit()
+
+    logger.info(f"Exported {file.file_url}")
+    frappe.publish_realtime(
+        "msgprint",
+        message.format(f'<a href="{file.file_url}" target="_blank">{file_name}</a>'),
+        user=user,
+    )
+    return file
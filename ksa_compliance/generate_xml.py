@@ -1,25 +1,40 @@
+import threading
+from typing import Dict
+
 import frappe
 from frappe import get_jenv
+from jinja2 import Environment, Template
+
+_TEMPLATE_PATH = "ksa_compliance/templates/e_invoice.xml"
+_envs: Dict[str, Environment] = {}
+_envs_lock = threading.Lock()
+
+
+def _get_template() -> Template:
+    """
+    Returns the compiled e-invoice template. It's compiled once per site and process in an overlay of the site's
+    frappe environment, so it sees the same filters and globals (e.g. rounded) but gets its own whitespace settings
+    instead of changing the shared environment for everyone else. Sites on the same bench can have different jinja
+    hooks, so each gets its own overlay.
+    """
+    site = frappe.local.site
+    env = _envs.get(site)
+    if env is None:
+        with _envs_lock:
+            env = _envs.get(site)
+            if env is None:
+                env = _envs[site] = get_jenv().overlay(lstrip_blocks=True, trim_blocks=True)
+    return env.get_template(_TEMPLATE_PATH)
 
 
-def generate_xml_file(data: dict):
-    env = get_jenv()
-    lstrip = env.lstrip_blocks
-    trim = env.trim_blocks
-    env.lstrip_blocks = True
-    env.trim_blocks = True
-    try:
-        template = env.get_template("ksa_compliance/templates/e_invoice.xml")
-        return template.render(
-            {
-                "invoice": data.get("invoice"),
-                "seller_details": data.get("seller_details"),
-                "buyer_details": data.get("buyer_details"),
-                "business_settings": data.get("business_settings"),
-                "prepayment_invoices": data.get("prepayment_invoices"),
-                "prepaid_amount": data.get("prepaid_amount"),
-            }
-        )
-    finally:
-        env.lstrip_blocks = lstrip
-        env.trim_blocks = trim
+def generate_xml_file(data: dict) -> str:
+    return _get_template().render(
+        {
+            "invoice": data.get("invoice"),
+            "seller_details": data.get("seller_details"),
+            "buyer_details": data.get("buyer_details"),
+            "business_settings": data.get("business_settings"),
+            "prepayment_invoices": data.get("prepayment_invoices"),
+            "prepaid_amount": data.get("prepaid_amount"),
+        }
+    )
@@ -69,6 +69,7 @@ doctype_js = {
 jinja = {
     "methods": [
         "ksa_compliance.jinja.get_zatca_phase_1_qr_for_invoice",
+        "ksa_compliance.jinja.get_zatca_phase_1_qr_image_src",
         "frappe.utils.data.rounded",
         "ksa_compliance.jinja.get_phase_2_print_format_details",
     ],
@@ -177,6 +178,14 @@ doc_events = {
     },
     "Branch": {
         "validate": "ksa_compliance.standard_doctypes.branch.validate_branch",
+        "on_update": "ksa_compliance.party_identification.clear_party_ids",
+        "after_rename": "ksa_compliance.party_identification.clear_party_ids",
+        "on_trash": "ksa_compliance.party_identification.clear_party_ids",
+    },
+    "Customer": {
+        "on_update": "ksa_compliance.party_identification.clear_party_ids",
+        "after_rename": "ksa_compliance.party_identification.clear_party_ids",
+        "on_trash": "ksa_compliance.party_identification.clear_party_ids",
     },
     "Unreconcile Payment": {
         "validate": "ksa_compliance.standard_doctypes.unreconcile_payment.prevent_un_reconcile_advance_payments",
@@ -184,12 +193,27 @@ doc_events = {
     "GL Entry": {
         "validate": "ksa_compliance.standard_doctypes.gl_entry.set_party_details_on_advance_invoice",
     },
+    "Tax Category": {
+        "on_update": "ksa_compliance.standard_doctypes.tax_category.clear_tax_category_index",
+        "after_rename": "ksa_compliance.standard_doctypes.tax_category.clear_tax_category_index",
+        "on_trash": "ksa_compliance.standard_doctypes.tax_category.clear_tax_category_index",
+    },
+    "Item Tax Template": {
+        "on_update": "ksa_compliance.standard_doctypes.tax_category.clear_tax_category_index",
+        "after_rename": "ksa_compliance.standard_doctypes.tax_category.clear_tax_category_index",
+        "on_trash": "ksa_compliance.standard_doctypes.tax_category.clear_tax_category_index",
+    },
 }
 
 # Scheduled Tasks
 # ---------------
 
-scheduler_events = {"hourly_long": ["ksa_compliance.background_jobs.sync_e_invoices"]}
+scheduler_events = {
+    "hourly_long": ["ksa_compliance.background_jobs.sync_e_invoices"],
+    "daily_long": [
+        "ksa_compliance.ksa_compliance.doctype.zatca_archived_record.zatca_archived_record.archive_old_records"
+    ],
+}
 # "all": [
 # "ksa_compliance.tasks.all"
 # ],
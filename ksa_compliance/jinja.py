@@ -1,11 +1,9 @@
-import base64
 import datetime
+import json
 from base64 import b64encode
-from io import BytesIO
-from typing import Optional, cast
+from typing import Dict, List, Optional, cast
 
 import frappe
-import pyqrcode
 from erpnext.accounts.doctype.journal_entry.journal_entry import JournalEntry
 from erpnext.accounts.doctype.payment_entry.payment_entry import PaymentEntry
 from erpnext.accounts.doctype.pos_invoice.pos_invoice import POSInvoice
@@ -14,6 +12,8 @@ from erpnext.setup.doctype.branch.branch import Branch
 from frappe.utils import flt
 from frappe.utils.data import get_time, getdate
 
+from ksa_compliance import party_identification, qr_image
+from ksa_compliance.background_jobs import load_additional_fields
 from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import (
     ZATCABusinessSettings,
 )
@@ -26,37 +26,71 @@ from ksa_compliance.utils.update_itemised_tax_data import (
 
 
 def get_zatca_phase_1_qr_for_invoice(invoice_name: str) -> str:
+    """Returns the phase 1 QR of an invoice as a base64-encoded PNG"""
     values = get_qr_inputs(invoice_name)
     if values is None:
         return values
     decoded_string = generate_decoded_string(values)
-    return generate_qrcode(decoded_string)
+    return qr_image.get_qr_base64(decoded_string, "png")
 
 
-def get_qr_inputs(invoice_name: str) -> list:
-    invoice_doc: Optional[SalesInvoice] = None
-    if frappe.db.exists("POS Invoice", invoice_name):
-        invoice_doc = cast(POSInvoice, frappe.get_doc("POS Invoice", invoice_name))
-    elif frappe.db.exists("Sales Invoice", invoice_name):
-        invoice_doc = cast(SalesInvoice, frappe.get_doc("Sales Invoice", invoice_name))
-    else:
+def get_zatca_phase_1_qr_image_src(invoice: SalesInvoice | POSInvoice) -> str | None:
+    """
+    Returns the phase 1 QR of [invoice] as an image data URI, in the configured QR image format. Print formats
+    already have the invoice, so it isn't loaded again
+    """
+    values = get_qr_inputs_for_invoice(invoice)
+    if values is None:
         return None
-    seller_name = invoice_doc.company
-    phase_1_name = frappe.get_value("ZATCA Phase 1 Business Settings", {"company": seller_name})
-    if not phase_1_name:
+    return qr_image.get_qr_data_uri(generate_decoded_string(values))
+
+
+def get_qr_inputs(invoice_name: str) -> list:
+    fields = [
+        "name",
+        "company",
+        "posting_date",
+        "posting_time",
+        "grand_total",
+        "total_taxes_and_charges",
+    ]
+    invoice = frappe.db.get_value(
+        "POS Invoice", invoice_name, fields, as_dict=True
+    ) or frappe.db.get_value("Sales Invoice", invoice_name, fields, as_dict=True)
+    if not invoice:
         return None
-    phase_1_settings = frappe.get_doc("ZATCA Phase 1 Business Settings", phase_1_name)
-    if phase_1_settings.status == "Disabled":
+    return get_qr_inputs_for_invoice(invoice)
+
+
+def get_qr_inputs_for_invoice(invoice: SalesInvoice | POSInvoice | dict) -> list:
+    seller_name = invoice.company
+    phase_1_settings = _get_phase_1_settings(seller_name)
+    if not phase_1_settings or phase_1_settings.status == "Disabled":
         return None
     seller_vat_reg_no = phase_1_settings.vat_registration_number
-    time = invoice_doc.posting_time
-    timestamp = format_date(invoice_doc.posting_date, time)
-    grand_total = invoice_doc.grand_total
-    total_vat = invoice_doc.total_taxes_and_charges
+    time = invoice.posting_time
+    timestamp = format_date(invoice.posting_date, time)
+    grand_total = invoice.grand_total
+    total_vat = invoice.total_taxes_and_charges
     # returned values should be ordered based on ZATCA Qr Specifications
     return [seller_name, seller_vat_reg_no, timestamp, grand_total, total_vat]
 
 
+def _get_phase_1_settings(company: str) -> Optional[frappe._dict]:
+    """Phase 1 settings of [company], looked up once per request (e.g. once for a whole bulk print)"""
+    if not hasattr(frappe.local, "zatca_phase_1_settings"):
+        frappe.local.zatca_phase_1_settings = {}
+    cache = frappe.local.zatca_phase_1_settings
+    if company not in cache:
+        cache[company] = frappe.db.get_value(
+            "ZATCA Phase 1 Business Settings",
+            {"company": company},
+            ["vat_registration_number", "status"],
+            as_dict=True,
+        )
+    return cache[company]
+
+
 def generate_decoded_string(values: list) -> str:
     encoded_text = ""
     for tag, value in enumerate(values, 1):
@@ -95,14 +129,7 @@ def format_date(date: str, time: str) -> str:
 
 
 def generate_qrcode(data: str) -> str:
-    if not data:
-        return None
-    qr = pyqrcode.create(data)
-    with BytesIO() as buffer:
-        qr.png(buffer, scale=7)
-        buffer.seek(0)
-        img_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-        return img_str
+    return qr_image.get_qr_base64(data, "png")
 
 
 def get_advance_payment_entry_info(payment_entry, settings):
@@ -130,34 +157,191 @@ def get_advance_payment_entry_info(payment_entry, settings):
 def get_phase_2_print_format_details(
     sales_invoice: SalesInvoice | POSInvoice | PaymentEntry | JournalEntry,
 ) -> dict | None:
-    settings_id = frappe.db.exists(
-        "ZATCA Business Settings",
-        {"company": sales_invoice.company, "enable_zatca_integration": True},
-    )
-    if not settings_id:
+    """
+    Returns what the phase 2 print formats need for [sales_invoice]. When several documents of the same doctype are
+    printed in one request (e.g. printing a selection from the list view), the shared parts of all their contexts are
+    built together on the first call and reused by the rest
+    """
+    contexts = _get_request_print_contexts()
+    key = (sales_invoice.doctype, sales_invoice.name)
+    if key not in contexts:
+        names = _get_requested_names(sales_invoice.doctype)
+        if sales_invoice.name in names:
+            invoices = _get_print_rows(sales_invoice.doctype, names)
+        else:
+            invoices = [sales_invoice]
+        contexts.update(_build_shared_contexts(invoices))
+
+    return _complete_print_context(sales_invoice, contexts.get(key))
+
+
+def build_print_contexts(
+    invoices: List[SalesInvoice | POSInvoice | PaymentEntry | JournalEntry],
+) -> Dict[str, dict | None]:
+    """
+    Builds the phase 2 print contexts of several documents by name, as [get_phase_2_print_format_details] would
+    return them. Settings, branches and party IDs are loaded once per company, branch and party, and the additional
+    fields of all documents are loaded together
+    """
+    shared = _build_shared_contexts(invoices)
+    return {
+        invoice.name: _complete_print_context(invoice, shared.get((invoice.doctype, invoice.name)))
+        for invoice in invoices
+    }
+
+
+def clear_print_contexts() -> None:
+    """
+    Forgets the print contexts built so far. frappe resets them with each request, but a thread that renders one
+    document after another (e.g. a PDF export worker) keeps them until it clears them
+    """
+    frappe.local.zatca_print_contexts = {}
+
+
+def _get_request_print_contexts() -> dict:
+    if not hasattr(frappe.local, "zatca_print_contexts"):
+        frappe.local.zatca_print_contexts = {}
+    return frappe.local.zatca_print_contexts
+
+
+def _get_requested_names(doctype: str) -> List[str]:
+    """Returns the documents of [doctype] that the current request prints together (frappe's download_multi_pdf)"""
+    form_dict = getattr(frappe.local, "form_dict", None) or {}
+    names = form_dict.get("name")
+    if form_dict.get("doctype") != doctype or not names:
+        return []
+    if isinstance(names, str):
+        try:
+            names = json.loads(names)
+        except ValueError:
+            return []
+    return names if isinstance(names, list) else []
+
+
+def _get_print_rows(doctype: str, names: List[str]) -> List[frappe._dict]:
+    meta = frappe.get_meta(doctype)
+    fields = ["name", "company"] + [
+        field for field in ("branch", "customer", "party") if meta.has_field(field)
+    ]
+    rows = frappe.get_all(doctype, filters={"name": ["in", names]}, fields=fields)
+    for row in rows:
+        row.doctype = doctype
+    return rows
+
+
+def _build_shared_contexts(invoices: list) -> Dict[tuple, dict | None]:
+    """
+    Builds the parts of the print contexts of [invoices] that don't need the full documents. [invoices] can be
+    documents or rows with their company, branch and customer (or party)
+    """
+    contexts = {}
+    settings_by_company = {}
+    branches = {}
+    for invoice in invoices:
+        if invoice.company not in settings_by_company:
+            settings_id = frappe.db.exists(
+                "ZATCA Business Settings",
+                {"company": invoice.company, "enable_zatca_integration": True},
+            )
+            settings_by_company[invoice.company] = (
+                cast(
+                    ZATCABusinessSettings,
+                    frappe.get_cached_doc("ZATCA Business Settings", settings_id),
+                )
+                if settings_id
+                else None
+            )
+    invoices = [invoice for invoice in invoices if settings_by_company[invoice.company]]
+    for invoice in invoices:
+        contexts[(invoice.doctype, invoice.name)] = None
+
+    names = [invoice.name for invoice in invoices]
+    siaf_by_invoice = {}
+    if names:
+        siaf_names = frappe.get_all(
+            "Sales Invoice Additional Fields",
+            filters={"sales_invoice": ["in", names], "is_latest": 1},
+            pluck="name",
+        )
+        # Print formats only show the summary fields, so the signed XML and validation messages aren't read
+        for siaf in load_additional_fields(siaf_names, defer_large_fields=True):
+            siaf_by_invoice[siaf.sales_invoice] = siaf
+        invoices_with_advances = set(
+            frappe.get_all(
+                "Sales Invoice Advance",
+                filters={"parent": ["in", names]},
+                pluck="parent",
+                distinct=True,
+            )
+        )
+
+    for invoice in invoices:
+        settings = settings_by_company[invoice.company]
+        branch_doc = None
+        has_branch_address = False
+        branch = invoice.get("branch") if settings.enable_branch_configuration else None
+        if branch:
+            if branch not in branches:
+                branches[branch] = cast(Branch, frappe.get_cached_doc("Branch", branch))
+            branch_doc = branches[branch]
+            has_branch_address = bool(branch_doc.custom_company_address)
+        seller_other_id, seller_other_id_name = party_identification.get_seller_other_id(
+            settings.name, branch
+        )
+
+        customer = (
+            invoice.get("party") if invoice.doctype == "Payment Entry" else invoice.get("customer")
+        )
+        # A journal entry's customer is the party of its advance payment entry, which is resolved with the document
+        buyer_other_id, buyer_other_id_name = (
+            party_identification.get_buyer_other_id(customer)
+            if customer
+            else (None, party_identification.DEFAULT_ID_NAME)
+        )
+        contexts[(invoice.doctype, invoice.name)] = {
+            "settings": settings,
+            "address": {
+                "street": branch_doc.custom_street if has_branch_address else settings.street,
+                "district": (
+                    branch_doc.custom_district if has_branch_address else settings.district
+                ),
+                "city": branch_doc.custom_city if has_branch_address else settings.city,
+                "postal_code": (
+                    branch_doc.custom_postal_code if has_branch_address else settings.postal_code
+                ),
+            },
+            "seller_other_id": seller_other_id,
+            "seller_other_id_name": seller_other_id_name,
+            "buyer_other_id": buyer_other_id,
+            "buyer_other_id_name": buyer_other_id_name,
+            "siaf": siaf_by_invoice.get(invoice.name),
+            "has_advances": invoice.name in invoices_with_advances,
+        }
+    return contexts
+
+
+def _complete_print_context(
+    sales_invoice: SalesInvoice | POSInvoice | PaymentEntry | JournalEntry, shared: dict | None
+) -> dict | None:
+    """Adds the parts of a print context that depend on the full document to its [shared] parts"""
+    if not shared:
         return None
 
-    branch_doc = None
-    has_branch_address = False
-    settings = cast(ZATCABusinessSettings, frappe.get_doc("ZATCA Business Settings", settings_id))
-    if settings.enable_branch_configuration:
-        if sales_invoice.branch:
-            branch_doc = cast(Branch, frappe.get_doc("Branch", sales_invoice.branch))
-            if branch_doc.custom_company_address:
-                has_branch_address = True
-    seller_other_id, seller_other_id_name = get_seller_other_id(sales_invoice, settings)
+    settings = shared["settings"]
+    details = {key: value for key, value in shared.items() if key != "has_advances"}
     advance_payment_entry = None
     net_amount = 0.0
     tax_amount = 0.0
     if sales_invoice.doctype == "Payment Entry":
-        customer = sales_invoice.party
         advance_payment_entry = get_advance_payment_entry_info(sales_invoice, settings)
-        customer_id = sales_invoice.party
+        advance_payment_entry.party = sales_invoice.party
     elif sales_invoice.doctype == "Journal Entry" and sales_invoice.advance_payment_entry:
         payment_entry = frappe.get_doc("Payment Entry", sales_invoice.advance_payment_entry)
-        customer = payment_entry.party
         advance_payment_entry = get_advance_payment_entry_info(payment_entry, settings)
-        customer_id = payment_entry.party
+        advance_payment_entry.party = payment_entry.party
+        details["buyer_other_id"], details["buyer_other_id_name"] = get_buyer_other_id(
+            payment_entry.party
+        )
         net_amount = calculate_net_from_gross_included_in_print_rate(
             sales_invoice.accounts[0].debit_in_account_currency,
             advance_payment_entry.tax_rate,
@@ -166,83 +350,22 @@ def get_phase_2_print_format_details(
             sales_invoice.accounts[0].debit_in_account_currency,
             net_amount,
         )
-    else:
-        customer = sales_invoice.customer
-        customer_id = getattr(sales_invoice, "customer", None)
-    buyer_other_id, buyer_other_id_name = get_buyer_other_id(customer)
-    siaf = frappe.get_last_doc(
-        "Sales Invoice Additional Fields", {"sales_invoice": sales_invoice.name}
+
+    details["prepayment_info"] = (
+        get_prepayment_info(sales_invoice) if shared["has_advances"] else []
     )
-    prepayment_info = get_prepayment_info(sales_invoice)
-    if advance_payment_entry:
-        advance_payment_entry.party = customer_id
-    return {
-        "settings": settings,
-        "address": {
-            "street": branch_doc.custom_street if has_branch_address else settings.street,
-            "district": branch_doc.custom_district if has_branch_address else settings.district,
-            "city": branch_doc.custom_city if has_branch_address else settings.city,
-            "postal_code": (
-                branch_doc.custom_postal_code if has_branch_address else settings.postal_code
-            ),
-        },
-        "seller_other_id": seller_other_id,
-        "seller_other_id_name": seller_other_id_name,
-        "buyer_other_id": buyer_other_id,
-        "buyer_other_id_name": buyer_other_id_name,
-        "siaf": siaf,
-        "prepayment_info": prepayment_info,
-        "advance_payment_entry": advance_payment_entry,
-        "net_amount": net_amount,
-        "tax_amount": tax_amount,
-    }
+    details["advance_payment_entry"] = advance_payment_entry
+    details["net_amount"] = net_amount
+    details["tax_amount"] = tax_amount
+    return details
 
 
 def get_seller_other_id(
     sales_invoice: SalesInvoice | POSInvoice, settings: ZATCABusinessSettings
 ) -> tuple:
-    seller_other_ids = ["CRN", "MOM", "MLS", "700", "SAG", "OTH"]
-    seller_other_id, seller_other_id_name = None, None
-    if settings.enable_branch_configuration:
-        if sales_invoice.branch:
-            seller_other_id = frappe.get_value(
-                "Additional Seller IDs",
-                {"parent": sales_invoice.branch, "type_code": "CRN"},
-                "value",
-            )
-    if not seller_other_id:
-        for other_id in seller_other_ids:
-            seller_other_id = frappe.get_value(
-                "Additional Seller IDs", {"parent": settings.name, "type_code": other_id}, "value"
-            )
-            seller_other_id = (
-                seller_other_id.strip() or None
-                if isinstance(seller_other_id, str)
-                else seller_other_id
-            )
-            if seller_other_id and seller_other_id != "CRN":
-                seller_other_id_name = frappe.get_value(
-                    "Additional Seller IDs",
-                    {"parent": settings.name, "type_code": other_id},
-                    "type_name",
-                )
-                break
-    return seller_other_id, seller_other_id_name or "Commercial Registration Number"
+    branch = sales_invoice.branch if settings.enable_branch_configuration else None
+    return party_identification.get_seller_other_id(settings.name, branch)
 
 
 def get_buyer_other_id(customer: str) -> tuple:
-    buyer_other_ids = ["TIN", "CRN", "MOM", "MLS", "700", "SAG", "NAT", "GCC", "IQA", "PAS", "OTH"]
-    buyer_other_id, buyer_other_id_name = None, None
-    for other_id in buyer_other_ids:
-        buyer_other_id = frappe.get_value(
-            "Additional Buyer IDs", {"parent": customer, "type_code": other_id}, "value"
-        )
-        buyer_other_id = (
-            buyer_other_id.strip() or None if isinstance(buyer_other_id, str) else buyer_other_id
-        )
-        if buyer_other_id and buyer_other_id != "CRN":
-            buyer_other_id_name = frappe.get_value(
-                "Additional Buyer IDs", {"parent": customer, "type_code": other_id}, "type_name"
-            )
-            break
-    return buyer_other_id, buyer_other_id_name or "Commercial Registration Number"
+    return party_identification.get_buyer_other_id(customer)
@@ -2,15 +2,12 @@
 # For license information, please see license.txt
 from __future__ import annotations
 
-import base64
 import html
 import uuid
-from io import BytesIO
-from typing import Literal, Optional, cast
+from typing import Iterable, List, Literal, Optional, Tuple, cast
 
 import frappe
 import frappe.utils.background_jobs
-import pyqrcode
 from erpnext.accounts.doctype.journal_entry.journal_entry import JournalEntry
 from erpnext.accounts.doctype.payment_entry.payment_entry import PaymentEntry
 from erpnext.accounts.doctype.pos_invoice.pos_invoice import POSInvoice
@@ -26,9 +23,12 @@ from frappe.utils.pdf import get_file_data_from_writer
 from pypdf import PdfWriter
 from result import Err, Ok, Result, is_err, is_ok
 
-from ksa_compliance import logger
+from ksa_compliance import logger, qr_image
 from ksa_compliance import zatca_api as api
+from ksa_compliance import zatca_circuit_breaker
 from ksa_compliance import zatca_cli as cli
+from ksa_compliance import zatca_native_signer as native_signer
+from ksa_compliance import zatca_workspace
 from ksa_compliance.generate_xml import generate_xml_file
 from ksa_compliance.invoice import InvoiceMode, InvoiceType, InvoiceTypeCode
 from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import (
@@ -38,9 +38,21 @@ from ksa_compliance.ksa_compliance.doctype.zatca_egs.zatca_egs import ZATCAEGS
 from ksa_compliance.ksa_compliance.doctype.zatca_integration_log.zatca_integration_log import (
     ZATCAIntegrationLog,
 )
+from ksa_compliance.ksa_compliance.doctype.zatca_integration_status_rollup.zatca_integration_status_rollup import (
+    record_status_change,
+)
+from ksa_compliance.ksa_compliance.doctype.zatca_invoice_counting_settings.zatca_invoice_counting_settings import (
+    advance_chain,
+    lock_chain,
+)
 from ksa_compliance.ksa_compliance.doctype.zatca_precomputed_invoice.zatca_precomputed_invoice import (
     ZATCAPrecomputedInvoice,
 )
+from ksa_compliance.ksa_compliance.doctype.zatca_signed_xml.zatca_signed_xml import (
+    load_signed_xml,
+    load_signed_xmls,
+    store_signed_xml,
+)
 from ksa_compliance.output_models.e_invoice_output_model import (
     AdvancePaymentEntry,
     SalesEinvoice,
@@ -52,14 +64,24 @@ from ksa_compliance.zatca_api import (
     ReportOrClearInvoiceResult,
     ZatcaSendMode,
 )
+from ksa_compliance.zatca_async_api import ReportInvoiceRequest, ReportResponse
 from ksa_compliance.zatca_cli import check_pdfa3b_support_or_throw, convert_to_pdf_a3_b
 
 # These are the possible statuses resulting from a submission to ZATCA. Note that this is a subset of
 # [SalesInvoiceAdditionalFields.integration_status]
 ZatcaIntegrationStatus = Literal[
-    "Resend", "Accepted with warnings", "Accepted", "Rejected", "Clearance switched off"
+    "Ready For Batch",
+    "Resend",
+    "Accepted with warnings",
+    "Accepted",
+    "Rejected",
+    "Clearance switched off",
 ]
 
+# Large text columns that are only needed to inspect or resend an invoice. Bulk loads can defer them (see
+# [SalesInvoiceAdditionalFields.defer_fields]) so syncing and printing don't read them for every document
+DEFERRED_FIELDS = ("invoice_xml", "validation_messages", "validation_errors")
+
 
 class SalesInvoiceAdditionalFields(Document):
     # begin: auto-generated types
@@ -139,6 +161,7 @@ class SalesInvoiceAdditionalFields(Document):
         reason_for_charge: DF.Data | None
         reason_for_charge_code: DF.Data | None
         sales_invoice: DF.DynamicLink
+        signed_xml: DF.Link | None
         sum_of_charges: DF.Float
         supply_end_date: DF.Data | None
         tax_currency: DF.Data | None
@@ -162,6 +185,62 @@ class SalesInvoiceAdditionalFields(Document):
         doc.sales_invoice = invoice_id
         return doc
 
+    def defer_fields(self, fieldnames: Iterable[str]) -> None:
+        """
+        Marks [fieldnames] as not loaded. They're read from the database the first time they're accessed, and left
+        out of updates until then, so saving the document doesn't overwrite them
+        """
+        for fieldname in fieldnames:
+            self.__dict__.pop(fieldname, None)
+        self._deferred_fields = set(fieldnames)
+
+    def load_deferred_fields(self) -> None:
+        deferred = self.__dict__.get("_deferred_fields")
+        if not deferred:
+            return
+
+        self._deferred_fields = None
+        # Fields assigned since they were deferred keep their new values
+        missing = [fieldname for fieldname in deferred if fieldname not in self.__dict__]
+        if missing:
+            values = frappe.db.get_value(self.doctype, self.name, missing, as_dict=True) or {}
+            for fieldname in missing:
+                self.__dict__[fieldname] = values.get(fieldname)
+
+    def __getattr__(self, name: str):
+        # Only called for attributes that aren't set, which is how deferred fields look until they're loaded
+        deferred = self.__dict__.get("_deferred_fields")
+        if not deferred or name not in deferred:
+            raise AttributeError(name)
+        self.load_deferred_fields()
+        return self.__dict__.get(name)
+
+    def get(self, key, *args, **kwargs):
+        if isinstance(key, str) and key in (self.__dict__.get("_deferred_fields") or ()):
+            self.load_deferred_fields()
+        return super().get(key, *args, **kwargs)
+
+    def get_valid_dict(self, *args, **kwargs):
+        deferred = self.__dict__.get("_deferred_fields")
+        if not deferred:
+            return super().get_valid_dict(*args, **kwargs)
+
+        # Build the dict without loading the deferred fields, then leave out the ones that are still not loaded, so
+        # updates only write the columns we have
+        self._deferred_fields = None
+        try:
+            values = super().get_valid_dict(*args, **kwargs)
+        finally:
+            self._deferred_fields = deferred
+        for fieldname in deferred:
+            if fieldname not in self.__dict__:
+                values.pop(fieldname, None)
+        return values
+
+    def as_dict(self, *args, **kwargs):
+        self.load_deferred_fields()
+        return super().as_dict(*args, **kwargs)
+
     @property
     def is_compliance_mode(self) -> bool:
         return self.send_mode == ZatcaSendMode.Compliance
@@ -174,7 +253,11 @@ class SalesInvoiceAdditionalFields(Document):
         self.previous_invoice_hash = precomputed_invoice.previous_invoice_hash
         self.invoice_hash = precomputed_invoice.invoice_hash
         self.qr_code = precomputed_invoice.invoice_qr
-        self.invoice_xml = precomputed_invoice.invoice_xml
+        if precomputed_invoice.signed_xml:
+            # Both documents link to the same stored XML
+            self.signed_xml = precomputed_invoice.signed_xml
+        else:
+            self.set_signed_xml(precomputed_invoice.invoice_xml)
 
     def _get_invoice_type(self, settings: ZATCABusinessSettings) -> InvoiceType:
         if settings.invoice_mode == InvoiceMode.Standard:
@@ -193,6 +276,16 @@ class SalesInvoiceAdditionalFields(Document):
     def before_insert(self):
         self.integration_status = "Ready For Batch"
         self.is_latest = True
+        # The rollup moves the invoice away from the status of the record we replace, if any
+        previous = frappe.db.get_value(
+            "Sales Invoice Additional Fields",
+            {"sales_invoice": self.sales_invoice, "is_latest": 1},
+            "integration_status",
+            as_dict=True,
+        )
+        self.flags.previous_integration_status = (
+            (previous.integration_status or "") if previous else None
+        )
         # Mark any pre-existing sales invoice additional fields as no longer being latest
         frappe.db.set_value(
             "Sales Invoice Additional Fields",
@@ -230,19 +323,29 @@ class SalesInvoiceAdditionalFields(Document):
         if settings.enable_branch_configuration:
             self._set_branch_details(sales_invoice)
 
-        self._prepare_for_zatca(settings)
+        # Signing and validation exchange files with ZATCA CLI, which are removed once the invoice is prepared
+        with zatca_workspace.scope():
+            self._prepare_for_zatca(settings)
+
+    def on_update(self):
+        # Keep the integration status rollup in step, in the same transaction as the status change
+        previous = self.get_doc_before_save()
+        if previous is None:
+            old_status = self.flags.previous_integration_status
+        elif self.is_latest:
+            old_status = previous.integration_status or ""
+        else:
+            return
+        record_status_change(
+            self.invoice_doctype, self.sales_invoice, old_status, self.integration_status or ""
+        )
 
     def _prepare_for_zatca(self, settings: ZATCABusinessSettings):
         invoice_type = self._get_invoice_type(settings)
-        counting_settings_id, pre_invoice_counter, pre_invoice_hash = frappe.db.get_values(
-            "ZATCA Invoice Counting Settings",
-            {"business_settings_reference": settings.name},
-            ["name", "invoice_counter", "previous_invoice_hash"],
-            for_update=True,
-        )[0]
-
-        self.invoice_counter = pre_invoice_counter + 1
-        self.previous_invoice_hash = pre_invoice_hash
+
+        # Everything that doesn't depend on the invoice hash chain (counter and previous hash) is prepared before
+        # locking the chain. Concurrent submissions for the same business settings wait on the lock, so we keep the
+        # locked section down to rendering and signing
         if self.invoice_doctype in ("Payment Entry", "Journal Entry"):
             einvoice = AdvancePaymentEntry(
                 sales_invoice_additional_fields_doc=self, invoice_type=invoice_type
@@ -255,20 +358,41 @@ class SalesInvoiceAdditionalFields(Document):
         cert_path = (
             settings.compliance_cert_path if self.is_compliance_mode else settings.cert_path
         )
+
+        chain = lock_chain(settings.name)
+        self.invoice_counter = chain.next_counter
+        self.previous_invoice_hash = chain.previous_invoice_hash
+        einvoice.set_chain_position(self.invoice_counter, self.previous_invoice_hash)
         invoice_xml = generate_xml_file(einvoice.result)
-        result = cli.sign_invoice(
-            settings.zatca_cli_path,
-            settings.java_home,
-            invoice_xml,
-            cert_path,
-            settings.private_key_path,
-        )
+        if settings.is_native_signing:
+            try:
+                result = native_signer.sign_invoice(
+                    invoice_xml, cert_path, settings.private_key_path
+                )
+            except native_signer.QrFieldTooLong as e:
+                frappe.throw(
+                    title=ft("ZATCA QR Code Error"),
+                    msg=ft(
+                        "The $field in the QR code is $length bytes long, but ZATCA allows at most $max bytes",
+                        field=ft(e.field),
+                        length=e.length,
+                        max=native_signer.MAX_TLV_VALUE_LENGTH,
+                    ),
+                )
+        else:
+            result = cli.sign_invoice(
+                settings.zatca_cli_path,
+                settings.java_home,
+                invoice_xml,
+                cert_path,
+                settings.private_key_path,
+            )
 
         if settings.validate_generated_xml and not self.is_compliance_mode:
             validation_result = cli.validate_invoice(
                 settings.zatca_cli_path,
                 settings.java_home,
-                result.signed_invoice_path,
+                result.get_signed_invoice_path(),
                 settings.cert_path,
                 self.previous_invoice_hash,
             )
@@ -320,21 +444,24 @@ class SalesInvoiceAdditionalFields(Document):
 
         self.invoice_hash = result.invoice_hash
         self.qr_code = result.qr_code
-        self.invoice_xml = result.signed_invoice_xml
+        self.set_signed_xml(result.signed_invoice_xml)
 
-        # To update counting settings data
-        logger.info(
-            f"Changing invoice counter, hash from: {pre_invoice_counter}, {pre_invoice_hash} -> "
-            f"{self.invoice_counter}, {self.invoice_hash}"
-        )
-        frappe.db.set_value(
-            "ZATCA Invoice Counting Settings",
-            counting_settings_id,
-            {"invoice_counter": self.invoice_counter, "previous_invoice_hash": self.invoice_hash},
-        )
+        advance_chain(chain, self.invoice_hash)
 
-    def submit_to_zatca(self) -> Result[str, str]:
-        settings = ZATCABusinessSettings.for_invoice(self.sales_invoice, self.invoice_doctype)
+    def submit_to_zatca(
+        self,
+        response: Optional[ReportResponse] = None,
+        settings: Optional[ZATCABusinessSettings] = None,
+        egs: Optional[ZATCAEGS] = None,
+    ) -> Result[str, str]:
+        """
+        Sends the invoice to ZATCA and records the outcome. [response] can carry the result of reporting this invoice
+        through [zatca_async_api.report_invoices], in which case it's recorded without calling ZATCA again. Batch
+        callers can pass the [settings] and precomputed invoice [egs] they already loaded.
+        """
+        settings = settings or ZATCABusinessSettings.for_invoice(
+            self.sales_invoice, self.invoice_doctype
+        )
         if not settings:
             return Err(f"Missing ZATCA business settings for sales invoice: {self.sales_invoice}")
 
@@ -343,33 +470,33 @@ class SalesInvoiceAdditionalFields(Document):
         if not signed_xml:
             return Err(_("Could not find signed XML"))
 
-        if self.precomputed_invoice:
-            device_id = frappe.db.get_value(
-                "ZATCA Precomputed Invoice", self.precomputed_invoice, "device_id"
-            )
-            egs = ZATCAEGS.for_device(device_id)
-            if not egs:
-                return Err(f"Could not find a ZATCA EGS for device '{device_id}'")
-
-            token = egs.production_security_token
-            secret = egs.get_password("production_secret") if egs.production_secret else ""
-        else:
-            token = (
-                settings.security_token
-                if self.is_compliance_mode
-                else settings.production_security_token
-            )
-            secret = settings.get_password(
-                "secret" if self.is_compliance_mode else "production_secret"
-            )
-
-        if not token or not secret:
-            return Err(f"Missing ZATCA token/secret for {self.name}")
+        credentials = self._get_credentials(settings, egs)
+        if is_err(credentials):
+            return credentials
 
+        token, secret = credentials.ok_value
+        previous_status = self.integration_status
         integration_status = self._send_xml_via_api(
-            signed_xml, self.invoice_hash, invoice_type, settings.fatoora_server_url, token, secret
+            signed_xml,
+            self.invoice_hash,
+            invoice_type,
+            settings.fatoora_server_url,
+            token,
+            secret,
+            response,
         )
 
+        # ZATCA is unreachable and nothing was sent. The record stays a draft for the batch sync, which sends it once
+        # the gateway recovers
+        if integration_status == "Ready For Batch":
+            if previous_status != integration_status:
+                self.save()
+            return Ok(
+                _(
+                    "ZATCA is unreachable. The invoice will be sent by the batch sync once it recovers"
+                )
+            )
+
         # Regardless of what happened, save the side effects of the API call
         self.save()
 
@@ -385,6 +512,66 @@ class SalesInvoiceAdditionalFields(Document):
 
         return Ok(f"Invoice sent to ZATCA. Integration status: {integration_status}")
 
+    def get_report_request(
+        self,
+        settings: Optional[ZATCABusinessSettings] = None,
+        egs: Optional[ZATCAEGS] = None,
+    ) -> Optional[Tuple[str, ReportInvoiceRequest]]:
+        """
+        Returns the server URL and request for reporting this invoice through [zatca_async_api.report_invoices], or
+        None if it's not a simplified invoice or can't be sent (which [submit_to_zatca] reports properly)
+        """
+        settings = settings or ZATCABusinessSettings.for_invoice(
+            self.sales_invoice, self.invoice_doctype
+        )
+        if not settings or self._get_invoice_type(settings) != "Simplified":
+            return None
+
+        signed_xml = self.get_signed_xml()
+        credentials = self._get_credentials(settings, egs)
+        if not signed_xml or is_err(credentials):
+            return None
+
+        token, secret = credentials.ok_value
+        request = ReportInvoiceRequest(
+            invoice_xml=signed_xml,
+            invoice_uuid=self.uuid,
+            invoice_hash=self.invoice_hash,
+            security_token=token,
+            secret=secret,
+            mode=self.send_mode,
+        )
+        return settings.fatoora_server_url, request
+
+    def _get_credentials(
+        self, settings: ZATCABusinessSettings, egs: Optional[ZATCAEGS] = None
+    ) -> Result[Tuple[str, str], str]:
+        if self.precomputed_invoice:
+            if not egs:
+                device_id = frappe.db.get_value(
+                    "ZATCA Precomputed Invoice", self.precomputed_invoice, "device_id"
+                )
+                egs = ZATCAEGS.for_device(device_id)
+                if not egs:
+                    return Err(f"Could not find a ZATCA EGS for device '{device_id}'")
+
+            token = egs.production_security_token
+            secret = egs.get_password("production_secret") if egs.production_secret else ""
+        else:
+            token = (
+                settings.security_token
+                if self.is_compliance_mode
+                else settings.production_security_token
+            )
+            secret = settings.get_password(
+                "secret" if self.is_compliance_mode else "production_secret"
+            )
+
+        if not token or not secret:
+            return Err(f"Missing ZATCA token/secret for {self.name}")
+
+        return Ok((token, secret))
+
     def _get_invoice_type_code(
         self, invoice_doc: SalesInvoice | POSInvoice | JournalEntry
     ) -> InvoiceTypeCode | str:
@@ -473,8 +660,11 @@ class SalesInvoiceAdditionalFields(Document):
         server_url: str,
         token: str,
         secret: str,
+        response: Optional[ReportResponse] = None,
     ) -> ZatcaIntegrationStatus:
-        if invoice_type == "Standard":
+        if response:
+            result, status_code = response
+        elif invoice_type == "Standard":
             result, status_code = api.clear_invoice(
                 server=server_url,
                 invoice_xml=invoice_xml,
@@ -496,6 +686,12 @@ class SalesInvoiceAdditionalFields(Document):
             )
 
         status = ""
+        self.flags.zatca_status_code = status_code
+        if status_code == zatca_circuit_breaker.STATUS_CODE:
+            # Nothing was sent, so there's no attempt to log
+            self.integration_status = "Ready For Batch"
+            return self.integration_status
+
         integration_status = _get_integration_status(status_code)
         if is_err(result):
             # The IDE gets confused resolving types, so we help it along
@@ -520,38 +716,26 @@ class SalesInvoiceAdditionalFields(Document):
                 total = total + item.tax_amount
         return total
 
-    def get_signed_xml(self) -> str | None:
-        # We leave the attachment logic below intact for backward compatibility. Sales Invoice Additional Fields created
-        # before adding the XML field will have the XML as an attachment instead. We may create a patch to migrate them
-        # later
-        if self.invoice_xml:
-            return self.invoice_xml
+    def set_signed_xml(self, xml: Optional[str]) -> None:
+        """Stores [xml] compressed in ZATCA Signed XML and links to it, instead of keeping it in the invoice_xml field"""
+        self.signed_xml = store_signed_xml(xml) if xml else None
+        self.invoice_xml = None
 
-        attachments = frappe.get_all(
-            "File",
-            fields=("name", "file_name", "attached_to_name", "file_url"),
-            filters={
-                "attached_to_name": self.name,
-                "attached_to_doctype": "Sales Invoice Additional Fields",
-            },
-        )
-        if not attachments:
-            return None
+    def get_signed_xml(self) -> str | None:
+        # XML read by [prefetch_signed_xmls] is used as long as the document still links to the same one
+        prefetched = getattr(self, "_prefetched_signed_xml", None)
+        if prefetched and prefetched[0] == self.signed_xml:
+            return prefetched[1]
 
-        name: str | None = None
-        for attachment in attachments:
-            if attachment.file_name and attachment.file_name.endswith(".xml"):
-                name = attachment.name
-                break
+        # Documents created before the XML was moved to ZATCA Signed XML keep it in the invoice_xml field until
+        # the migration patch moves it. Those created before the XML field was added have it as an attachment
+        if self.signed_xml:
+            return load_signed_xml(self.signed_xml)
 
-        if not name:
-            return None
+        if self.invoice_xml:
+            return self.invoice_xml
 
-        file = cast(File, frappe.get_doc("File", name))
-        content = file.get_content()
-        if isinstance(content, str):
-            return content
-        return content.decode("utf-8")
+        return get_attached_signed_xmls([self.name]).get(self.name)
 
     def _add_integration_log_document(self, zatca_message, integration_status, zatca_status):
         integration_doc = cast(
@@ -586,13 +770,7 @@ class SalesInvoiceAdditionalFields(Document):
 
     @property
     def qr_image_src(self) -> str | None:
-        if not self.qr_code:
-            return None
-        qr = pyqrcode.create(self.qr_code)
-        with BytesIO() as buffer:
-            qr.png(buffer, scale=7)
-            buffer.seek(0)
-            return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+        return qr_image.get_qr_data_uri(self.qr_code)
 
     def before_cancel(self) -> None:
         frappe.throw(
@@ -601,6 +779,20 @@ class SalesInvoiceAdditionalFields(Document):
         )
 
 
+def get_additional_fields_values(id: str, fields: List[str]) -> frappe._dict:
+    """
+    Reads [fields] of a Sales Invoice Additional Fields, for callers that don't need the whole document. Throws if it
+    doesn't exist, like frappe.get_doc
+    """
+    values = frappe.db.get_value("Sales Invoice Additional Fields", id, fields, as_dict=True)
+    if not values:
+        frappe.throw(
+            _("{0} {1} not found").format(_("Sales Invoice Additional Fields"), id),
+            frappe.DoesNotExistError,
+        )
+    return values
+
+
 @frappe.whitelist()
 def download_xml(id: str):
     """
@@ -625,8 +817,8 @@ def fix_rejection(id: str):
     if not frappe.permissions.has_permission("Sales Invoice Additional Fields"):
         raise PermissionError()
 
-    siaf = cast(
-        SalesInvoiceAdditionalFields, frappe.get_doc("Sales Invoice Additional Fields", id)
+    siaf = get_additional_fields_values(
+        id, ["sales_invoice", "invoice_doctype", "precomputed_invoice", "is_latest"]
     )
     if siaf.precomputed_invoice:
         frappe.throw(ft("Cannot fix rejection for a precomputed invoice from Desk"))
@@ -667,6 +859,64 @@ def fix_rejection(id: str):
     )
 
 
+def prefetch_signed_xmls(docs: Iterable[SalesInvoiceAdditionalFields]) -> None:
+    """
+    Reads the signed XML of all [docs] together, so that their [get_signed_xml] doesn't query for it: one query for
+    the XMLs in ZATCA Signed XML, and for older documents, one for those kept inline and one for attachments
+    """
+    docs = list(docs)
+    stored = load_signed_xmls(doc.signed_xml for doc in docs)
+    legacy = [doc.name for doc in docs if not doc.signed_xml]
+    inline = {}
+    if legacy:
+        inline = {
+            row.name: row.invoice_xml
+            for row in frappe.get_all(
+                "Sales Invoice Additional Fields",
+                filters={"name": ["in", legacy]},
+                fields=["name", "invoice_xml"],
+            )
+            if row.invoice_xml
+        }
+    attached = get_attached_signed_xmls([name for name in legacy if name not in inline])
+
+    for doc in docs:
+        if doc.signed_xml:
+            xml = stored.get(doc.signed_xml)
+        else:
+            xml = inline.get(doc.name) or attached.get(doc.name)
+        doc._prefetched_signed_xml = (doc.signed_xml, xml)
+
+
+def get_attached_signed_xmls(names: list[str]) -> dict[str, str]:
+    """
+    Returns the signed XML of each of the Sales Invoice Additional Fields [names] that has it as an attachment, which
+    is where it was kept before the XML field was added. Attachments are looked up in one query for all [names]
+    """
+    if not names:
+        return {}
+
+    attachments = frappe.get_all(
+        "File",
+        fields=("name", "file_name", "attached_to_name"),
+        filters={
+            "attached_to_name": ["in", names],
+            "attached_to_doctype": "Sales Invoice Additional Fields",
+        },
+    )
+    file_ids = {}
+    for attachment in attachments:
+        if attachment.file_name and attachment.file_name.endswith(".xml"):
+            file_ids.setdefault(attachment.attached_to_name, attachment.name)
+
+    xmls = {}
+    for siaf_id, file_id in file_ids.items():
+        file = cast(File, frappe.get_doc("File", file_id))
+        content = file.get_content()
+        xmls[siaf_id] = content if isinstance(content, str) else content.decode("utf-8")
+    return xmls
+
+
 def _get_integration_status(code: int) -> ZatcaIntegrationStatus:
     status_map = cast(
         dict[int, ZatcaIntegrationStatus],
@@ -698,9 +948,7 @@ def _submit_additional_fields(doc: SalesInvoiceAdditionalFields):
 
 @frappe.whitelist()
 def check_pdf_a3b_support(id: str):
-    siaf = cast(
-        SalesInvoiceAdditionalFields, frappe.get_doc("Sales Invoice Additional Fields", id)
-    )
+    siaf = get_additional_fields_values(id, ["sales_invoice", "invoice_doctype"])
     settings = ZATCABusinessSettings.for_invoice(siaf.sales_invoice, siaf.invoice_doctype)
     check_pdfa3b_support_or_throw(settings.zatca_cli_path, settings.java_home)
 
@@ -712,6 +960,16 @@ def download_zatca_pdf(
     siaf = cast(
         SalesInvoiceAdditionalFields, frappe.get_doc("Sales Invoice Additional Fields", id)
     )
+    pdf_content = render_zatca_pdf(siaf, print_format, lang)
+
+    frappe.response.filename = f"{siaf.sales_invoice}_a3b.pdf"
+    frappe.response.filecontent = pdf_content
+    frappe.response.type = "download"
+    frappe.response.display_content_as = "attachment"
+
+
+def render_zatca_pdf(siaf: SalesInvoiceAdditionalFields, print_format: str, lang: str) -> bytes:
+    """Prints the sales invoice of [siaf] and returns it as a PDF/A-3b with the signed invoice XML embedded"""
     sales_invoice_doc = cast(SalesInvoice, frappe.get_doc("Sales Invoice", siaf.sales_invoice))
     settings = ZATCABusinessSettings.for_invoice(siaf.sales_invoice, siaf.invoice_doctype)
     xml_content = siaf.get_signed_xml()
@@ -734,14 +992,6 @@ def download_zatca_pdf(
         )
     pdf_file = get_file_data_from_writer(pdf_writer)
 
-    zatca_pdf_path = convert_to_pdf_a3_b(
+    return convert_to_pdf_a3_b(
         settings.zatca_cli_path, settings.java_home, siaf.sales_invoice, pdf_file, xml_content
     )
-
-    with open(zatca_pdf_path, "rb") as f:
-        pdf_content = f.read()
-
-    frappe.response.filename = f"{siaf.sales_invoice}_a3b.pdf"
-    frappe.response.filecontent = pdf_content
-    frappe.response.type = "download"
-    frappe.response.display_content_as = "attachment"
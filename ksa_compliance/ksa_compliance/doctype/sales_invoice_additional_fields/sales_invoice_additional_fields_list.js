@@ -0,0 +1,73 @@
+// Copyright (c) 2024, Lavaloon and contributors
+// For license information, please see license.txt
+
+frappe.listview_settings["Sales Invoice Additional Fields"] = {
+    onload: function (listview) {
+        listview.page.add_menu_item(__("Export Signed XMLs"), () => export_signed_xmls());
+    },
+};
+
+function export_signed_xmls() {
+    let fields = [
+        {
+            label: __('Invoice Type'),
+            fieldname: 'invoice_doctype',
+            fieldtype: 'Select',
+            options: 'Sales Invoice\nPOS Invoice\nPayment Entry',
+            default: 'Sales Invoice',
+            reqd: 1,
+        },
+        {
+            label: __('Company'),
+            fieldname: 'company',
+            fieldtype: 'Link',
+            options: 'Company',
+            default: frappe.defaults.get_user_default('Company'),
+        },
+        {
+            label: __('From Date'),
+            fieldname: 'from_date',
+            fieldtype: 'Date',
+            default: frappe.datetime.month_start(),
+            reqd: 1,
+        },
+        {
+            label: __('To Date'),
+            fieldname: 'to_date',
+            fieldtype: 'Date',
+            default: frappe.datetime.get_today(),
+            reqd: 1,
+        },
+        {
+            label: __('Integration Status'),
+            fieldname: 'integration_status',
+            fieldtype: 'Select',
+            options: 'All\nReady For Batch\nResend\nCorrected\nAccepted with warnings\nAccepted\nRejected\nClearance switched off',
+            default: 'All',
+        },
+        {
+            label: __('Latest Only'),
+            fieldname: 'latest_only',
+            fieldtype: 'Check',
+            default: 1,
+            description: __('Skip the documents replaced by a later submission of the same invoice'),
+        },
+        {
+            label: __('Archive Format'),
+            fieldname: 'archive_format',
+            fieldtype: 'Select',
+            options: 'zip\ntar.gz',
+            default: 'zip',
+        },
+    ];
+    frappe.prompt(fields, values => {
+        let {archive_format, ...filters} = values;
+        frappe.call({
+            method: 'ksa_compliance.xml_export.export_signed_xmls',
+            args: {
+                filters: filters,
+                archive_format: archive_format,
+            },
+        });
+    }, __('Export Signed XMLs'));
+}
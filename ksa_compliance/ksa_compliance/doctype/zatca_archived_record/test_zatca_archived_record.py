@@ -0,0 +1,114 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import frappe
+
+from ksa_compliance.ksa_compliance.doctype.zatca_archived_record.zatca_archived_record import (
+    archive_additional_fields_batch,
+    archive_integration_logs_batch,
+    get_archive_name,
+    get_archived_records,
+)
+from ksa_compliance.ksa_compliance.test.ksa_compliance_test_base import KSAComplianceTestBase
+
+# Records are back-dated before this cutoff, so the tests only archive their own records
+CUTOFF = "2000-01-02 00:00:00"
+
+
+class TestZATCAArchivedRecord(KSAComplianceTestBase):
+    def setUp(self):
+        super().setUp()
+        self.sales_invoice = self._create_test_sales_invoice()
+        self.siaf = frappe.get_doc(
+            "Sales Invoice Additional Fields",
+            {"sales_invoice": self.sales_invoice.name, "is_latest": 1},
+        )
+        self.log = frappe.get_doc(
+            {
+                "doctype": "ZATCA Integration Log",
+                "invoice_doctype": "Sales Invoice",
+                "invoice_reference": self.sales_invoice.name,
+                "invoice_additional_fields_reference": self.siaf.name,
+                "zatca_message": '{"validationResults": {"status": "PASS"}}',
+                "status": "Accepted",
+                "zatca_status": "REPORTED",
+            }
+        ).insert(ignore_permissions=True)
+        frappe.db.set_value(
+            "Sales Invoice Additional Fields",
+            self.siaf.name,
+            {"docstatus": 1, "integration_status": "Accepted", "creation": "2000-01-01"},
+            update_modified=False,
+        )
+        frappe.db.set_value(
+            "ZATCA Integration Log",
+            self.log.name,
+            "creation",
+            "2000-01-01 00:00:01",
+            update_modified=False,
+        )
+
+    def test_archives_replaced_additional_fields_with_their_logs(self):
+        frappe.db.set_value(
+            "Sales Invoice Additional Fields",
+            self.siaf.name,
+            "is_latest",
+            0,
+            update_modified=False,
+        )
+
+        self.assertEqual(archive_additional_fields_batch(CUTOFF, 100), 1)
+
+        self.assertFalse(frappe.db.exists("Sales Invoice Additional Fields", self.siaf.name))
+        self.assertFalse(frappe.db.exists("ZATCA Integration Log", self.log.name))
+
+        by_uuid = get_archived_records(uuid=self.siaf.uuid)
+        self.assertEqual(
+            [(r.record_doctype, r.record_name) for r in by_uuid],
+            [
+                ("Sales Invoice Additional Fields", self.siaf.name),
+                ("ZATCA Integration Log", self.log.name),
+            ],
+        )
+        self.assertEqual(by_uuid[0].record.invoice_hash, self.siaf.invoice_hash)
+        self.assertEqual(by_uuid[1].record.zatca_message, self.log.zatca_message)
+        self.assertEqual(
+            [r.name for r in get_archived_records(invoice_hash=self.siaf.invoice_hash)],
+            [r.name for r in by_uuid],
+        )
+        self.assertEqual(
+            [r.name for r in get_archived_records(invoice_reference=self.sales_invoice.name)],
+            [r.name for r in by_uuid],
+        )
+
+        archived = frappe.get_doc(
+            "ZATCA Archived Record",
+            get_archive_name("Sales Invoice Additional Fields", self.siaf.name),
+        )
+        self.assertEqual(archived.get_signed_xml(), self.siaf.get_signed_xml())
+
+    def test_keeps_latest_additional_fields_and_archives_their_logs(self):
+        self.assertEqual(archive_additional_fields_batch(CUTOFF, 100), 0)
+        self.assertEqual(archive_integration_logs_batch(CUTOFF, 100), 1)
+
+        self.assertTrue(frappe.db.exists("Sales Invoice Additional Fields", self.siaf.name))
+        self.assertFalse(frappe.db.exists("ZATCA Integration Log", self.log.name))
+        self.assertEqual(
+            [r.record_name for r in get_archived_records(uuid=self.siaf.uuid)], [self.log.name]
+        )
+
+    def test_keeps_logs_of_pending_additional_fields(self):
+        frappe.db.set_value(
+            "Sales Invoice Additional Fields",
+            self.siaf.name,
+            "docstatus",
+            0,
+            update_modified=False,
+        )
+
+        self.assertEqual(archive_integration_logs_batch(CUTOFF, 100), 0)
+        self.assertTrue(frappe.db.exists("ZATCA Integration Log", self.log.name))
+
+    def test_lookup_needs_a_key(self):
+        with self.assertRaises(frappe.ValidationError):
+            get_archived_records()
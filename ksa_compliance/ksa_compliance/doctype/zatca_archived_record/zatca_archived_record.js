@@ -0,0 +1,16 @@
+// Copyright (c) 2024, LavaLoon and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("ZATCA Archived Record", {
+    refresh(frm) {
+        const method = "ksa_compliance.ksa_compliance.doctype.zatca_archived_record.zatca_archived_record";
+        frm.add_custom_button(__("Download Record"), () => {
+            window.open(`/api/method/${method}.download_record?id=${encodeURIComponent(frm.doc.name)}`);
+        });
+        if (frm.doc.record_doctype === "Sales Invoice Additional Fields") {
+            frm.add_custom_button(__("Download XML"), () => {
+                window.open(`/api/method/${method}.download_xml?id=${encodeURIComponent(frm.doc.name)}`);
+            });
+        }
+    },
+});
@@ -0,0 +1,357 @@
+# Copyright (c) 2024, LavaLoon and contributors
+# For license information, please see license.txt
+
+import hashlib
+import json
+from typing import List, Optional
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import add_days, cint, now_datetime
+
+from ksa_compliance import logger
+from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
+    get_attached_signed_xmls,
+)
+from ksa_compliance.ksa_compliance.doctype.zatca_signed_xml.zatca_signed_xml import (
+    COMPRESSION,
+    compress_text,
+    decompress_text,
+    load_signed_xml,
+    store_signed_xml,
+)
+
+SIAF_DOCTYPE = "Sales Invoice Additional Fields"
+LOG_DOCTYPE = "ZATCA Integration Log"
+# The child table of the 'other_buyer_ids' field, which reuses the seller IDs doctype
+_OTHER_BUYER_IDS_DOCTYPE = "Additional Seller IDs"
+
+DEFAULT_BATCH_SIZE = 500
+
+# A run moves at most this many batches of each record type, so the first run on a large site is spread over several
+# days instead of holding a worker for hours
+MAX_BATCHES_PER_RUN = 20
+
+_FIELDS = [
+    "name",
+    "creation",
+    "modified",
+    "owner",
+    "modified_by",
+    "docstatus",
+    "record_doctype",
+    "record_name",
+    "invoice_doctype",
+    "invoice_reference",
+    "additional_fields_reference",
+    "uuid",
+    "invoice_hash",
+    "status",
+    "record_creation",
+    "compression",
+    "original_size",
+    "compressed_size",
+    "payload",
+]
+
+
+class ZATCAArchivedRecord(Document):
+    # begin: auto-generated types
+    # This code is auto-generated. Do not modify anything in this block.
+
+    from typing import TYPE_CHECKING
+
+    if TYPE_CHECKING:
+        from frappe.types import DF
+
+        additional_fields_reference: DF.Data | None
+        compressed_size: DF.Int
+        compression: DF.Data | None
+        invoice_doctype: DF.Literal[
+            "Sales Invoice", "POS Invoice", "Payment Entry", "Journal Entry"
+        ]
+        invoice_hash: DF.Data | None
+        invoice_reference: DF.DynamicLink | None
+        original_size: DF.Int
+        payload: DF.LongText | None
+        record_creation: DF.Datetime | None
+        record_doctype: DF.Literal["Sales Invoice Additional Fields", "ZATCA Integration Log"]
+        record_name: DF.Data | None
+        status: DF.Data | None
+        uuid: DF.Data | None
+    # end: auto-generated types
+
+    def get_record(self) -> frappe._dict:
+        """Returns the fields of the archived record as they were in its table, with its child tables"""
+        return load_payload(self.compression, self.payload)
+
+    def get_signed_xml(self) -> Optional[str]:
+        if self.record_doctype != SIAF_DOCTYPE:
+            return None
+        return load_signed_xml(self.get_record().signed_xml)
+
+
+def get_archive_name(record_doctype: str, record_name: str) -> str:
+    """Archived records are named after the record they hold, so a record can be found without knowing its invoice"""
+    key = f"{record_doctype}|{record_name}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def load_payload(compression: str, payload: str) -> frappe._dict:
+    return frappe._dict(json.loads(decompress_text(compression, payload)))
+
+
+def get_archived_records(
+    invoice_reference: Optional[str] = None,
+    uuid: Optional[str] = None,
+    invoice_hash: Optional[str] = None,
+) -> List[frappe._dict]:
+    """
+    Returns the archived records of an invoice, a UUID or an invoice hash, oldest first. Each has the fields it had in
+    its table under [record]
+    """
+    filters = {
+        field: value
+        for field, value in (
+            ("invoice_reference", invoice_reference),
+            ("uuid", uuid),
+            ("invoice_hash", invoice_hash),
+        )
+        if value
+    }
+    if not filters:
+        frappe.throw(_("Pass an invoice, a UUID or an invoice hash to look up archived records"))
+
+    rows = frappe.get_all(
+        "ZATCA Archived Record",
+        filters=filters,
+        fields=["name", "record_doctype", "record_name", "compression", "payload"],
+        order_by="record_creation asc, name asc",
+    )
+    return [
+        frappe._dict(
+            name=row.name,
+            record_doctype=row.record_doctype,
+            record_name=row.record_name,
+            record=load_payload(row.compression, row.payload),
+        )
+        for row in rows
+    ]
+
+
+def get_retention_days() -> int:
+    """Archiving is off unless the site config sets [zatca_archive_after_days]"""
+    return cint(frappe.conf.get("zatca_archive_after_days"))
+
+
+def get_batch_size() -> int:
+    return max(1, cint(frappe.conf.get("zatca_archive_batch_size") or DEFAULT_BATCH_SIZE))
+
+
+def archive_old_records() -> None:
+    """
+    Moves finalized records older than the retention window to the archive, committing after each batch so an
+    interrupted run keeps the batches it finished. Runs daily from the scheduler
+    """
+    days = get_retention_days()
+    if days <= 0:
+        return
+
+    cutoff = add_days(now_datetime(), -days)
+    batch_size = get_batch_size()
+    for archive_batch in (archive_additional_fields_batch, archive_integration_logs_batch):
+        archived = 0
+        for _batch in range(MAX_BATCHES_PER_RUN):
+            count = archive_batch(cutoff, batch_size)
+            frappe.db.commit()
+            archived += count
+            if count < batch_size:
+                break
+        logger.info(f"{archive_batch.__name__}: archived {archived} records older than {cutoff}")
+
+
+def archive_additional_fields_batch(cutoff, batch_size: int) -> int:
+    """
+    Archives up to [batch_size] submitted additional fields created before [cutoff] that were replaced by a later
+    record for the same invoice, along with their integration logs. The latest record of each invoice stays, since
+    printing, the reports and the status rollup read it. Returns the number of additional fields archived
+    """
+    rows = frappe.db.sql(
+        f"""
+        SELECT * FROM `tab{SIAF_DOCTYPE}`
+        WHERE docstatus = 1 AND is_latest = 0 AND creation < %(cutoff)s
+        ORDER BY creation, name
+        LIMIT %(limit)s
+        """,
+        {"cutoff": cutoff, "limit": batch_size},
+        as_dict=True,
+    )
+    if not rows:
+        return 0
+
+    names = [row.name for row in rows]
+    buyer_ids = {}
+    for buyer_id in frappe.db.sql(
+        f"""
+        SELECT * FROM `tab{_OTHER_BUYER_IDS_DOCTYPE}`
+        WHERE parenttype = %(parenttype)s AND parent IN %(names)s
+        ORDER BY idx
+        """,
+        {"parenttype": SIAF_DOCTYPE, "names": names},
+        as_dict=True,
+    ):
+        buyer_ids.setdefault(buyer_id.parent, []).append(buyer_id)
+
+    _move_xmls_to_storage(rows)
+    logs = frappe.db.sql(
+        f"SELECT * FROM `tab{LOG_DOCTYPE}` WHERE invoice_additional_fields_reference IN %(names)s",
+        {"names": names},
+        as_dict=True,
+    )
+
+    by_name = {row.name: row for row in rows}
+    records = []
+    for row in rows:
+        row.other_buyer_ids = buyer_ids.get(row.name, [])
+        records.append(_get_archive_values(SIAF_DOCTYPE, row, row.sales_invoice, row))
+    for log in logs:
+        records.append(
+            _get_archive_values(
+                LOG_DOCTYPE,
+                log,
+                log.invoice_reference,
+                by_name[log.invoice_additional_fields_reference],
+            )
+        )
+
+    frappe.db.bulk_insert("ZATCA Archived Record", _FIELDS, records, chunk_size=100)
+    # The records are deleted with SQL rather than frappe.delete_doc, so no doc events run. Nothing depends on them:
+    # - Only records with is_latest = 0 are archived. The status rollup only counts latest records, and their on_update
+    #   already skips records that aren't latest, so archiving one doesn't change any totals
+    # - The party ID and tax category caches are keyed by party and tax category, never by these records, and print
+    #   contexts only live for a request
+    # - Neither doctype has delete hooks of its own
+    # It also skips the Deleted Document copy delete_doc would keep, which the archive already is
+    _delete(LOG_DOCTYPE, [log.name for log in logs])
+    frappe.db.sql(
+        f"DELETE FROM `tab{_OTHER_BUYER_IDS_DOCTYPE}` WHERE parenttype = %(parenttype)s AND parent IN %(names)s",
+        {"parenttype": SIAF_DOCTYPE, "names": names},
+    )
+    _delete(SIAF_DOCTYPE, names)
+    return len(rows)
+
+
+def archive_integration_logs_batch(cutoff, batch_size: int) -> int:
+    """
+    Archives up to [batch_size] integration logs created before [cutoff] whose additional fields are submitted, so the
+    invoice is done with ZATCA. Returns the number of logs archived
+    """
+    logs = frappe.db.sql(
+        f"""
+        SELECT log.* FROM `tab{LOG_DOCTYPE}` log
+        JOIN `tab{SIAF_DOCTYPE}` siaf ON siaf.name = log.invoice_additional_fields_reference
+        WHERE log.creation < %(cutoff)s AND siaf.docstatus = 1
+        ORDER BY log.creation, log.name
+        LIMIT %(limit)s
+        """,
+        {"cutoff": cutoff, "limit": batch_size},
+        as_dict=True,
+    )
+    if not logs:
+        return 0
+
+    additional_fields = {
+        row.name: row
+        for row in frappe.get_all(
+            SIAF_DOCTYPE,
+            filters={
+                "name": ["in", list({log.invoice_additional_fields_reference for log in logs})]
+            },
+            fields=["name", "uuid", "invoice_hash"],
+        )
+    }
+    records = [
+        _get_archive_values(
+            LOG_DOCTYPE,
+            log,
+            log.invoice_reference,
+            additional_fields[log.invoice_additional_fields_reference],
+        )
+        for log in logs
+    ]
+    frappe.db.bulk_insert("ZATCA Archived Record", _FIELDS, records, chunk_size=100)
+    _delete(LOG_DOCTYPE, [log.name for log in logs])
+    return len(logs)
+
+
+def _move_xmls_to_storage(rows: List[frappe._dict]) -> None:
+    # The payload keeps the key of the signed XML, which stays in ZATCA Signed XML, rather than a copy of the XML.
+    # Records from before that storage still have it inline or as an attachment, so it's stored for them first
+    attached = get_attached_signed_xmls(
+        [row.name for row in rows if not row.signed_xml and not row.invoice_xml]
+    )
+    for row in rows:
+        xml = row.invoice_xml or attached.get(row.name)
+        if not row.signed_xml and xml:
+            row.signed_xml = store_signed_xml(xml)
+        row.invoice_xml = None
+
+
+def _get_archive_values(
+    record_doctype: str,
+    record: frappe._dict,
+    invoice_reference: str,
+    additional_fields: frappe._dict,
+) -> tuple:
+    payload = frappe.as_json(record, indent=None, separators=(",", ":"))
+    compressed = compress_text(payload)
+    now = now_datetime()
+    return (
+        get_archive_name(record_doctype, record.name),
+        now,
+        now,
+        frappe.session.user,
+        frappe.session.user,
+        0,
+        record_doctype,
+        record.name,
+        record.invoice_doctype,
+        invoice_reference,
+        additional_fields.name,
+        additional_fields.uuid,
+        additional_fields.invoice_hash,
+        record.integration_status if record_doctype == SIAF_DOCTYPE else record.status,
+        record.creation,
+        COMPRESSION,
+        len(payload.encode("utf-8")),
+        len(compressed),
+        compressed,
+    )
+
+
+def _delete(doctype: str, names: List[str]) -> None:
+    if names:
+        frappe.db.sql(f"DELETE FROM `tab{doctype}` WHERE name IN %(names)s", {"names": names})
+
+
+@frappe.whitelist()
+def download_record(id: str):
+    record = frappe.get_doc("ZATCA Archived Record", id)
+    record.check_permission("read")
+
+    frappe.response.filename = f"{record.record_name}.json"
+    frappe.response.filecontent = frappe.as_json(record.get_record())
+    frappe.response.type = "download"
+    frappe.response.display_content_as = "attachment"
+
+
+@frappe.whitelist()
+def download_xml(id: str):
+    record = frappe.get_doc("ZATCA Archived Record", id)
+    record.check_permission("read")
+
+    frappe.response.filename = f"{record.record_name}.xml"
+    frappe.response.filecontent = record.get_signed_xml()
+    frappe.response.type = "download"
+    frappe.response.display_content_as = "attachment"
@@ -29,6 +29,7 @@ import ksa_compliance.zatca_cli as cli
 import ksa_compliance.zatca_files
 from ksa_compliance import logger
 from ksa_compliance.invoice import InvoiceMode
+from ksa_compliance.party_identification import clear_party_ids
 from ksa_compliance.throw import fthrow
 from ksa_compliance.translation import ft
 
@@ -80,6 +81,7 @@ class ZATCABusinessSettings(Document):
         secret: DF.Password | None
         security_token: DF.SmallText | None
         seller_name: DF.Data
+        signing_backend: DF.Literal["ZATCA CLI", "Native"]
         street: DF.Data | None
         sync_with_zatca: DF.Literal["Live", "Batches"]
         tax_rate: DF.Percent
@@ -168,6 +170,13 @@ class ZATCABusinessSettings(Document):
                 title=_("Duplicate Configuration Not Allowed"),
             )
 
+    def on_update(self):
+        clear_request_cache()
+        clear_party_ids(self)
+
+    def after_rename(self, old: str, new: str, merge: bool):
+        clear_party_ids(self, "after_rename", old, new, merge)
+
     def after_insert(self):
         invoice_counting_doc = frappe.new_doc("ZATCA Invoice Counting Settings")
         invoice_counting_doc.business_settings_reference = self.name
@@ -192,6 +201,10 @@ class ZATCABusinessSettings(Document):
     def is_live_sync(self) -> bool:
         return self.sync_with_zatca.lower() == "live"
 
+    @property
+    def is_native_signing(self) -> bool:
+        return self.signing_backend == "Native"
+
     @property
     def invoice_mode(self) -> InvoiceMode:
         return InvoiceMode.from_literal(self.type_of_business_transactions)
@@ -355,50 +368,56 @@ class ZATCABusinessSettings(Document):
     def for_invoice(
         invoice_id: str, doctype: Literal["Sales Invoice", "POS Invoice", "Payment Entry"]
     ) -> Optional["ZATCABusinessSettings"]:
-        company_id = frappe.db.get_value(doctype, invoice_id, ["company"])
+        cache = _get_request_cache()
+        key = ("invoice_company", doctype, invoice_id)
+        company_id = cache.get(key)
         if not company_id:
-            return None
-        invoice = frappe.get_doc(doctype, invoice_id)
-        return ZATCABusinessSettings.for_company(company_id, invoice)
+            company_id = frappe.db.get_value(doctype, invoice_id, ["company"])
+            if not company_id:
+                return None
+            cache[key] = company_id
+        return ZATCABusinessSettings.for_company(company_id)
 
     @staticmethod
     def for_company(company_id: str, invoice=None) -> Optional["ZATCABusinessSettings"]:
         """Retrieves active business settings for a company"""
-        filters = {
-            "company": company_id,
-            "status": "Active",  # Default: only Active for normal invoices
-        }
+        statuses = ["Active"]  # Default: only Active for normal invoices
         # For compliance check tests, allow both Active and Pending Activation
         company_doc = frappe.get_cached_doc("Company", company_id)
         if company_doc.is_perform_compliance_checks:
-            filters["status"] = ["in", ["Active", "Pending Activation"]]
-        business_settings_id = frappe.db.get_value("ZATCA Business Settings", filters=filters)
+            statuses.append("Pending Activation")
+        business_settings_id = next(
+            (row.name for row in _get_company_settings(company_id) if row.status in statuses), None
+        )
 
         if not business_settings_id:
             return None
 
         return cast(
-            ZATCABusinessSettings, frappe.get_doc("ZATCA Business Settings", business_settings_id)
+            ZATCABusinessSettings,
+            frappe.get_cached_doc("ZATCA Business Settings", business_settings_id),
         )
 
     @staticmethod
     def is_withdrawn_for_company(company_id: str) -> bool:
         """Checks if business settings have been withdrawn for a company"""
-        filters = {"company": company_id, "status": "Withdrawn"}
-        business_settings_id = frappe.db.get_value("ZATCA Business Settings", filters=filters)
-        return bool(business_settings_id)
+        return any(row.status == "Withdrawn" for row in _get_company_settings(company_id))
 
     @staticmethod
     def is_enabled_for_company(company_id: str) -> bool:
         """Checks if ZATCA integration is enabled and active for a company"""
-        filters = {"company": company_id, "status": "Active", "enable_zatca_integration": True}
-        return bool(frappe.db.get_value("ZATCA Business Settings", filters=filters))
+        return any(
+            row.status == "Active" and row.enable_zatca_integration
+            for row in _get_company_settings(company_id)
+        )
 
     @staticmethod
     def is_branch_config_enabled(company_id: str) -> bool:
         """Checks if branch configuration is enabled for an active company"""
-        filters = {"company": company_id, "status": "Active", "enable_branch_configuration": True}
-        return bool(frappe.db.get_value("ZATCA Business Settings", filters=filters))
+        return any(
+            row.status == "Active" and row.enable_branch_configuration
+            for row in _get_company_settings(company_id)
+        )
 
     def _generate_csr(self) -> cli.CsrResult:
         config = frappe.render_template(
@@ -567,6 +586,34 @@ def duplicate_configuration(source_name: str, target_doc=None):
     return new_doc
 
 
+def _get_request_cache() -> dict:
+    """
+    Returns the cache for business settings lookups. It lives on frappe.local, so it only lasts for the current request
+    or background job, and settings documents themselves come from the document cache, which frappe clears on save
+    """
+    if not hasattr(frappe.local, "zatca_business_settings_cache"):
+        frappe.local.zatca_business_settings_cache = {}
+    return frappe.local.zatca_business_settings_cache
+
+
+def clear_request_cache() -> None:
+    frappe.local.zatca_business_settings_cache = {}
+
+
+def _get_company_settings(company_id: str) -> list[dict]:
+    """Returns the status and flags of all business settings for a company, newest first"""
+    cache = _get_request_cache()
+    key = ("company_settings", company_id)
+    if key not in cache:
+        cache[key] = frappe.get_all(
+            "ZATCA Business Settings",
+            filters={"company": company_id},
+            fields=["name", "status", "enable_zatca_integration", "enable_branch_configuration"],
+            order_by="creation desc",
+        )
+    return cache[key]
+
+
 @frappe.whitelist()
 def withdraw_settings(settings_id: str, company: str):
     """Withdraws ZATCA integration for a business settings configuration"""
@@ -1,9 +1,28 @@
 # Copyright (c) 2024, Lavaloon and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
 
 class TestZATCAIntegrationLog(FrappeTestCase):
-    pass
+    def _insert_log(self, invoice_reference: str) -> str:
+        log = frappe.get_doc(
+            {
+                "doctype": "ZATCA Integration Log",
+                "invoice_doctype": "Sales Invoice",
+                "invoice_reference": invoice_reference,
+                "invoice_additional_fields_reference": invoice_reference,
+                "status": "Resend",
+            }
+        )
+        log.insert(ignore_permissions=True, ignore_links=True)
+        return log.name
+
+    def test_names_number_attempts_per_invoice(self):
+        invoice_reference = f"TEST-SINV-{frappe.generate_hash(length=8)}"
+        other_reference = f"TEST-SINV-{frappe.generate_hash(length=8)}"
+
+        self.assertEqual(self._insert_log(invoice_reference), f"log-{invoice_reference}-1")
+        self.assertEqual(self._insert_log(other_reference), f"log-{other_reference}-1")
+        self.assertEqual(self._insert_log(invoice_reference), f"log-{invoice_reference}-2")
@@ -1,8 +1,8 @@
 # Copyright (c) 2024, Lavaloon and contributors
 # For license information, please see license.txt
 
-import frappe
 from frappe.model.document import Document
+from frappe.model.naming import getseries
 
 
 class ZATCAIntegrationLog(Document):
@@ -35,9 +35,11 @@ class ZATCAIntegrationLog(Document):
     pass
 
     def autoname(self):
-        count = len(
-            frappe.get_all(
-                self.doctype, {"invoice_reference": self.invoice_reference}, pluck="name"
-            )
-        )
-        self.name = f"log-{self.invoice_reference}-{count + 1}"
+        # The attempt number comes from a per-invoice series rather than counting existing logs, so naming takes the
+        # same time on the 100th retry as on the first, and the series row lock keeps concurrent attempts apart
+        key = get_series_key(self.invoice_reference)
+        self.name = key + getseries(key, 1)
+
+
+def get_series_key(invoice_reference: str) -> str:
+    return f"log-{invoice_reference}-"
@@ -0,0 +1,53 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import frappe
+from frappe.utils import flt
+
+from ksa_compliance.ksa_compliance.doctype.zatca_integration_status_rollup.zatca_integration_status_rollup import (
+    get_rollup_name,
+    rebuild,
+)
+from ksa_compliance.ksa_compliance.test.ksa_compliance_test_base import KSAComplianceTestBase
+from ksa_compliance.test.test_constants import TEST_COMPANY_NAME
+
+
+class TestZATCAIntegrationStatusRollup(KSAComplianceTestBase):
+    def _get_totals(self, status: str) -> tuple[int, float]:
+        name = get_rollup_name(TEST_COMPANY_NAME, frappe.utils.nowdate(), "Sales Invoice", status)
+        row = frappe.db.get_value(
+            "ZATCA Integration Status Rollup", name, ["invoice_count", "grand_total"], as_dict=True
+        )
+        return (row.invoice_count, flt(row.grand_total)) if row else (0, 0.0)
+
+    def test_counts_submitted_invoices_and_status_changes(self):
+        ready_count, ready_total = self._get_totals("Ready For Batch")
+        accepted_count, accepted_total = self._get_totals("Accepted")
+
+        sales_invoice = self._create_test_sales_invoice()
+        self.assertEqual(
+            self._get_totals("Ready For Batch"),
+            (ready_count + 1, ready_total + flt(sales_invoice.grand_total)),
+        )
+
+        siaf = frappe.get_doc(
+            "Sales Invoice Additional Fields",
+            {"sales_invoice": sales_invoice.name, "is_latest": 1},
+        )
+        siaf.integration_status = "Accepted"
+        siaf.save(ignore_permissions=True)
+
+        self.assertEqual(self._get_totals("Ready For Batch"), (ready_count, ready_total))
+        self.assertEqual(
+            self._get_totals("Accepted"),
+            (accepted_count + 1, accepted_total + flt(sales_invoice.grand_total)),
+        )
+
+    def test_rebuild_matches_incremental_totals(self):
+        self._create_test_sales_invoice()
+        self._create_test_sales_invoice()
+        incremental = self._get_totals("Ready For Batch")
+
+        rebuild(TEST_COMPANY_NAME)
+
+        self.assertEqual(self._get_totals("Ready For Batch"), incremental)
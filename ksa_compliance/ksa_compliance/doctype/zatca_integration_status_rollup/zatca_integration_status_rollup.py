@@ -0,0 +1,172 @@
+# Copyright (c) 2024, LavaLoon and contributors
+# For license information, please see license.txt
+
+import hashlib
+from typing import Optional
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import flt, getdate, now_datetime
+
+from ksa_compliance import logger
+
+_TABLE = "`tabZATCA Integration Status Rollup`"
+
+# Invoices without integration status are grouped under this status, like the summary report always did
+NO_STATUS = "N/A"
+
+# Amount columns of each invoice doctype, in (net total, VAT total, grand total) order. Advance payments (Payment Entry
+# and Journal Entry) are only counted
+_AMOUNT_FIELDS = {
+    "Sales Invoice": ("net_total", "total_taxes_and_charges", "grand_total"),
+    "POS Invoice": ("net_total", "total_taxes_and_charges", "grand_total"),
+}
+_INVOICE_DOCTYPES = ["Sales Invoice", "POS Invoice", "Payment Entry", "Journal Entry"]
+
+
+class ZATCAIntegrationStatusRollup(Document):
+    # begin: auto-generated types
+    # This code is auto-generated. Do not modify anything in this block.
+
+    from typing import TYPE_CHECKING
+
+    if TYPE_CHECKING:
+        from frappe.types import DF
+
+        company: DF.Link | None
+        grand_total: DF.Currency
+        integration_status: DF.Data | None
+        invoice_count: DF.Int
+        invoice_doctype: DF.Literal[
+            "Sales Invoice", "POS Invoice", "Payment Entry", "Journal Entry"
+        ]
+        net_total: DF.Currency
+        posting_date: DF.Date | None
+        total_taxes_and_charges: DF.Currency
+    # end: auto-generated types
+
+    pass
+
+
+def get_rollup_name(
+    company: str, posting_date, invoice_doctype: str, integration_status: str
+) -> str:
+    """
+    Rows are named after their key so they can be upserted without looking them up first. [rebuild] computes the same
+    name in SQL, so the two must stay in sync
+    """
+    key = "|".join([company, str(getdate(posting_date)), invoice_doctype, integration_status])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def record_status_change(
+    invoice_doctype: str,
+    invoice_name: str,
+    old_status: Optional[str],
+    new_status: Optional[str],
+) -> None:
+    """
+    Moves an invoice from [old_status] to [new_status] in the rollup. A None status means the invoice wasn't counted
+    before (a first additional fields record) or shouldn't be counted anymore. Runs in the caller's transaction, so
+    the rollup changes exactly when the status change is committed
+    """
+    if old_status == new_status:
+        return
+
+    fields = ["company", "posting_date", "docstatus", *_AMOUNT_FIELDS.get(invoice_doctype, ())]
+    invoice = frappe.db.get_value(invoice_doctype, invoice_name, fields, as_dict=True)
+    if not invoice or invoice.docstatus != 1:
+        return
+
+    amounts = [flt(invoice.get(field)) for field in _AMOUNT_FIELDS.get(invoice_doctype, ())] or [
+        0,
+        0,
+        0,
+    ]
+    changes = []
+    if old_status is not None:
+        changes.append((old_status or NO_STATUS, -1, [-amount for amount in amounts]))
+    if new_status is not None:
+        changes.append((new_status or NO_STATUS, 1, amounts))
+
+    now = now_datetime()
+    values = []
+    for status, count, (net_total, vat_total, grand_total) in changes:
+        name = get_rollup_name(invoice.company, invoice.posting_date, invoice_doctype, status)
+        values.extend(
+            [
+                name,
+                now,
+                now,
+                frappe.session.user,
+                frappe.session.user,
+                invoice.company,
+                invoice.posting_date,
+                invoice_doctype,
+                status,
+                count,
+                net_total,
+                vat_total,
+                grand_total,
+            ]
+        )
+
+    placeholders = ", ".join(
+        ["(%s, %s, %s, %s, %s, 0, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(changes)
+    )
+    frappe.db.sql(
+        f"""
+        INSERT INTO {_TABLE} (name, creation, modified, owner, modified_by, docstatus, company, posting_date,
+            invoice_doctype, integration_status, invoice_count, net_total, total_taxes_and_charges, grand_total)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE
+            invoice_count = invoice_count + VALUES(invoice_count),
+            net_total = net_total + VALUES(net_total),
+            total_taxes_and_charges = total_taxes_and_charges + VALUES(total_taxes_and_charges),
+            grand_total = grand_total + VALUES(grand_total),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """,
+        values,
+    )
+
+
+def rebuild(company: Optional[str] = None) -> None:
+    """
+    Recomputes the rollup from the latest additional fields of each submitted invoice, for [company] or for all
+    companies. The affected rows are replaced within the caller's transaction, so readers see either the old or the
+    new totals once it's committed. Status changes committed while it runs may be missed, so it's best run while the
+    sync job is idle
+    """
+    company_condition = "AND inv.company = %(company)s" if company else ""
+    values = {"company": company, "user": frappe.session.user}
+
+    frappe.db.sql(
+        f"DELETE FROM {_TABLE} {'WHERE company = %(company)s' if company else ''}", values
+    )
+    for invoice_doctype in _INVOICE_DOCTYPES:
+        amount_fields = _AMOUNT_FIELDS.get(invoice_doctype)
+        amounts = (
+            ", ".join(f"SUM(inv.{field})" for field in amount_fields)
+            if amount_fields
+            else "0, 0, 0"
+        )
+        frappe.db.sql(
+            f"""
+            INSERT INTO {_TABLE} (name, creation, modified, owner, modified_by, docstatus, company, posting_date,
+                invoice_doctype, integration_status, invoice_count, net_total, total_taxes_and_charges, grand_total)
+            SELECT SHA1(CONCAT_WS('|', inv.company, inv.posting_date, %(invoice_doctype)s, status)), NOW(), NOW(),
+                %(user)s, %(user)s, 0, inv.company, inv.posting_date, %(invoice_doctype)s, status, COUNT(*), {amounts}
+            FROM (
+                SELECT sales_invoice, IFNULL(integration_status, %(no_status)s) AS status
+                FROM `tabSales Invoice Additional Fields`
+                WHERE is_latest = 1 AND invoice_doctype = %(invoice_doctype)s
+            ) siaf
+            JOIN `tab{invoice_doctype}` inv ON inv.name = siaf.sales_invoice
+            WHERE inv.docstatus = 1 {company_condition}
+            GROUP BY inv.company, inv.posting_date, status
+            """,
+            {**values, "invoice_doctype": invoice_doctype, "no_status": NO_STATUS},
+        )
+
+    logger.info(f"Rebuilt ZATCA integration status rollup for {company or 'all companies'}")
@@ -1,10 +1,27 @@
 # Copyright (c) 2024, LavaLoon and contributors
 # For license information, please see license.txt
 
+from dataclasses import dataclass
+
 import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from ksa_compliance import logger
+
+
+@dataclass
+class ChainPosition:
+    """The head of an invoice hash chain: the last issued counter and hash for a business settings"""
+
+    counting_settings_id: str
+    invoice_counter: int
+    previous_invoice_hash: str
+
+    @property
+    def next_counter(self) -> int:
+        return self.invoice_counter + 1
+
 
 class ZATCAInvoiceCountingSettings(Document):
     # begin: auto-generated types
@@ -26,3 +43,31 @@ class ZATCAInvoiceCountingSettings(Document):
             msg=_("You cannot delete a configured Invoice Counting Settings"),
             title=_("This Action Is Not Allowed"),
         )
+
+
+def lock_chain(business_settings_id: str) -> ChainPosition:
+    """
+    Locks the invoice hash chain of a business settings and returns its head. The lock (a row lock on the counting
+    settings) is held until the current transaction ends, so it should be taken as late as possible: only the work
+    that depends on the counter and previous hash (rendering and signing) should happen after this call.
+    """
+    counting_settings_id, invoice_counter, previous_invoice_hash = frappe.db.get_values(
+        "ZATCA Invoice Counting Settings",
+        {"business_settings_reference": business_settings_id},
+        ["name", "invoice_counter", "previous_invoice_hash"],
+        for_update=True,
+    )[0]
+    return ChainPosition(counting_settings_id, invoice_counter, previous_invoice_hash)
+
+
+def advance_chain(position: ChainPosition, invoice_hash: str) -> None:
+    """Moves the head of a locked chain to the next counter with the given invoice hash"""
+    logger.info(
+        f"Changing invoice counter, hash from: {position.invoice_counter}, {position.previous_invoice_hash} -> "
+        f"{position.next_counter}, {invoice_hash}"
+    )
+    frappe.db.set_value(
+        "ZATCA Invoice Counting Settings",
+        position.counting_settings_id,
+        {"invoice_counter": position.next_counter, "previous_invoice_hash": invoice_hash},
+    )
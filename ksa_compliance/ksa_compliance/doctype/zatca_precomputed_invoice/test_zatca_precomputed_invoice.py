@@ -64,7 +64,7 @@ class TestZATCAPrecomputedInvoice(KSAComplianceTestBase):
         precomputed_invoice.previous_invoice_hash = si_additional_fields.previous_invoice_hash
         precomputed_invoice.invoice_hash = si_additional_fields.invoice_hash
         precomputed_invoice.invoice_qr = si_additional_fields.qr_code
-        precomputed_invoice.invoice_xml = si_additional_fields.invoice_xml
+        precomputed_invoice.invoice_xml = si_additional_fields.get_signed_xml()
 
         precomputed_invoice.insert(ignore_permissions=True)
 
@@ -103,7 +103,7 @@ class TestZATCAPrecomputedInvoice(KSAComplianceTestBase):
         self.assertIsNotNone(precomputed_invoice.invoice_uuid)
         self.assertIsNotNone(precomputed_invoice.invoice_hash)
         self.assertIsNotNone(precomputed_invoice.invoice_qr)
-        self.assertIsNotNone(precomputed_invoice.invoice_xml)
+        self.assertIsNotNone(precomputed_invoice.get_signed_xml())
 
         # Verify UUID format (should be a proper UUID4)
         import uuid
@@ -276,7 +276,7 @@ class TestZATCAPrecomputedInvoice(KSAComplianceTestBase):
         self.assertEqual(mock_response.type, "download")
         self.assertEqual(mock_response.display_content_as, "attachment")
         self.assertEqual(mock_response.filename, f"{precomputed_invoice.name}.xml")
-        self.assertEqual(mock_response.filecontent, precomputed_invoice.invoice_xml)
+        self.assertEqual(mock_response.filecontent, precomputed_invoice.get_signed_xml())
 
         frappe.logger().info("✅ test_download_xml_endpoint completed successfully")
 
@@ -298,7 +298,7 @@ class TestZATCAPrecomputedInvoice(KSAComplianceTestBase):
         self.assertIsNotNone(precomputed_invoice.invoice_uuid)
         self.assertIsNotNone(precomputed_invoice.invoice_hash)
         self.assertIsNotNone(precomputed_invoice.invoice_qr)
-        self.assertIsNotNone(precomputed_invoice.invoice_xml)
+        self.assertIsNotNone(precomputed_invoice.get_signed_xml())
 
         # Verify UUID format (should be a proper UUID4)
         import uuid
@@ -317,8 +317,9 @@ class TestZATCAPrecomputedInvoice(KSAComplianceTestBase):
             self.fail("invoice_hash is not valid base64")
 
         # Verify XML contains expected elements
-        self.assertIn("Invoice", precomputed_invoice.invoice_xml)
-        self.assertIn("xml", precomputed_invoice.invoice_xml.lower())
+        invoice_xml = precomputed_invoice.get_signed_xml()
+        self.assertIn("Invoice", invoice_xml)
+        self.assertIn("xml", invoice_xml.lower())
 
         frappe.logger().info(
             "✅ test_create_precomputed_invoice_with_real_zatca_data completed successfully"
@@ -359,6 +360,10 @@ class TestZATCAPrecomputedInvoice(KSAComplianceTestBase):
         self.assertEqual(
             si_additional_fields.qr_code, precomputed_invoice.invoice_qr
         )  # Field name mapping
-        self.assertEqual(si_additional_fields.invoice_xml, precomputed_invoice.invoice_xml)
+        self.assertEqual(
+            si_additional_fields.get_signed_xml(), precomputed_invoice.get_signed_xml()
+        )
+        # Both documents share the stored XML
+        self.assertEqual(si_additional_fields.signed_xml, precomputed_invoice.signed_xml)
 
         frappe.logger().info("✅ test_precomputed_invoice_data_mapping completed successfully")
@@ -6,6 +6,11 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from ksa_compliance.ksa_compliance.doctype.zatca_signed_xml.zatca_signed_xml import (
+    load_signed_xml,
+    store_signed_xml,
+)
+
 
 class ZATCAPrecomputedInvoice(Document):
     # begin: auto-generated types
@@ -24,6 +29,7 @@ class ZATCAPrecomputedInvoice(Document):
         invoice_xml: DF.LongText | None
         previous_invoice_hash: DF.Data | None
         sales_invoice: DF.Link | None
+        signed_xml: DF.Link | None
     # end: auto-generated types
     pass
 
@@ -39,6 +45,18 @@ class ZATCAPrecomputedInvoice(Document):
             "ZATCAPrecomputedInvoice", frappe.get_doc("ZATCA Precomputed Invoice", prepared_id)
         )
 
+    def before_insert(self) -> None:
+        # Clients send the XML in invoice_xml. It's stored compressed and shared with the Sales Invoice Additional
+        # Fields created from this invoice
+        if self.invoice_xml:
+            self.signed_xml = store_signed_xml(self.invoice_xml)
+            self.invoice_xml = None
+
+    def get_signed_xml(self) -> Optional[str]:
+        if self.signed_xml:
+            return load_signed_xml(self.signed_xml)
+        return self.invoice_xml
+
     def on_trash(self) -> None:
         frappe.throw(
             msg=_("You cannot Delete a configured ZATCA Precomputed Invoice"),
@@ -56,6 +74,6 @@ def download_xml(id: str):
 
     # Reference: https://frappeframework.com/docs/user/en/python-api/response
     frappe.response.filename = doc.name + ".xml"
-    frappe.response.filecontent = doc.invoice_xml
+    frappe.response.filecontent = doc.get_signed_xml()
     frappe.response.type = "download"
     frappe.response.display_content_as = "attachment"
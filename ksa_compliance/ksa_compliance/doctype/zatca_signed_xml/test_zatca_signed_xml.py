@@ -0,0 +1,46 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance.ksa_compliance.doctype.zatca_signed_xml.zatca_signed_xml import (
+    get_xml_key,
+    load_signed_xml,
+    load_signed_xmls,
+    store_signed_xml,
+)
+
+
+def _invoice_xml() -> str:
+    lines = "".join(f"<cac:InvoiceLine><cbc:ID>{i}</cbc:ID></cac:InvoiceLine>" for i in range(200))
+    return f"<Invoice><cbc:UUID>{frappe.generate_hash()}</cbc:UUID>{lines}</Invoice>"
+
+
+class TestZATCASignedXML(FrappeTestCase):
+    def test_round_trip(self):
+        xml = _invoice_xml()
+        key = store_signed_xml(xml)
+
+        self.assertEqual(key, get_xml_key(xml))
+        self.assertEqual(load_signed_xml(key), xml)
+
+        row = frappe.db.get_value(
+            "ZATCA Signed XML", key, ["original_size", "compressed_size"], as_dict=True
+        )
+        self.assertEqual(row.original_size, len(xml.encode("utf-8")))
+        self.assertLess(row.compressed_size, row.original_size)
+
+    def test_same_xml_is_stored_once(self):
+        xml = _invoice_xml()
+        self.assertEqual(store_signed_xml(xml), store_signed_xml(xml))
+        self.assertEqual(frappe.db.count("ZATCA Signed XML", {"name": get_xml_key(xml)}), 1)
+
+    def test_load_many(self):
+        xmls = [_invoice_xml() for _ in range(3)]
+        keys = [store_signed_xml(xml) for xml in xmls]
+
+        loaded = load_signed_xmls(keys + ["missing", None])
+
+        self.assertEqual(loaded, dict(zip(keys, xmls)))
+        self.assertIsNone(load_signed_xml("missing"))
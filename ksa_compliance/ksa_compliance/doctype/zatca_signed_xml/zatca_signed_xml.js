@@ -0,0 +1,8 @@
+// Copyright (c) 2024, LavaLoon and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("ZATCA Signed XML", {
+// 	refresh(frm) {
+
+// 	},
+// });
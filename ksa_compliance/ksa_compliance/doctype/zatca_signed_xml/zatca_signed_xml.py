@@ -0,0 +1,98 @@
+# Copyright (c) 2024, LavaLoon and contributors
+# For license information, please see license.txt
+
+import base64
+import gzip
+import hashlib
+from typing import Dict, Iterable, Optional
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+_TABLE = "`tabZATCA Signed XML`"
+
+# Signed UBL is repetitive markup, so gzip shrinks it several times over. Each row records its compression so another
+# codec can be added later without rewriting existing rows
+COMPRESSION = "gzip"
+_DECOMPRESS = {"gzip": gzip.decompress}
+
+
+class ZATCASignedXML(Document):
+    # begin: auto-generated types
+    # This code is auto-generated. Do not modify anything in this block.
+
+    from typing import TYPE_CHECKING
+
+    if TYPE_CHECKING:
+        from frappe.types import DF
+
+        compressed_size: DF.Int
+        compressed_xml: DF.LongText | None
+        compression: DF.Data | None
+        original_size: DF.Int
+    # end: auto-generated types
+
+    pass
+
+
+def get_xml_key(xml: str) -> str:
+    """Signed XMLs are named after the SHA-256 of their content, so storing the same XML twice keeps one copy"""
+    return hashlib.sha256(xml.encode("utf-8")).hexdigest()
+
+
+def store_signed_xml(xml: str) -> str:
+    """
+    Stores [xml] compressed and returns its key. Storing an XML that's already stored is a no-op. The row is written in
+    the caller's transaction, so it's rolled back along with the document that links to it
+    """
+    key = get_xml_key(xml)
+    content = xml.encode("utf-8")
+    compressed = compress_text(xml)
+    now = now_datetime()
+    frappe.db.sql(
+        f"""
+            INSERT IGNORE INTO {_TABLE}
+            (name, creation, modified, owner, modified_by, docstatus,
+            compression, original_size, compressed_size, compressed_xml)
+            VALUES (%(name)s, %(now)s, %(now)s, %(user)s, %(user)s, 0,
+            %(compression)s, %(original_size)s, %(compressed_size)s, %(compressed_xml)s)
+        """,
+        {
+            "name": key,
+            "now": now,
+            "user": frappe.session.user,
+            "compression": COMPRESSION,
+            "original_size": len(content),
+            "compressed_size": len(compressed),
+            "compressed_xml": compressed,
+        },
+    )
+    return key
+
+
+def load_signed_xml(key: str) -> Optional[str]:
+    return load_signed_xmls([key]).get(key)
+
+
+def load_signed_xmls(keys: Iterable[str]) -> Dict[str, str]:
+    """Returns the XML of each of [keys] that's stored, read in one query"""
+    keys = list({key for key in keys if key})
+    if not keys:
+        return {}
+
+    rows = frappe.db.sql(
+        f"SELECT name, compression, compressed_xml FROM {_TABLE} WHERE name IN %(keys)s",
+        {"keys": keys},
+        as_dict=True,
+    )
+    return {row.name: decompress_text(row.compression, row.compressed_xml) for row in rows}
+
+
+def compress_text(text: str) -> str:
+    """Compresses [text] with [COMPRESSION] and returns it base64 encoded, so it fits a Long Text column"""
+    return base64.b64encode(gzip.compress(text.encode("utf-8"), mtime=0)).decode("ascii")
+
+
+def decompress_text(compression: str, compressed: str) -> str:
+    return _DECOMPRESS[compression](base64.b64decode(compressed)).decode("utf-8")
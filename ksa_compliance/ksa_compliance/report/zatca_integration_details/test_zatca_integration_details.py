@@ -0,0 +1,37 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import frappe
+
+from ksa_compliance.ksa_compliance.report.zatca_integration_details.zatca_integration_details import (
+    get_zatca_integration_details_data,
+    iter_zatca_integration_details_data,
+)
+from ksa_compliance.ksa_compliance.test.ksa_compliance_test_base import KSAComplianceTestBase
+from ksa_compliance.test.test_constants import TEST_COMPANY_NAME
+
+
+class TestZATCAIntegrationDetails(KSAComplianceTestBase):
+    def _filters(self) -> frappe._dict:
+        today = frappe.utils.nowdate()
+        return frappe._dict(
+            from_date_filter=today,
+            to_date_filter=today,
+            company_filter=TEST_COMPANY_NAME,
+            integration_status_filter="All",
+        )
+
+    def test_pages_cover_every_row_once(self):
+        for _ in range(3):
+            self._create_test_sales_invoice()
+
+        filters = self._filters()
+        expected = [
+            row.invoice_id for row in get_zatca_integration_details_data(filters, limit=10_000)
+        ]
+        self.assertGreaterEqual(len(expected), 3)
+
+        streamed = [
+            row.invoice_id for row in iter_zatca_integration_details_data(filters, batch_size=2)
+        ]
+        self.assertEqual(streamed, expected)
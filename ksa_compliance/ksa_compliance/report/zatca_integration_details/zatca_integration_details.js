@@ -1,6 +1,85 @@
 // Copyright (c) 2024, LavaLoon and contributors
 // For license information, please see license.txt
 
+// Same as PAGE_LENGTH in zatca_integration_details.py
+const PAGE_LENGTH = 500;
+
+// Pages are fetched with keyset pagination: the hidden 'page_after' filter holds the (posting date, invoice) of the
+// last row of the previous page, and we keep the cursors of the pages before it to go back
+function setup_pagination(report) {
+  const page_after = report.get_filter('page_after');
+  page_after.toggle(false);
+  report.page_cursors = [];
+
+  // Changing any other filter starts over from the first page
+  for (const name of ['from_date_filter', 'to_date_filter', 'company_filter', 'integration_status_filter']) {
+    const filter = report.get_filter(name);
+    const onchange = filter.df.onchange;
+    filter.df.onchange = function () {
+      report.page_cursors = [];
+      page_after.value = '';
+      page_after.$input && page_after.$input.val('');
+      return onchange && onchange.apply(this, arguments);
+    };
+  }
+
+  report.page.add_inner_button(__("Previous Page"), () => {
+    if (!report.page_cursors.length) {
+      frappe.show_alert(__("This is the first page"));
+      return;
+    }
+    report.set_filter_value('page_after', report.page_cursors.pop());
+  });
+
+  report.page.add_inner_button(__("Next Page"), () => {
+    const data = report.data || [];
+    if (data.length < PAGE_LENGTH) {
+      frappe.show_alert(__("This is the last page"));
+      return;
+    }
+    const last = data[data.length - 1];
+    report.page_cursors.push(page_after.get_value() || '');
+    report.set_filter_value('page_after', `${last.posting_date}|${last.invoice_id}`);
+  });
+
+  report.page.add_inner_button(__("Export All Rows"), () => {
+    frappe.prompt(
+      {fieldname: 'file_format', fieldtype: 'Select', label: __('Format'), options: 'CSV\nExcel', default: 'CSV'},
+      (values) => {
+        frappe.call({
+          method: "ksa_compliance.ksa_compliance.report.zatca_integration_details.zatca_integration_details.export_report",
+          args: {
+            filters: report.get_filter_values(),
+            file_format: values.file_format,
+          },
+        });
+      },
+      __('Export'),
+    );
+  });
+
+  report.page.add_inner_button(__("Export PDF/A-3b"), () => {
+    frappe.prompt(
+      [
+        {fieldname: 'print_format', fieldtype: 'Link', label: __('Print Format'), options: 'Print Format', reqd: 1,
+          default: 'ZATCA Phase 2 Print Format'},
+        {fieldname: 'lang', fieldtype: 'Link', label: __('Language'), options: 'Language', reqd: 1, default: 'en'},
+      ],
+      (values) => {
+        frappe.call({
+          method: "ksa_compliance.pdf_export.export_pdfs",
+          args: {
+            filters: report.get_filter_values(),
+            print_format: values.print_format,
+            lang: values.lang,
+          },
+        });
+      },
+      __('Export PDF/A-3b'),
+    );
+  });
+}
+
 frappe.query_reports["Zatca Integration Details"] = {
 	"onload": function (report) {
     const summary_elm = document.getElementById('message-summary')
@@ -8,7 +87,7 @@ frappe.query_reports["Zatca Integration Details"] = {
       const page_container = report.$page[0];
       const filters_section = page_container.querySelector(".page-form");
       const message = "This report will display the ZATCA status for each transaction and provide detailed invoice amount information, to reconcile transactions between the system and Fatoorah platform.\n" +
-          "It is not recommended to run or generate this report with the “From Date” and “To Date” filters set for a period exceeding 31 days.";
+          "Results are shown " + PAGE_LENGTH + " invoices at a time. Use “Export All Rows” to download the whole period, or “Export PDF/A-3b” to download the invoices themselves.";
 
       const message_summary_elm = document.createElement('div');
       message_summary_elm.classList.add('my-3', 'mx-auto');
@@ -23,6 +102,7 @@ frappe.query_reports["Zatca Integration Details"] = {
       message_summary_elm.append(document.createElement('hr'), message_title, message_content);
       filters_section.appendChild(message_summary_elm);
     }
+    setup_pagination(report);
   },
     formatter:function (value, row, column, data, default_formatter) {
     value = default_formatter(value, row, column, data);
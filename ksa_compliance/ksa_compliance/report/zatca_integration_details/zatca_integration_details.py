@@ -1,10 +1,30 @@
 # Copyright (c) 2024, Lavaloon and contributors
 # For license information, please see license.txt
 
+import csv
+import json
 from datetime import datetime
+from typing import Iterator, Optional
 
 import frappe
+import frappe.utils.background_jobs
 from frappe import _
+from frappe.utils import cstr, flt
+
+from ksa_compliance.exports import export_path, publish_export
+
+# Rows shown per report page. zatca_integration_details.js uses the same number to tell whether there's a next page
+PAGE_LENGTH = 500
+
+# Rows fetched per query when exporting
+EXPORT_BATCH_SIZE = 5000
+
+_STATUS_COLORS = {
+    "Accepted": "green",
+    "Rejected": "red",
+    "Resend": "blue",
+    "Accepted with warnings": "yellow",
+}
 
 
 def execute(filters=None):
@@ -12,44 +32,40 @@ def execute(filters=None):
     if not filters:
         return
 
-    df = datetime.strptime(filters["from_date_filter"], "%Y-%m-%d")
-    dt = datetime.strptime(filters["to_date_filter"], "%Y-%m-%d")
-    if dt < df:
-        frappe.throw(
-            msg=_("To date must be after From date. error_code='InvalidDateRange', code=400")
-        )
+    validate_filters(filters)
     try:
-        data = get_zatca_integration_details_data(filters=filters)
         columns = get_columns()
-        records_count = len(data)
+        data = get_zatca_integration_details_data(
+            filters, after=parse_cursor(filters.get("page_after")), limit=PAGE_LENGTH
+        )
+
+        status_totals = get_status_totals(filters)
         report_summary = [
             {
-                "value": records_count,
+                "value": sum(row["records_count"] for row in status_totals),
                 "label": _("Number of records"),
                 "datatype": "Number",
             },
+            {
+                "value": sum(flt(row["net_total"]) for row in status_totals),
+                "label": _("Net Amount"),
+                "datatype": "Currency",
+            },
+            {
+                "value": sum(flt(row["total_taxes_and_charges"]) for row in status_totals),
+                "label": _("VAT Amount"),
+                "datatype": "Currency",
+            },
+            {
+                "value": sum(flt(row["grand_total"]) for row in status_totals),
+                "label": _("Grand Total"),
+                "datatype": "Currency",
+            },
         ]
 
-        values = {}
-        labels = []
-        colors = []
-        for row in data:
-            if row["integration_status"] not in labels:
-                labels.append(row["integration_status"])
-            if row["integration_status"] not in values:
-                values[row["integration_status"]] = 1
-            else:
-                values[row["integration_status"]] += 1
-
-        for label in labels:
-            if label == "Accepted":
-                colors.append("green")
-            elif label == "Rejected":
-                colors.append("red")
-            elif label == "Resend":
-                colors.append("blue")
-            elif label == "Accepted with warnings":
-                colors.append("yellow")
+        labels = [row["integration_status"] for row in status_totals]
+        values = {row["integration_status"]: row["records_count"] for row in status_totals}
+        colors = [_STATUS_COLORS[label] for label in labels if label in _STATUS_COLORS]
         chart = get_pie_chart_data(
             title=_("Zatca Integration Status"),
             labels=labels,
@@ -65,8 +81,44 @@ def execute(filters=None):
         frappe.throw(msg=f"""{str(ex)}""")
 
 
-def get_zatca_integration_details_data(filters):
-    query = """
+def validate_filters(filters) -> None:
+    df = datetime.strptime(filters["from_date_filter"], "%Y-%m-%d")
+    dt = datetime.strptime(filters["to_date_filter"], "%Y-%m-%d")
+    if dt < df:
+        frappe.throw(
+            msg=_("To date must be after From date. error_code='InvalidDateRange', code=400")
+        )
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[tuple[str, str]]:
+    """
+    Parses a page cursor of the form '<posting date>|<invoice id>', which points at the last row of the previous page
+    """
+    if not cursor:
+        return None
+    posting_date, _sep, invoice_id = cstr(cursor).partition("|")
+    return posting_date, invoice_id
+
+
+def get_zatca_integration_details_data(
+    filters, after: Optional[tuple[str, str]] = None, limit: int = PAGE_LENGTH
+):
+    """
+    Returns up to [limit] rows ordered by (posting date, invoice id), starting after the [after] row. Pages are read
+    with keyset pagination, so deep pages cost the same as the first one
+    """
+    status_condition = ""
+    if filters["integration_status_filter"] != "All":
+        status_condition = "AND zi.integration_status = %(integration_status_filter)s"
+
+    after_condition = ""
+    if after:
+        after_condition = """
+                AND (inv.posting_date > %(after_date)s
+                    OR (inv.posting_date = %(after_date)s AND inv.name > %(after_name)s))
+        """
+
+    query = f"""
                 SELECT
                     inv.name AS invoice_id,
                     IFNULL(zi.integration_status,'N/A') integration_status,
@@ -75,18 +127,16 @@ def get_zatca_integration_details_data(filters):
                     inv.total_taxes_and_charges,
                     inv.grand_total
                 FROM
-                    `tabSales Invoice Additional Fields` zi
-                RIGHT JOIN `tabSales Invoice` inv
-                ON inv.name = zi.sales_invoice
+                    `tabSales Invoice` inv
+                JOIN `tabSales Invoice Additional Fields` zi
+                ON zi.sales_invoice = inv.name AND zi.is_latest = 1
                 WHERE inv.company = %(company)s
-                AND inv.posting_date BETWEEN %(from_date)s AND DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-                AND zi.is_latest = 1
-                AND (
-                (%(integration_status_filter)s = 'All' AND zi.integration_status IN ('All', 'Ready For Batch', 'Resend', 'Accepted with warnings', 'Accepted', 'Rejected', 'Clearance switched off'))
-                ) OR
-                (
-                (%(integration_status_filter)s != 'All' AND zi.integration_status = %(integration_status_filter)s)
-                )
+                AND inv.docstatus = 1
+                AND inv.posting_date BETWEEN %(from_date)s AND %(to_date)s
+                {status_condition}
+                {after_condition}
+                ORDER BY inv.posting_date, inv.name
+                LIMIT %(limit)s
             """
 
     return frappe.db.sql(
@@ -96,11 +146,117 @@ def get_zatca_integration_details_data(filters):
             "to_date": filters["to_date_filter"],
             "company": filters["company_filter"],
             "integration_status_filter": filters["integration_status_filter"],
+            "after_date": after[0] if after else None,
+            "after_name": after[1] if after else None,
+            "limit": limit,
+        },
+        as_dict=1,
+    )
+
+
+def iter_zatca_integration_details_data(
+    filters, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[dict]:
+    """Yields every row of the report one keyset page at a time, so only one page is held in memory"""
+    after = None
+    while True:
+        rows = get_zatca_integration_details_data(filters, after=after, limit=batch_size)
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1]["posting_date"], rows[-1]["invoice_id"])
+
+
+def get_status_totals(filters):
+    """Counts and totals per integration status over the whole range, from the integration status rollup"""
+    status_condition = ""
+    if filters["integration_status_filter"] != "All":
+        status_condition = "AND integration_status = %(integration_status_filter)s"
+
+    return frappe.db.sql(
+        f"""
+            SELECT integration_status,
+            SUM(invoice_count) AS records_count,
+            SUM(net_total) AS net_total,
+            SUM(total_taxes_and_charges) AS total_taxes_and_charges,
+            SUM(grand_total) AS grand_total
+            FROM `tabZATCA Integration Status Rollup`
+            WHERE company = %(company)s
+            AND invoice_doctype = 'Sales Invoice'
+            AND posting_date BETWEEN %(from_date)s AND %(to_date)s
+            {status_condition}
+            GROUP BY integration_status
+            HAVING records_count > 0
+        """,
+        {
+            "from_date": filters["from_date_filter"],
+            "to_date": filters["to_date_filter"],
+            "company": filters["company_filter"],
+            "integration_status_filter": filters["integration_status_filter"],
         },
         as_dict=1,
     )
 
 
+@frappe.whitelist()
+def export_report(filters: str, file_format: str = "CSV") -> None:
+    """
+    Exports the whole report in the background. The file is written row by row as it's read from the database, then
+    attached as a private file and the user is sent a link to it
+    """
+    filters = frappe._dict(json.loads(filters) if isinstance(filters, str) else filters)
+    if not frappe.has_permission("Sales Invoice", "report"):
+        frappe.throw(_("Not permitted"), frappe.PermissionError)
+    validate_filters(filters)
+    if file_format not in ("CSV", "Excel"):
+        frappe.throw(_("Unsupported export format: {0}").format(file_format))
+
+    frappe.utils.background_jobs.enqueue(
+        _export_report,
+        queue="long",
+        filters=filters,
+        file_format=file_format,
+        user=frappe.session.user,
+    )
+    frappe.msgprint(_("The export has started. You'll be notified when the file is ready"))
+
+
+def _export_report(filters: dict, file_format: str, user: str) -> None:
+    extension = "csv" if file_format == "CSV" else "xlsx"
+    columns = get_columns()
+    rows = (
+        [row.get(column["fieldname"]) for column in columns]
+        for row in iter_zatca_integration_details_data(filters)
+    )
+    headers = [column["label"] for column in columns]
+    with export_path("zatca-integration-details", extension) as (file_name, path):
+        if file_format == "CSV":
+            _write_csv(path, headers, rows)
+        else:
+            _write_xlsx(path, headers, rows)
+
+    publish_export(file_name, user, _("ZATCA integration details export is ready: {0}"))
+
+
+def _write_csv(path: str, headers: list, rows: Iterator[list]) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+def _write_xlsx(path: str, headers: list, rows: Iterator[list]) -> None:
+    from openpyxl import Workbook
+
+    # A write-only workbook streams rows to a temporary file instead of keeping every cell in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(_("ZATCA Integration Details"))
+    sheet.append(headers)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
 def get_columns():
     return [
         {
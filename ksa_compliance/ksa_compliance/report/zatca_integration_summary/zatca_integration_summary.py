@@ -7,6 +7,7 @@ from frappe import _
 
 from ksa_compliance.ksa_compliance.report.zatca_integration_details.zatca_integration_details import (
     get_pie_chart_data,
+    get_status_totals,
 )
 
 
@@ -82,29 +83,4 @@ def get_columns():
 
 
 def get_zatca_integration_summary_data(filters):
-    query = """
-            SELECT IFNULL(zi.integration_status,'N/A') AS integration_status,
-            COUNT(DISTINCT inv.name) AS records_count,
-            SUM(inv.net_total) AS net_total,
-            SUM(inv.total_taxes_and_charges) AS total_taxes_and_charges,
-            SUM(inv.grand_total) AS grand_total
-            FROM
-            `tabSales Invoice` inv
-            LEFT JOIN `tabSales Invoice Additional Fields` zi
-            ON inv.name = zi.sales_invoice
-            WHERE inv.company = %(company)s
-            AND inv.docstatus = 1
-            AND inv.posting_date BETWEEN %(from_date)s AND DATE_ADD(%(to_date)s, INTERVAL 1 DAY)
-            AND zi.is_latest = 1
-            GROUP BY zi.integration_status
-          """
-
-    return frappe.db.sql(
-        query=query,
-        values={
-            "from_date": filters["from_date_filter"],
-            "to_date": filters["to_date_filter"],
-            "company": filters["company_filter"],
-        },
-        as_dict=1,
-    )
+    return get_status_totals({**filters, "integration_status_filter": "All"})
@@ -0,0 +1,54 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import background_jobs
+
+FREE = {"company": "_Test Company ZATCA", "device_id": None}
+BUSY = {"company": "_Test Company ZATCA", "device_id": "EGS-1"}
+
+
+class TestBackgroundJobs(FrappeTestCase):
+    def tearDown(self):
+        for partition in (FREE, BUSY):
+            frappe.cache().delete(background_jobs.get_partition_lock_key(partition))
+
+    def test_skips_partitions_another_sync_is_running(self):
+        running = frappe.cache().lock(background_jobs.get_partition_lock_key(BUSY), timeout=60)
+        self.assertTrue(running.acquire(blocking=False))
+
+        with patch.object(background_jobs, "sync_partition") as sync_partition:
+            background_jobs.sync_partitions([BUSY, FREE])
+        self.assertEqual([c.args[0] for c in sync_partition.call_args_list], [FREE])
+
+        # Finished partitions are released for the next sync
+        running.release()
+        with patch.object(background_jobs, "sync_partition") as sync_partition:
+            background_jobs.sync_partitions([BUSY, FREE])
+        self.assertEqual([c.args[0] for c in sync_partition.call_args_list], [BUSY, FREE])
+
+    def test_releases_the_lock_when_the_sync_fails(self):
+        with patch.object(background_jobs, "sync_partition", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                background_jobs.sync_partitions([FREE])
+
+        with patch.object(background_jobs, "sync_partition") as sync_partition:
+            background_jobs.sync_partitions([FREE])
+        sync_partition.assert_called_once()
+
+    def test_sync_after_recovery_skips_partitions_of_the_running_sync(self):
+        # The hourly sync is sending BUSY when ZATCA recovers and queues another sync of everything
+        hourly = frappe.cache().lock(background_jobs.get_partition_lock_key(BUSY), timeout=60)
+        self.assertTrue(hourly.acquire(blocking=False))
+
+        with (
+            patch.object(background_jobs, "get_sync_partitions", return_value=[BUSY, FREE]),
+            patch.object(background_jobs, "sync_partition") as sync_partition,
+        ):
+            background_jobs.sync_e_invoices()
+        self.assertEqual([c.args[0] for c in sync_partition.call_args_list], [FREE])
+        hourly.release()
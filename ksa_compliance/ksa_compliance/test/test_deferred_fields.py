@@ -0,0 +1,92 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+
+from ksa_compliance.background_jobs import load_additional_fields
+from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields import (
+    sales_invoice_additional_fields,
+)
+from ksa_compliance.ksa_compliance.test.ksa_compliance_test_base import KSAComplianceTestBase
+
+
+class TestDeferredFields(KSAComplianceTestBase):
+    def setUp(self):
+        super().setUp()
+        sales_invoice = self._create_test_sales_invoice()
+        self.siaf_id = frappe.db.get_value(
+            "Sales Invoice Additional Fields",
+            {"sales_invoice": sales_invoice.name, "is_latest": 1},
+        )
+        frappe.db.set_value(
+            "Sales Invoice Additional Fields",
+            self.siaf_id,
+            {"validation_messages": "Message", "validation_errors": "Warning"},
+            update_modified=False,
+        )
+
+    def _load(self):
+        return load_additional_fields([self.siaf_id], defer_large_fields=True)[0]
+
+    def test_large_fields_are_read_on_first_access(self):
+        siaf = self._load()
+        self.assertNotIn("validation_messages", siaf.__dict__)
+
+        self.assertEqual(siaf.validation_messages, "Message")
+        self.assertEqual(siaf.get("validation_errors"), "Warning")
+        self.assertEqual(
+            siaf.get_signed_xml(),
+            frappe.get_doc("Sales Invoice Additional Fields", self.siaf_id).get_signed_xml(),
+        )
+
+    def test_saving_keeps_fields_that_were_not_loaded(self):
+        siaf = self._load()
+        siaf.last_attempt = frappe.utils.now_datetime()
+        siaf.save(ignore_permissions=True)
+
+        self.assertEqual(
+            frappe.db.get_value(
+                "Sales Invoice Additional Fields", self.siaf_id, "validation_messages"
+            ),
+            "Message",
+        )
+
+    def test_assigned_fields_are_saved(self):
+        siaf = self._load()
+        siaf.validation_errors = "Changed"
+        siaf.save(ignore_permissions=True)
+
+        self.assertEqual(
+            frappe.db.get_value(
+                "Sales Invoice Additional Fields", self.siaf_id, "validation_errors"
+            ),
+            "Changed",
+        )
+        self.assertEqual(
+            frappe.db.get_value(
+                "Sales Invoice Additional Fields", self.siaf_id, "validation_messages"
+            ),
+            "Message",
+        )
+
+    def test_as_dict_loads_everything(self):
+        values = self._load().as_dict()
+        self.assertEqual(values.validation_messages, "Message")
+        self.assertEqual(values.validation_errors, "Warning")
+
+    def test_prefetched_signed_xml_is_read_once(self):
+        expected = frappe.get_doc("Sales Invoice Additional Fields", self.siaf_id).get_signed_xml()
+        siaf = load_additional_fields(
+            [self.siaf_id], defer_large_fields=True, prefetch_signed_xml=True
+        )[0]
+
+        with patch.object(sales_invoice_additional_fields, "load_signed_xml") as load_signed_xml:
+            self.assertEqual(siaf.get_signed_xml(), expected)
+            self.assertEqual(siaf.get_signed_xml(), expected)
+        load_signed_xml.assert_not_called()
+
+        # A newly signed XML replaces the prefetched one
+        siaf.set_signed_xml("<Invoice>Changed</Invoice>")
+        self.assertEqual(siaf.get_signed_xml(), "<Invoice>Changed</Invoice>")
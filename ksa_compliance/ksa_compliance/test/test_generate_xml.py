@@ -0,0 +1,56 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import frappe
+from frappe import get_jenv
+
+from ksa_compliance.generate_xml import generate_xml_file
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import (
+    ZATCABusinessSettings,
+)
+from ksa_compliance.ksa_compliance.test.ksa_compliance_test_base import KSAComplianceTestBase
+from ksa_compliance.output_models.e_invoice_output_model import SalesEinvoice
+
+
+def _render_in_shared_env(data: dict) -> str:
+    # How the XML used to be rendered: the whitespace settings were switched on the shared environment for the
+    # duration of the render
+    env = get_jenv()
+    lstrip, trim = env.lstrip_blocks, env.trim_blocks
+    env.lstrip_blocks = env.trim_blocks = True
+    try:
+        return env.get_template("ksa_compliance/templates/e_invoice.xml").render(
+            {
+                "invoice": data.get("invoice"),
+                "seller_details": data.get("seller_details"),
+                "buyer_details": data.get("buyer_details"),
+                "business_settings": data.get("business_settings"),
+                "prepayment_invoices": data.get("prepayment_invoices"),
+                "prepaid_amount": data.get("prepaid_amount"),
+            }
+        )
+    finally:
+        env.lstrip_blocks, env.trim_blocks = lstrip, trim
+
+
+class TestGenerateXml(KSAComplianceTestBase):
+    def test_matches_rendering_in_shared_environment(self):
+        invoice = self._create_test_sales_invoice()
+        settings = ZATCABusinessSettings.for_invoice(invoice.name, "Sales Invoice")
+        if not settings:
+            self.skipTest("Rendering invoices requires business settings")
+
+        siaf = frappe.get_last_doc(
+            "Sales Invoice Additional Fields", {"sales_invoice": invoice.name}
+        )
+        data = SalesEinvoice(
+            sales_invoice_additional_fields_doc=siaf,
+            invoice_type=siaf._get_invoice_type(settings),
+        ).result
+
+        xml = generate_xml_file(data)
+        self.assertEqual(xml.encode("utf-8"), _render_in_shared_env(data).encode("utf-8"))
+
+        # The shared environment keeps its own whitespace settings
+        self.assertFalse(get_jenv().lstrip_blocks)
+        self.assertFalse(get_jenv().trim_blocks)
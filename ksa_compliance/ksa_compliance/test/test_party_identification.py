@@ -0,0 +1,50 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import party_identification
+from ksa_compliance.party_identification import (
+    BUYER_ID_PRIORITY,
+    SELLER_ID_PRIORITY,
+    clear_party_ids,
+    find_by_priority,
+    get_buyer_other_id,
+)
+
+
+def _id(type_code: str, value: str, type_name: str = "") -> dict:
+    return {"type_code": type_code, "type_name": type_name or type_code, "value": value}
+
+
+class TestPartyIdentification(FrappeTestCase):
+    def test_picks_first_scheme_by_priority(self):
+        ids = [_id("OTH", "O-1"), _id("MLS", "M-1"), _id("CRN", "C-1")]
+        self.assertEqual(find_by_priority(ids, SELLER_ID_PRIORITY)["value"], "C-1")
+
+    def test_skips_blank_values(self):
+        ids = [_id("TIN", "  "), _id("NAT", "N-1"), _id("CRN", "")]
+        self.assertEqual(find_by_priority(ids, BUYER_ID_PRIORITY)["value"], "N-1")
+
+    def test_no_match(self):
+        self.assertIsNone(find_by_priority([_id("XYZ", "1")], SELLER_ID_PRIORITY))
+        self.assertIsNone(find_by_priority([], SELLER_ID_PRIORITY))
+
+    def test_buyer_ids_are_read_once_until_cleared(self):
+        customer = frappe._dict(
+            doctype="Customer", name=f"Test Customer {frappe.generate_hash(length=8)}"
+        )
+        rows = [_id("PAS", " P-1 ", "Passport ID")]
+        with patch.object(party_identification.frappe, "get_all", return_value=rows) as get_all:
+            self.assertEqual(get_buyer_other_id(customer.name), ("P-1", "Passport ID"))
+            self.assertEqual(get_buyer_other_id(customer.name), ("P-1", "Passport ID"))
+            self.assertEqual(get_all.call_count, 1)
+
+            clear_party_ids(customer)
+            get_buyer_other_id(customer.name)
+            self.assertEqual(get_all.call_count, 2)
+
+        clear_party_ids(customer)
@@ -0,0 +1,52 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import io
+import zipfile
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import pdf_export
+
+
+def _fake_render(invoice: str, print_format: str, lang: str) -> bytes:
+    if invoice == "SINV-BAD":
+        frappe.throw("Conversion failed")
+    return f"%PDF {invoice} {print_format} {lang}".encode()
+
+
+class TestPdfExport(FrappeTestCase):
+    def tearDown(self):
+        frappe.conf.pop("zatca_pdf_export_concurrency", None)
+
+    def _write(self, invoices, concurrency):
+        buffer = io.BytesIO()
+        with patch.object(pdf_export, "_render", side_effect=_fake_render):
+            with zipfile.ZipFile(buffer, "w") as archive:
+                errors = pdf_export.write_pdfs(
+                    archive, invoices, "Print", "en", frappe.session.user, concurrency
+                )
+        return zipfile.ZipFile(buffer), errors
+
+    def test_writes_every_invoice_and_collects_errors(self):
+        invoices = [f"SINV-{i}" for i in range(10)] + ["SINV-BAD"]
+
+        archive, errors = self._write(invoices, concurrency=3)
+
+        self.assertEqual(
+            sorted(archive.namelist()), sorted(f"SINV-{i}_a3b.pdf" for i in range(10))
+        )
+        self.assertEqual(archive.read("SINV-4_a3b.pdf"), b"%PDF SINV-4 Print en")
+        self.assertEqual(errors, ["SINV-BAD: Conversion failed"])
+
+    def test_no_invoices(self):
+        archive, errors = self._write([], concurrency=3)
+        self.assertEqual(archive.namelist(), [])
+        self.assertEqual(errors, [])
+
+    def test_concurrency(self):
+        self.assertEqual(pdf_export.get_concurrency(), pdf_export.DEFAULT_CONCURRENCY)
+        frappe.conf.zatca_pdf_export_concurrency = 8
+        self.assertEqual(pdf_export.get_concurrency(), 8)
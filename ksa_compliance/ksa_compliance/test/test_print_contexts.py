@@ -0,0 +1,61 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import json
+
+import frappe
+
+from ksa_compliance.jinja import (
+    build_print_contexts,
+    clear_print_contexts,
+    get_phase_2_print_format_details,
+)
+from ksa_compliance.ksa_compliance.test.ksa_compliance_test_base import KSAComplianceTestBase
+
+
+class TestPrintContexts(KSAComplianceTestBase):
+    def setUp(self):
+        super().setUp()
+        clear_print_contexts()
+
+    def tearDown(self):
+        clear_print_contexts()
+        frappe.local.form_dict = frappe._dict()
+        super().tearDown()
+
+    def _assert_same_context(self, bulk: dict, single: dict):
+        self.assertEqual(bulk.keys(), single.keys())
+        self.assertEqual(bulk["siaf"].name, single["siaf"].name)
+        for key in bulk:
+            if key not in ("siaf", "settings"):
+                self.assertEqual(bulk[key], single[key], key)
+
+    def test_bulk_contexts_match_single_document_contexts(self):
+        invoices = [self._create_test_sales_invoice() for _ in range(3)]
+
+        bulk = build_print_contexts(invoices)
+        for invoice in invoices:
+            clear_print_contexts()
+            self._assert_same_context(
+                bulk[invoice.name], get_phase_2_print_format_details(invoice)
+            )
+
+    def test_multi_document_print_prefetches_the_whole_selection(self):
+        invoices = [self._create_test_sales_invoice() for _ in range(3)]
+        frappe.local.form_dict = frappe._dict(
+            doctype="Sales Invoice", name=json.dumps([invoice.name for invoice in invoices])
+        )
+
+        get_phase_2_print_format_details(invoices[0])
+
+        for invoice in invoices:
+            self.assertIn(("Sales Invoice", invoice.name), frappe.local.zatca_print_contexts)
+
+    def test_clearing_forgets_built_contexts(self):
+        invoice = self._create_test_sales_invoice()
+        get_phase_2_print_format_details(invoice)
+        self.assertIn(("Sales Invoice", invoice.name), frappe.local.zatca_print_contexts)
+
+        clear_print_contexts()
+
+        self.assertEqual(frappe.local.zatca_print_contexts, {})
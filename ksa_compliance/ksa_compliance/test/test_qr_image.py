@@ -0,0 +1,45 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import base64
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import qr_image
+
+
+class TestQRImage(FrappeTestCase):
+    def setUp(self):
+        qr_image._get_cached.cache_clear()
+        self.payload = f"test-qr-{frappe.generate_hash(length=10)}"
+
+    def tearDown(self):
+        frappe.conf.pop("zatca_qr_image_format", None)
+
+    def test_png_by_default(self):
+        uri = qr_image.get_qr_data_uri(self.payload)
+        self.assertTrue(uri.startswith("data:image/png;base64,"))
+        png = base64.b64decode(uri.split(",", 1)[1])
+        self.assertEqual(png[:8], b"\x89PNG\r\n\x1a\n")
+
+    def test_svg_when_configured(self):
+        frappe.conf.zatca_qr_image_format = "svg"
+        uri = qr_image.get_qr_data_uri(self.payload)
+        self.assertTrue(uri.startswith("data:image/svg+xml;base64,"))
+        self.assertIn(b"<svg", base64.b64decode(uri.split(",", 1)[1]))
+
+    def test_renders_each_payload_once(self):
+        with patch.object(qr_image, "_render", wraps=qr_image._render) as render:
+            first = qr_image.get_qr_base64(self.payload, "png")
+            # A fresh process would miss the in-process cache and find the image in Redis
+            qr_image._get_cached.cache_clear()
+            second = qr_image.get_qr_base64(self.payload, "png")
+
+        self.assertEqual(first, second)
+        self.assertEqual(render.call_count, 1)
+
+    def test_no_payload(self):
+        self.assertIsNone(qr_image.get_qr_base64(""))
+        self.assertIsNone(qr_image.get_qr_data_uri(None))
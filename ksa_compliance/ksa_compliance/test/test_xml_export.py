@@ -0,0 +1,103 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import csv
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import xml_export
+
+
+def _row(name: str, signed_xml: str = None, invoice_xml: str = None) -> frappe._dict:
+    return frappe._dict(
+        name=name,
+        sales_invoice=f"SINV-{name}",
+        posting_date="2024-05-01",
+        integration_status="Accepted",
+        uuid=f"uuid-{name}",
+        invoice_counter=int(name[-1]),
+        invoice_hash=f"hash-{name}",
+        previous_invoice_hash=f"pih-{name}",
+        signed_xml=signed_xml,
+        invoice_xml=invoice_xml,
+    )
+
+
+class TestXmlExport(FrappeTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filters = frappe._dict(invoice_doctype="Sales Invoice")
+        self.batches = [
+            [_row("SIAF-1", signed_xml="key-1"), _row("SIAF-2")],
+            [_row("SIAF-3"), _row("SIAF-4", invoice_xml="<Invoice>4</Invoice>")],
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _export(self, archive_format: str) -> str:
+        path = os.path.join(self.directory, f"export.{archive_format}")
+        with (
+            patch.object(xml_export, "iter_signed_xml_batches", return_value=iter(self.batches)),
+            patch.object(
+                xml_export,
+                "load_signed_xmls",
+                side_effect=lambda keys: {"key-1": "<Invoice>1</Invoice>"} if keys else {},
+            ),
+            patch.object(
+                xml_export,
+                "get_attached_signed_xmls",
+                side_effect=lambda names: {"SIAF-2": "<Invoice>2</Invoice>"},
+            ) as get_attached,
+        ):
+            with xml_export.ArchiveWriter(path, archive_format) as archive:
+                self.assertEqual(xml_export.write_signed_xmls(archive, self.filters), (3, 1))
+
+        # Attachments are only looked up for the rows without a stored or inline XML, once per batch
+        self.assertEqual(
+            [call.args[0] for call in get_attached.call_args_list], [["SIAF-2"], ["SIAF-3"]]
+        )
+        return path
+
+    def _assert_manifest(self, content: bytes):
+        rows = list(csv.DictReader(io.StringIO(content.decode("utf-8"))))
+        self.assertEqual(
+            [row["file"] for row in rows], ["SIAF-1.xml", "SIAF-2.xml", "", "SIAF-4.xml"]
+        )
+        self.assertEqual(rows[0]["uuid"], "uuid-SIAF-1")
+        self.assertEqual(rows[1]["invoice_hash"], "hash-SIAF-2")
+        self.assertEqual(rows[3]["previous_invoice_hash"], "pih-SIAF-4")
+
+    def test_zip(self):
+        with zipfile.ZipFile(self._export("zip")) as archive:
+            self.assertEqual(archive.read("SIAF-1.xml"), b"<Invoice>1</Invoice>")
+            self.assertEqual(archive.read("SIAF-2.xml"), b"<Invoice>2</Invoice>")
+            self.assertNotIn("SIAF-3.xml", archive.namelist())
+            self._assert_manifest(archive.read("manifest.csv"))
+
+    def test_tar(self):
+        with tarfile.open(self._export("tar.gz"), "r:gz") as archive:
+            self.assertEqual(archive.extractfile("SIAF-4.xml").read(), b"<Invoice>4</Invoice>")
+            self._assert_manifest(archive.extractfile("manifest.csv").read())
+
+    def test_validate_filters(self):
+        with self.assertRaises(frappe.ValidationError):
+            xml_export.validate_filters(
+                frappe._dict(
+                    invoice_doctype="Customer", from_date="2024-01-01", to_date="2024-02-01"
+                )
+            )
+        with self.assertRaises(frappe.ValidationError):
+            xml_export.validate_filters(
+                frappe._dict(
+                    invoice_doctype="POS Invoice", from_date="2024-02-01", to_date="2024-01-01"
+                )
+            )
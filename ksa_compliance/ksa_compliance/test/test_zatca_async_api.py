@@ -0,0 +1,186 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from result import is_err, is_ok
+
+from ksa_compliance import zatca_circuit_breaker, zatca_rate_limit
+from ksa_compliance.zatca_api import ReportOrClearInvoiceError, ZatcaSendMode
+from ksa_compliance.zatca_async_api import ReportInvoiceRequest, report_invoices_sync
+
+
+class FakeFatoora(BaseHTTPRequestHandler):
+    """
+    Answers reporting calls like the Fatoora gateway. The invoice XML selects the response, and 'delay:<seconds>'
+    sets how long it takes. Accepted invoices get their hash back, like the real gateway
+    """
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    attempts: dict[str, int] = {}
+    answered: list[str] = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        xml = base64.b64decode(body["invoice"]).decode()
+        with self.lock:
+            FakeFatoora.in_flight += 1
+            FakeFatoora.max_in_flight = max(FakeFatoora.max_in_flight, FakeFatoora.in_flight)
+            FakeFatoora.attempts[body["uuid"]] = FakeFatoora.attempts.get(body["uuid"], 0) + 1
+            attempt = FakeFatoora.attempts[body["uuid"]]
+
+        time.sleep(float(xml.split(":")[1]) if xml.startswith("delay:") else 0.1)
+        if xml == "rejected":
+            status, data = 400, {
+                "validationResults": {
+                    "errorMessages": [{"code": "BR-KSA-01", "message": "Invalid invoice"}],
+                    "status": "ERROR",
+                },
+                "reportingStatus": "NOT_REPORTED",
+            }
+        elif xml == "throttled" and attempt == 1:
+            status, data = 429, {"message": "Too many requests"}
+        else:
+            status, data = 200, {
+                "invoiceHash": body["invoiceHash"],
+                "validationResults": {
+                    "warningMessages": [],
+                    "errorMessages": [],
+                    "status": "PASS",
+                },
+                "reportingStatus": "REPORTED",
+            }
+
+        with self.lock:
+            FakeFatoora.in_flight -= 1
+            FakeFatoora.answered.append(body["uuid"])
+
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestZATCAAsyncAPI(FrappeTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeFatoora)
+        cls.server_url = f"http://127.0.0.1:{cls.server.server_port}/e-invoicing/developer-portal"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeFatoora.max_in_flight = 0
+        FakeFatoora.attempts = {}
+        FakeFatoora.answered = []
+        frappe.conf.zatca_http_backoff = 0.01
+        zatca_rate_limit.reset("token")
+
+    def tearDown(self):
+        frappe.conf.pop("zatca_http_backoff", None)
+        frappe.conf.pop("zatca_rate_limit_max_wait", None)
+        zatca_rate_limit.reset("token")
+        for server in (self.server_url, "http://127.0.0.1:1"):
+            zatca_circuit_breaker.reset(server)
+
+    def _request(self, xml: str, uuid: str, invoice_hash: str = "hash") -> ReportInvoiceRequest:
+        return ReportInvoiceRequest(
+            invoice_xml=xml,
+            invoice_uuid=uuid,
+            invoice_hash=invoice_hash,
+            security_token="token",
+            secret="secret",
+            mode=ZatcaSendMode.Production,
+        )
+
+    def test_reports_concurrently_in_order(self):
+        # Later invoices are answered faster, so responses arrive out of order
+        requests = [
+            self._request(f"delay:{(10 - i) * 0.03}", f"uuid-{i}", f"hash-{i}") for i in range(10)
+        ]
+        responses = report_invoices_sync(self.server_url, requests, concurrency=5)
+
+        self.assertNotEqual(FakeFatoora.answered, [r.invoice_uuid for r in requests])
+        self.assertEqual(len(responses), 10)
+        for request, (result, status_code) in zip(requests, responses):
+            self.assertTrue(is_ok(result))
+            self.assertEqual(status_code, 200)
+            self.assertEqual(result.ok_value.status, "REPORTED")
+            self.assertEqual(result.ok_value.invoice_hash, request.invoice_hash)
+        self.assertGreater(FakeFatoora.max_in_flight, 1)
+        self.assertLessEqual(FakeFatoora.max_in_flight, 5)
+
+    def test_rejection_returns_same_error_as_sync_client(self):
+        responses = report_invoices_sync(
+            self.server_url, [self._request("invoice", "ok"), self._request("rejected", "bad")]
+        )
+
+        self.assertTrue(is_ok(responses[0][0]))
+        result, status_code = responses[1]
+        self.assertTrue(is_err(result))
+        self.assertEqual(status_code, 400)
+        self.assertIsInstance(result.err_value, ReportOrClearInvoiceError)
+        self.assertEqual(result.err_value.error, "BR-KSA-01: Invalid invoice")
+
+    def test_retries_throttled_calls(self):
+        ((result, status_code),) = report_invoices_sync(
+            self.server_url, [self._request("throttled", "throttled")]
+        )
+
+        self.assertTrue(is_ok(result))
+        self.assertEqual(status_code, 200)
+        self.assertEqual(FakeFatoora.attempts["throttled"], 2)
+
+    def test_unreachable_server(self):
+        ((result, status_code),) = report_invoices_sync(
+            "http://127.0.0.1:1", [self._request("invoice", "unreachable")]
+        )
+
+        self.assertTrue(is_err(result))
+        self.assertEqual(status_code, 0)
+
+    def test_rate_limited_calls_are_not_sent(self):
+        frappe.conf.zatca_rate_limit_max_wait = 0.1
+        zatca_rate_limit.record_response(
+            zatca_rate_limit.get_bucket_key("token"),
+            frappe._dict(status_code=429, headers={"Retry-After": "30"}),
+        )
+
+        ((result, status_code),) = report_invoices_sync(
+            self.server_url, [self._request("invoice", "limited")]
+        )
+
+        self.assertTrue(is_err(result))
+        self.assertEqual(status_code, zatca_circuit_breaker.STATUS_CODE)
+        self.assertNotIn("limited", FakeFatoora.attempts)
+
+    def test_open_circuit_skips_calls(self):
+        for _ in range(zatca_circuit_breaker.DEFAULT_FAILURES):
+            zatca_circuit_breaker.record_result(self.server_url, 0)
+
+        ((result, status_code),) = report_invoices_sync(
+            self.server_url, [self._request("invoice", "skipped")]
+        )
+
+        self.assertTrue(is_err(result))
+        self.assertEqual(status_code, zatca_circuit_breaker.STATUS_CODE)
+        self.assertNotIn("skipped", FakeFatoora.attempts)
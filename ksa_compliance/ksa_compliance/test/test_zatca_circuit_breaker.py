@@ -0,0 +1,103 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import time
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import zatca_circuit_breaker
+
+SERVER = "https://fatoora.test/e-invoicing/core/"
+
+
+class TestZATCACircuitBreaker(FrappeTestCase):
+    def setUp(self):
+        frappe.conf.zatca_circuit_breaker_failures = 3
+        frappe.conf.zatca_circuit_breaker_open_seconds = 0.2
+        zatca_circuit_breaker.reset(SERVER)
+
+    def tearDown(self):
+        zatca_circuit_breaker.reset(SERVER)
+        for key in ("zatca_circuit_breaker_failures", "zatca_circuit_breaker_open_seconds"):
+            frappe.conf.pop(key, None)
+
+    def _open(self):
+        for _ in range(3):
+            zatca_circuit_breaker.record_result(SERVER, 503)
+
+    def test_opens_after_repeated_failures(self):
+        zatca_circuit_breaker.record_result(SERVER, 0)
+        zatca_circuit_breaker.record_result(SERVER, 504)
+        zatca_circuit_breaker.before_call(SERVER)
+
+        zatca_circuit_breaker.record_result(SERVER, 502)
+        with self.assertRaises(zatca_circuit_breaker.CircuitOpen):
+            zatca_circuit_breaker.before_call(SERVER)
+        # The trailing slash doesn't make it a different server
+        with self.assertRaises(zatca_circuit_breaker.CircuitOpen):
+            zatca_circuit_breaker.before_call(SERVER.rstrip("/"))
+
+    def test_stays_closed_while_most_calls_succeed(self):
+        for status_code in (200, 400, 500, 429):
+            zatca_circuit_breaker.record_result(SERVER, status_code)
+            zatca_circuit_breaker.record_result(SERVER, 200)
+        self._open()
+
+        zatca_circuit_breaker.before_call(SERVER)
+
+    def test_successful_probe_closes_the_circuit_and_sends_the_backlog(self):
+        self._open()
+        time.sleep(0.25)
+
+        # The first call probes, the others wait for its outcome
+        probe_id = zatca_circuit_breaker.before_call(SERVER)
+        with self.assertRaises(zatca_circuit_breaker.CircuitOpen):
+            zatca_circuit_breaker.before_call(SERVER)
+
+        with patch.object(frappe, "enqueue") as enqueue:
+            zatca_circuit_breaker.record_result(SERVER, 200, probe_id)
+
+        zatca_circuit_breaker.before_call(SERVER)
+        zatca_circuit_breaker.before_call(SERVER)
+        self.assertEqual(
+            enqueue.call_args.args[0], "ksa_compliance.background_jobs.sync_e_invoices"
+        )
+
+    def test_late_results_during_a_probe_are_ignored(self):
+        self._open()
+        time.sleep(0.25)
+        probe_id = zatca_circuit_breaker.before_call(SERVER)
+
+        # A call that started before the circuit opened succeeds while the probe is in flight
+        with patch.object(frappe, "enqueue") as enqueue:
+            zatca_circuit_breaker.record_result(SERVER, 200)
+        enqueue.assert_not_called()
+        with self.assertRaises(zatca_circuit_breaker.CircuitOpen):
+            zatca_circuit_breaker.before_call(SERVER)
+
+        zatca_circuit_breaker.record_result(SERVER, 0, probe_id)
+        # The failed probe's id is spent, so reporting it again changes nothing
+        with patch.object(frappe, "enqueue") as enqueue:
+            zatca_circuit_breaker.record_result(SERVER, 200, probe_id)
+        enqueue.assert_not_called()
+        with self.assertRaises(zatca_circuit_breaker.CircuitOpen):
+            zatca_circuit_breaker.before_call(SERVER)
+
+    def test_failed_probe_keeps_the_circuit_open_longer(self):
+        self._open()
+        time.sleep(0.25)
+        probe_id = zatca_circuit_breaker.before_call(SERVER)
+        zatca_circuit_breaker.record_result(SERVER, 0, probe_id)
+
+        time.sleep(0.25)
+        with self.assertRaises(zatca_circuit_breaker.CircuitOpen):
+            zatca_circuit_breaker.before_call(SERVER)
+        time.sleep(0.2)
+        zatca_circuit_breaker.before_call(SERVER)
+
+    def test_disabled_when_failures_is_zero(self):
+        frappe.conf.zatca_circuit_breaker_failures = 0
+        self._open()
+        zatca_circuit_breaker.before_call(SERVER)
@@ -0,0 +1,100 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import zatca_cli, zatca_cli_daemon
+from ksa_compliance.zatca_cli_worker import WorkerServer
+
+# Stands in for the CLI: echoes its arguments and JAVA_HOME, logs each run and fails or stalls when asked to
+FAKE_CLI = """#!{python}
+import json, os, sys, time
+with open(os.path.join(os.path.dirname(sys.argv[0]), "runs.log"), "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+if sys.argv[1] == "slow":
+    time.sleep(1)
+print(json.dumps({{"msg": "done", "errors": [], "data": {{"args": sys.argv[1:], "javaHome": os.environ.get("JAVA_HOME")}}}}))
+sys.exit(1 if sys.argv[1] == "fail" else 0)
+"""
+
+
+class TestZATCACliDaemon(FrappeTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cli_path = os.path.join(self.directory, "zatca-cli")
+        with open(self.cli_path, "w") as f:
+            f.write(FAKE_CLI.format(python=sys.executable))
+        os.chmod(self.cli_path, 0o700)
+        self.socket_path = os.path.join(self.directory, "worker.sock")
+        self.server = None
+
+    def tearDown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        for key in ("zatca_cli_daemon_socket", "zatca_cli_daemon_timeout"):
+            frappe.conf.pop(key, None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _start_worker(self):
+        self.server = WorkerServer(self.socket_path, self.cli_path)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        frappe.conf.zatca_cli_daemon_socket = self.socket_path
+
+    def _get_runs(self):
+        with open(os.path.join(self.directory, "runs.log")) as f:
+            return f.read().splitlines()
+
+    def test_round_trip_through_worker(self):
+        self._start_worker()
+
+        exit_code, output = zatca_cli_daemon.run(["sign", "-b", "invoice.xml"], "/opt/jre")
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(
+            output["data"], {"args": ["sign", "-b", "invoice.xml"], "javaHome": "/opt/jre"}
+        )
+
+        # The same connection serves the next command, and failures keep their exit code
+        exit_code, output = zatca_cli_daemon.run(["fail"], None)
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(output["msg"], "done")
+
+        result = zatca_cli.run_command(self.cli_path, ["validate", "-b", "invoice.xml"], None)
+        self.assertTrue(result.is_success)
+        self.assertEqual(result.data["args"], ["validate", "-b", "invoice.xml"])
+        self.assertEqual(
+            self._get_runs(), ["sign -b invoice.xml", "fail", "validate -b invoice.xml"]
+        )
+
+    def test_falls_back_to_spawning_the_cli(self):
+        frappe.conf.zatca_cli_daemon_socket = self.socket_path  # Nothing listens on it
+
+        self.assertIsNone(zatca_cli_daemon.run(["sign"], None))
+        result = zatca_cli.run_command(self.cli_path, ["sign", "-b", "invoice.xml"], "/opt/jre")
+        self.assertTrue(result.is_success)
+        self.assertEqual(result.data["javaHome"], "/opt/jre")
+        self.assertEqual(self._get_runs(), ["sign -b invoice.xml"])
+
+    def test_does_not_resend_after_read_timeout(self):
+        frappe.conf.zatca_cli_daemon_timeout = 0.3
+        self._start_worker()
+
+        started = time.monotonic()
+        with patch.object(zatca_cli, "spawn_command") as spawn_command:
+            result = zatca_cli.run_command(self.cli_path, ["slow"], None)
+        self.assertLess(time.monotonic() - started, 1)
+
+        # The command reached the worker, so it fails instead of being spawned again
+        self.assertFalse(result.is_success)
+        spawn_command.assert_not_called()
+        time.sleep(1.2)
+        self.assertEqual(self._get_runs(), ["slow"])
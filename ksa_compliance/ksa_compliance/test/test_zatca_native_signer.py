@@ -0,0 +1,109 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import base64
+import os
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import zatca_cli as cli
+from ksa_compliance import zatca_native_signer as native_signer
+from ksa_compliance.generate_xml import generate_xml_file
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import (
+    ZATCABusinessSettings,
+)
+from ksa_compliance.ksa_compliance.test.ksa_compliance_test_base import KSAComplianceTestBase
+from ksa_compliance.output_models.e_invoice_output_model import SalesEinvoice
+
+
+def _decode_tlv(qr_code: str) -> dict[int, bytes]:
+    data = base64.b64decode(qr_code)
+    values, index = {}, 0
+    while index < len(data):
+        tag, length = data[index], data[index + 1]
+        values[tag] = data[index + 2 : index + 2 + length]
+        index += 2 + length
+    return values
+
+
+class TestZATCANativeSigner(KSAComplianceTestBase):
+    """Conformance tests for the native signer, using invoices signed by ZATCA CLI as the reference"""
+
+    def setUp(self):
+        super().setUp()
+        invoice = self._create_test_sales_invoice()
+        self.settings = ZATCABusinessSettings.for_invoice(invoice.name, "Sales Invoice")
+        if not self.settings or not os.path.isfile(self.settings.cert_path):
+            self.skipTest("Native signer conformance tests require an onboarded business settings")
+
+        # Invoices are signed by the CLI, which serves as the golden reference
+        self.assertFalse(self.settings.is_native_signing)
+        self.siaf = frappe.get_last_doc(
+            "Sales Invoice Additional Fields", {"sales_invoice": invoice.name}
+        )
+
+    def _generate_unsigned_xml(self) -> str:
+        invoice_type = self.siaf._get_invoice_type(self.settings)
+        einvoice = SalesEinvoice(
+            sales_invoice_additional_fields_doc=self.siaf, invoice_type=invoice_type
+        )
+        return generate_xml_file(einvoice.result)
+
+    def test_invoice_hash_of_cli_signed_invoice(self):
+        """The native hash of a CLI-signed invoice matches the hash reported by the CLI"""
+        self.assertEqual(
+            native_signer.get_invoice_hash(self.siaf.get_signed_xml()), self.siaf.invoice_hash
+        )
+
+    def test_invoice_hash_matches_cli_for_same_input(self):
+        """Signing the same unsigned invoice natively yields the same invoice hash as the CLI"""
+        result = native_signer.sign_invoice(
+            self._generate_unsigned_xml(), self.settings.cert_path, self.settings.private_key_path
+        )
+        self.assertEqual(result.invoice_hash, self.siaf.invoice_hash)
+
+    def test_qr_code_matches_cli(self):
+        """Invoice fields and hash in the native QR code match the CLI QR code byte for byte"""
+        result = native_signer.sign_invoice(
+            self._generate_unsigned_xml(), self.settings.cert_path, self.settings.private_key_path
+        )
+        native_qr = _decode_tlv(result.qr_code)
+        cli_qr = _decode_tlv(self.siaf.qr_code)
+
+        # Tag 7 (signature) differs because ECDSA signatures are randomized
+        for tag in (1, 2, 3, 4, 5, 6, 8, 9):
+            self.assertEqual(native_qr.get(tag), cli_qr.get(tag), f"QR tag {tag} differs")
+
+    def test_native_signature_passes_cli_validation(self):
+        """Natively signed invoices pass signature and QR validation by the CLI"""
+        result = native_signer.sign_invoice(
+            self._generate_unsigned_xml(), self.settings.cert_path, self.settings.private_key_path
+        )
+        validation = cli.validate_invoice(
+            self.settings.zatca_cli_path,
+            self.settings.java_home,
+            result.get_signed_invoice_path(),
+            self.settings.cert_path,
+            self.siaf.previous_invoice_hash,
+        )
+        if not validation.details:
+            self.skipTest("Validation details require ZATCA CLI 2.1.0 or later")
+
+        self.assertTrue(validation.details.is_valid_signature, validation.details.errors)
+        self.assertTrue(validation.details.is_valid_qr, validation.details.errors)
+
+
+class TestZATCANativeSignerTlv(FrappeTestCase):
+    def test_encodes_tags_in_order(self):
+        tlv = base64.b64encode(
+            native_signer._encode_tlv([b"Seller", "بائع".encode(), b""])
+        ).decode()
+        self.assertEqual(_decode_tlv(tlv), {1: b"Seller", 2: "بائع".encode(), 3: b""})
+
+    def test_rejects_values_longer_than_a_byte_can_count(self):
+        native_signer._encode_tlv([b"x" * native_signer.MAX_TLV_VALUE_LENGTH])
+        with self.assertRaises(native_signer.QrFieldTooLong) as raised:
+            native_signer._encode_tlv([b"Seller", b"x" * 256])
+        self.assertEqual(raised.exception.field, "VAT Registration Number")
+        self.assertEqual(raised.exception.length, 256)
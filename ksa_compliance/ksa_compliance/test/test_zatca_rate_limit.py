@@ -0,0 +1,79 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import email.utils
+import time
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import zatca_rate_limit
+
+
+def _response(status_code: int, retry_after: str = None) -> frappe._dict:
+    return frappe._dict(
+        status_code=status_code, headers={"Retry-After": retry_after} if retry_after else {}
+    )
+
+
+class TestZATCARateLimit(FrappeTestCase):
+    def setUp(self):
+        frappe.conf.zatca_rate_limit_per_second = 2
+        self.csid = frappe.generate_hash()
+        self.key = zatca_rate_limit.get_bucket_key(self.csid)
+
+    def tearDown(self):
+        zatca_rate_limit.reset(self.csid)
+        for key in ("zatca_rate_limit_per_second", "zatca_rate_limit_max_wait"):
+            frappe.conf.pop(key, None)
+
+    def _get_rate(self) -> float:
+        # frappe's hget unpickles values, so the raw field is read with a script
+        return float(
+            frappe.cache().eval("return redis.call('HGET', KEYS[1], 'rate')", 1, self.key)
+        )
+
+    def test_bucket_allows_a_burst_then_paces_calls(self):
+        self.assertEqual(zatca_rate_limit._take(self.key), 0)
+        self.assertEqual(zatca_rate_limit._take(self.key), 0)
+
+        wait = zatca_rate_limit._take(self.key)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.5)
+
+    def test_throttling_halves_the_rate_and_holds_off_until_retry_after(self):
+        zatca_rate_limit._take(self.key)
+        zatca_rate_limit.record_response(self.key, _response(429, "3"))
+
+        self.assertEqual(self._get_rate(), 1)
+        self.assertGreater(zatca_rate_limit._take(self.key), 2)
+
+    def test_successful_calls_recover_the_rate(self):
+        zatca_rate_limit._take(self.key)
+        zatca_rate_limit.record_response(self.key, _response(429))
+        zatca_rate_limit.record_response(self.key, _response(200))
+
+        self.assertAlmostEqual(self._get_rate(), 1.2)
+        for _ in range(10):
+            zatca_rate_limit.record_response(self.key, _response(200))
+        self.assertEqual(self._get_rate(), 2)
+
+    def test_gives_up_instead_of_waiting_past_the_maximum(self):
+        frappe.conf.zatca_rate_limit_max_wait = 1
+        zatca_rate_limit.record_response(self.key, _response(503, "30"))
+
+        start = time.monotonic()
+        with self.assertRaises(zatca_rate_limit.RateLimited):
+            zatca_rate_limit.acquire(self.key)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_disabled_when_rate_is_zero(self):
+        frappe.conf.zatca_rate_limit_per_second = 0
+        for _ in range(10):
+            zatca_rate_limit.acquire(self.key)
+
+    def test_retry_after_as_http_date(self):
+        retry_at = email.utils.formatdate(time.time() + 120, usegmt=True)
+        self.assertAlmostEqual(
+            zatca_rate_limit.get_retry_after(_response(429, retry_at)), 120, delta=2
+        )
@@ -4,6 +4,8 @@
 ZATCA Tax Category and Invoice Integration Tests
 
 """
+
+import dataclasses
 import traceback
 
 import frappe
@@ -18,6 +20,7 @@ from ksa_compliance.ksa_compliance.test.test_invoice_helpers import (
     create_tax_category_with_zatca,
     ensure_test_item_exists,
 )
+from ksa_compliance.standard_doctypes.tax_category import map_tax_categories, map_tax_category
 from ksa_compliance.test.test_constants import (
     SAUDI_CURRENCY,
     TEST_COMPANY_NAME,
@@ -386,3 +389,44 @@ class TestZATCATaxCategoryIntegration(FrappeTestCase):
         frappe.logger().info(
             "\n✅✅✅ Advance payment ENTRY tax category test completed successfully ✅✅✅"
         )
+
+
+class TestMapTaxCategories(FrappeTestCase):
+    def setUp(self):
+        for cat in TAX_CATEGORIES:
+            create_tax_category_with_zatca(cat["name"], cat["custom_zatca_category"])
+
+    def test_batch_mapping_matches_single_mapping(self):
+        sources = [("Tax Category", cat["name"]) for cat in TAX_CATEGORIES]
+        mapped = map_tax_categories(sources)
+
+        self.assertEqual(len(mapped), len(TAX_CATEGORIES))
+        for source in sources:
+            self.assertEqual(mapped[source], map_tax_category(tax_category_id=source[1]))
+        self.assertEqual(mapped[("Tax Category", "CAT-S")].tax_category_code, "S")
+        self.assertEqual(mapped[("Tax Category", "CAT-Z")].reason_code, "VATEX-SA-32")
+        self.assertEqual(mapped[("Tax Category", "CAT-E")].reason_code, "VATEX-SA-30")
+
+    def test_mapped_categories_cannot_be_changed(self):
+        mapped = map_tax_category(tax_category_id="CAT-Z")
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            mapped.reason_code = "VATEX-SA-33"
+        self.assertEqual(map_tax_category(tax_category_id="CAT-Z").reason_code, "VATEX-SA-32")
+
+    def test_mapping_follows_tax_category_changes(self):
+        self.assertEqual(map_tax_category(tax_category_id="CAT-S").tax_category_code, "S")
+
+        tax_category = frappe.get_doc("Tax Category", "CAT-S")
+        tax_category.custom_zatca_category = "Zero rated goods || Export of services"
+        tax_category.save()
+        try:
+            mapped = map_tax_category(tax_category_id="CAT-S")
+            self.assertEqual(mapped.tax_category_code, "Z")
+            self.assertEqual(mapped.reason_code, "VATEX-SA-33")
+        finally:
+            tax_category.custom_zatca_category = "Standard rate"
+            tax_category.save()
+
+    def test_unknown_source_throws(self):
+        with self.assertRaises(frappe.DoesNotExistError):
+            map_tax_category(item_tax_template_id="Missing Item Tax Template")
@@ -0,0 +1,67 @@
+# Copyright (c) 2024, LavaLoon and Contributors
+# See license.txt
+
+import os
+import tempfile
+from unittest.mock import patch
+
+from frappe.tests.utils import FrappeTestCase
+
+from ksa_compliance import zatca_cli, zatca_workspace
+from ksa_compliance.zatca_cli import ZatcaResult
+
+
+class TestZATCAWorkspace(FrappeTestCase):
+    def _write_files(self, workspace):
+        external = tempfile.NamedTemporaryFile(suffix="-signed_invoice.xml", delete=False)
+        external.write(b"<Invoice/>")
+        external.close()
+        workspace.track(external.name)
+        return [workspace.write_text("<Invoice/>", "invoice.xml"), external.name]
+
+    def test_files_are_removed_when_scope_exits(self):
+        with zatca_workspace.scope() as workspace:
+            paths = self._write_files(workspace)
+            # Nested scopes share the workspace, so its files outlive them
+            with zatca_workspace.scope() as nested:
+                self.assertIs(nested, workspace)
+            self.assertTrue(all(os.path.isfile(path) for path in paths))
+
+        self.assertIsNone(zatca_workspace.current())
+        self.assertFalse(os.path.exists(workspace.path))
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_files_are_removed_when_scope_raises(self):
+        with self.assertRaises(RuntimeError):
+            with zatca_workspace.scope() as workspace:
+                paths = self._write_files(workspace)
+                raise RuntimeError
+
+        self.assertIsNone(zatca_workspace.current())
+        self.assertFalse(os.path.exists(workspace.path))
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_validate_invoice_removes_its_temp_files(self):
+        paths = []
+
+        def run_command(zatca_cli_path, args, java_home):
+            paths.append(zatca_cli.write_temp_file("<Invoice/>", "validation.xml"))
+            if args[-1] == "broken.xml":
+                raise RuntimeError
+            return ZatcaResult(
+                is_success=True,
+                msg="Validated",
+                errors=[],
+                data={"messages": [], "errorsAndWarnings": []},
+            )
+
+        with patch.object(zatca_cli, "run_command", side_effect=run_command):
+            zatca_cli.validate_invoice("/opt/zatca/bin/zatca-cli", None, "invoice.xml", "cert", "")
+            with self.assertRaises(RuntimeError):
+                zatca_cli.validate_invoice(
+                    "/opt/zatca/bin/zatca-cli", None, "broken.xml", "cert", ""
+                )
+
+        self.assertEqual(len(paths), 2)
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+        self.assertIsNone(zatca_workspace.current())
@@ -20,11 +20,12 @@ from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_busines
 from ksa_compliance.ksa_compliance.doctype.zatca_return_against_reference.zatca_return_against_reference import (
     ZATCAReturnAgainstReference,
 )
+from ksa_compliance.party_identification import BUYER_ID_PRIORITY, SELLER_ID_PRIORITY
 from ksa_compliance.standard_doctypes.sales_invoice_advance import (
     calculate_advance_payment_tax_amount,
     get_invoice_advance_payments,
 )
-from ksa_compliance.standard_doctypes.tax_category import map_tax_category
+from ksa_compliance.standard_doctypes.tax_category import map_tax_categories, map_tax_category
 from ksa_compliance.throw import fthrow
 from ksa_compliance.translation import ft
 from ksa_compliance.utils.advance_payment_entry_taxes_and_charges import get_taxes_and_charges
@@ -73,20 +74,22 @@ def append_tax_categories_to_item(item_lines: list, taxes_and_charges: str | Non
         )
     else:
         tax_category_id = None
-    unique_tax_categories = {}
-    for item in item_lines:
+
+    def get_source(item: dict) -> tuple[str, str]:
         if item["item_tax_template"]:
-            item_tax_category = map_tax_category(item_tax_template_id=item["item_tax_template"])
-        else:
-            if tax_category_id:
-                item_tax_category = map_tax_category(tax_category_id=tax_category_id)
-            else:
-                item_tax_category = None
-                frappe.throw(
-                    "Please Include Sales Taxes and Charges Template on invoice\n"
-                    f"Or include Item Tax Template on {item['item_name']}"
-                )
+            return "Item Tax Template", item["item_tax_template"]
+        if not tax_category_id:
+            frappe.throw(
+                "Please Include Sales Taxes and Charges Template on invoice\n"
+                f"Or include Item Tax Template on {item['item_name']}"
+            )
+        return "Tax Category", tax_category_id
 
+    # Resolve all lines at once rather than one lookup per line
+    tax_categories = map_tax_categories([get_source(item) for item in item_lines])
+    unique_tax_categories = {}
+    for item in item_lines:
+        item_tax_category = tax_categories[get_source(item)]
         item["tax_category_code"] = item_tax_category.tax_category_code
         item_tax_category_details = {
             "tax_category_code": item["tax_category_code"],
@@ -368,6 +371,17 @@ class Einvoice:
             parent="invoice",
         )
 
+    def set_chain_position(self, invoice_counter: int, previous_invoice_hash: str) -> None:
+        """
+        Sets the invoice counter (ICV) and previous invoice hash (PIH). These are the only values that depend on the
+        invoice hash chain, so the rest of the invoice can be prepared before locking the chain.
+        """
+        self.result["invoice"]["invoice_counter_value"] = invoice_counter
+        # Stripped and left out when empty, as get_text_value does for the other text fields
+        self.result["invoice"].pop("pih", None)
+        if previous_invoice_hash and previous_invoice_hash.strip():
+            self.result["invoice"]["pih"] = previous_invoice_hash.strip()
+
     # --------------------------- START helper functions ------------------------------
 
     def get_text_value(
@@ -500,21 +514,9 @@ class Einvoice:
 
         if xml_name == "party_identifications":
             if parent == "seller_details":
-                party_list = ["CRN", "MOM", "MLS", "700", "SAG", "OTH"]
+                party_list = SELLER_ID_PRIORITY
             else:  # buyer_details
-                party_list = [
-                    "TIN",
-                    "CRN",
-                    "MOM",
-                    "MLS",
-                    "700",
-                    "SAG",
-                    "NAT",
-                    "GCC",
-                    "IQA",
-                    "PAS",
-                    "OTH",
-                ]
+                party_list = BUYER_ID_PRIORITY
             if field_value:
                 field_value = self.validate_scheme_with_order(
                     field_value=field_value, ordered_list=party_list
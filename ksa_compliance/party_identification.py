@@ -0,0 +1,95 @@
+"""
+Other IDs (commercial registration, national ID, passport, etc.) of sellers and buyers.
+
+A party can have several IDs, and ZATCA expects the first one by scheme priority. [get_seller_other_id] and
+[get_buyer_other_id] read all IDs of a party in one query, cache them in Redis per party, and pick the match in memory.
+The cache entry of a party is dropped whenever its Customer, Branch or ZATCA Business Settings is saved, renamed or
+deleted.
+"""
+
+from typing import List, Optional, Tuple
+
+import frappe
+from frappe.utils import strip
+
+# Scheme codes by priority, as the ZATCA data dictionary orders them for the seller and buyer party identifications
+SELLER_ID_PRIORITY = ["CRN", "MOM", "MLS", "700", "SAG", "OTH"]
+BUYER_ID_PRIORITY = ["TIN", "CRN", "MOM", "MLS", "700", "SAG", "NAT", "GCC", "IQA", "PAS", "OTH"]
+
+DEFAULT_ID_NAME = "Commercial Registration Number"
+
+_CACHE_KEY = "zatca_party_ids"
+
+# (child doctype, parent field) of the other IDs table of each party doctype
+_ID_TABLES = {
+    "ZATCA Business Settings": ("Additional Seller IDs", "other_ids"),
+    "Branch": ("Additional Seller IDs", "custom_branch_ids"),
+    "Customer": ("Additional Buyer IDs", "custom_additional_ids"),
+}
+
+
+def get_party_ids(party_doctype: str, party: str) -> List[dict]:
+    """Returns the other IDs (type_code, type_name and value) of a party, in table order"""
+    key = f"{party_doctype}::{party}"
+    ids = frappe.cache().hget(_CACHE_KEY, key)
+    if ids is None:
+        doctype, parentfield = _ID_TABLES[party_doctype]
+        ids = frappe.get_all(
+            doctype,
+            filters={"parenttype": party_doctype, "parent": party, "parentfield": parentfield},
+            fields=["type_code", "type_name", "value"],
+            order_by="idx",
+        )
+        ids = [dict(row) for row in ids]
+        frappe.cache().hset(_CACHE_KEY, key, ids)
+    return ids
+
+
+def find_by_priority(ids: List[dict], priority: List[str]) -> Optional[dict]:
+    """Returns the ID with a non-blank value whose scheme comes first in [priority], if any"""
+    by_code = {}
+    for row in ids:
+        if strip(row.get("value") or "") and row.get("type_code") not in by_code:
+            by_code[row.get("type_code")] = row
+    for type_code in priority:
+        if type_code in by_code:
+            return by_code[type_code]
+    return None
+
+
+def get_seller_other_id(
+    settings_name: str, branch: Optional[str] = None
+) -> Tuple[Optional[str], str]:
+    """
+    Returns the (value, name) of the seller ID to print. With branch configuration, the branch CRN takes precedence
+    over the business settings IDs
+    """
+    if branch:
+        crn = find_by_priority(get_party_ids("Branch", branch), ["CRN"])
+        if crn:
+            return strip(crn["value"]), DEFAULT_ID_NAME
+
+    match = find_by_priority(
+        get_party_ids("ZATCA Business Settings", settings_name), SELLER_ID_PRIORITY
+    )
+    if not match:
+        return None, DEFAULT_ID_NAME
+    return strip(match["value"]), match.get("type_name") or DEFAULT_ID_NAME
+
+
+def get_buyer_other_id(customer: str) -> Tuple[Optional[str], str]:
+    """Returns the (value, name) of the buyer ID to print"""
+    match = find_by_priority(get_party_ids("Customer", customer), BUYER_ID_PRIORITY)
+    if not match:
+        return None, DEFAULT_ID_NAME
+    return strip(match["value"]), match.get("type_name") or DEFAULT_ID_NAME
+
+
+def clear_party_ids(doc, method=None, *args) -> None:
+    """Drops the cached IDs of a party. Hooked to the save, rename and delete of every party doctype"""
+    names = [doc.name]
+    if method == "after_rename" and args:
+        # after_rename is called with (old name, new name, merge)
+        names.append(args[0])
+    for name in names:
+        frappe.cache().hdel(_CACHE_KEY, f"{doc.doctype}::{name}")
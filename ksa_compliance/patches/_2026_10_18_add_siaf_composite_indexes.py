@@ -0,0 +1,17 @@
+import frappe
+
+# (index name, columns). The sync index leads with docstatus (an equality filter) followed by the keyset columns, so
+# pending rows are read straight off the index in (creation, name) order without a filesort, and integration_status
+# is checked from the index too. The latest index serves the is_latest updates on insert and the report joins.
+INDEXES = [
+    ("lava_siaf_sync_queue", "docstatus, creation, name, integration_status"),
+    ("lava_siaf_latest", "sales_invoice, is_latest"),
+]
+
+
+def execute():
+    for index_name, columns in INDEXES:
+        frappe.db.sql(
+            f"CREATE INDEX IF NOT EXISTS {index_name} ON "
+            f"`tabSales Invoice Additional Fields` ({columns})"
+        )
@@ -0,0 +1,12 @@
+import frappe
+
+
+def execute():
+    """Seeds the per-invoice integration log series with the highest attempt number already used for each invoice"""
+    frappe.db.sql(
+        "INSERT INTO `tabSeries` (name, current) "
+        "SELECT CONCAT('log-', invoice_reference, '-'), "
+        "       MAX(CAST(SUBSTRING_INDEX(name, '-', -1) AS UNSIGNED)) "
+        "FROM `tabZATCA Integration Log` GROUP BY invoice_reference "
+        "ON DUPLICATE KEY UPDATE current = GREATEST(current, VALUES(current))"
+    )
@@ -0,0 +1,7 @@
+from ksa_compliance.ksa_compliance.doctype.zatca_integration_status_rollup.zatca_integration_status_rollup import (
+    rebuild,
+)
+
+
+def execute():
+    rebuild()
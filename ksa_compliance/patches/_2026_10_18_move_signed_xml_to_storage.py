@@ -0,0 +1,46 @@
+import frappe
+
+from ksa_compliance import logger
+from ksa_compliance.ksa_compliance.doctype.zatca_signed_xml.zatca_signed_xml import (
+    store_signed_xml,
+)
+
+# Rows moved per transaction. Each batch is committed, so an interrupted migration resumes where it stopped
+BATCH_SIZE = 500
+
+
+def execute():
+    for doctype in ("ZATCA Precomputed Invoice", "Sales Invoice Additional Fields"):
+        _move_signed_xml(doctype)
+
+
+def _move_signed_xml(doctype: str) -> None:
+    """Moves the invoice_xml of every [doctype] row to ZATCA Signed XML, walking the table in primary key order"""
+    table = f"`tab{doctype}`"
+    after, moved = "", 0
+    while True:
+        rows = frappe.db.sql(
+            f"""
+                SELECT name, invoice_xml FROM {table}
+                WHERE name > %(after)s AND invoice_xml IS NOT NULL AND invoice_xml != ''
+                ORDER BY name
+                LIMIT %(limit)s
+            """,
+            {"after": after, "limit": BATCH_SIZE},
+            as_dict=True,
+        )
+        if not rows:
+            break
+
+        for row in rows:
+            # The modified timestamp is left alone: the document itself didn't change
+            frappe.db.sql(
+                f"UPDATE {table} SET signed_xml = %(key)s, invoice_xml = NULL WHERE name = %(name)s",
+                {"key": store_signed_xml(row.invoice_xml), "name": row.name},
+            )
+        frappe.db.commit()
+
+        moved += len(rows)
+        after = rows[-1].name
+
+    logger.info(f"Moved the signed XML of {moved} {doctype} documents to ZATCA Signed XML")
@@ -0,0 +1,213 @@
+"""
+Bulk export of ZATCA PDF/A-3b invoices.
+
+[download_zatca_pdf] prints, converts and downloads one invoice within the web request, which doesn't scale to the
+thousands of invoices auditors ask for. [export_pdfs] takes the filters of the ZATCA Integration Details report
+(company, date range and integration status) and enqueues a job that prints and converts every matching sales invoice
+with a bounded pool of worker threads. Each PDF is written to a zip archive as soon as it's ready, so only a few are
+held in memory at a time, and the requesting user sees the progress and gets a link to the archive when it's done.
+Invoices that fail are listed in 'errors.txt' inside the archive instead of failing the whole export.
+
+The pool size is read from the 'zatca_pdf_export_concurrency' site config key. Conversions go through
+[zatca_cli.run_command], so they're sent to the CLI signing worker when one is configured.
+"""
+
+import json
+import queue
+import threading
+import zipfile
+from typing import List, NamedTuple, Optional
+
+import frappe
+import frappe.utils.background_jobs
+from frappe import _
+from frappe.utils import cint
+
+from ksa_compliance import logger
+from ksa_compliance.exports import export_path, publish_export
+from ksa_compliance.jinja import clear_print_contexts
+from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
+    render_zatca_pdf,
+)
+from ksa_compliance.ksa_compliance.doctype.zatca_business_settings.zatca_business_settings import (
+    ZATCABusinessSettings,
+)
+from ksa_compliance.ksa_compliance.report.zatca_integration_details.zatca_integration_details import (
+    iter_zatca_integration_details_data,
+    validate_filters,
+)
+from ksa_compliance.throw import fthrow
+from ksa_compliance.translation import ft
+from ksa_compliance.zatca_cli import check_pdfa3b_support_or_throw
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PRINT_FORMAT = "ZATCA Phase 2 Print Format"
+
+# Printing and converting thousands of invoices takes far longer than the long queue's default timeout
+EXPORT_TIMEOUT_SECONDS = 6 * 60 * 60
+
+
+class ExportedPdf(NamedTuple):
+    sales_invoice: str
+    content: Optional[bytes]
+    error: Optional[str]
+
+
+def get_concurrency() -> int:
+    return max(cint(frappe.conf.get("zatca_pdf_export_concurrency")) or DEFAULT_CONCURRENCY, 1)
+
+
+@frappe.whitelist()
+def export_pdfs(filters: str, print_format: str = DEFAULT_PRINT_FORMAT, lang: str = "en") -> None:
+    """Exports the PDF/A-3b of every invoice matching the ZATCA Integration Details report [filters] to a zip archive"""
+    filters = frappe._dict(json.loads(filters) if isinstance(filters, str) else filters)
+    if not frappe.has_permission("Sales Invoice", "print"):
+        frappe.throw(_("Not permitted"), frappe.PermissionError)
+    validate_filters(filters)
+
+    settings = ZATCABusinessSettings.for_company(filters["company_filter"])
+    if not settings:
+        fthrow(
+            ft(
+                "Company $company does not have ZATCA Business Settings",
+                company=filters["company_filter"],
+            )
+        )
+    # Fail now rather than once per invoice in the job
+    check_pdfa3b_support_or_throw(settings.zatca_cli_path, settings.java_home)
+
+    frappe.utils.background_jobs.enqueue(
+        _export_pdfs,
+        queue="long",
+        timeout=EXPORT_TIMEOUT_SECONDS,
+        filters=filters,
+        print_format=print_format,
+        lang=lang,
+        user=frappe.session.user,
+    )
+    frappe.msgprint(_("The export has started. You'll be notified when the file is ready"))
+
+
+def _export_pdfs(filters: dict, print_format: str, lang: str, user: str) -> None:
+    invoices = [row["invoice_id"] for row in iter_zatca_integration_details_data(filters)]
+    concurrency = get_concurrency()
+    logger.info(f"Exporting {len(invoices)} ZATCA PDF/A-3b invoices with {concurrency} workers")
+
+    with export_path("zatca-pdf-a3b", "zip") as (file_name, path):
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+            errors = write_pdfs(archive, invoices, print_format, lang, user, concurrency)
+            if errors:
+                archive.writestr("errors.txt", "\n".join(errors))
+
+    message = _("ZATCA PDF/A-3b export is ready: {0}")
+    if errors:
+        message += "<br>" + _(
+            "{0} invoices could not be exported. See errors.txt in the archive"
+        ).format(len(errors))
+    publish_export(file_name, user, message)
+
+
+def write_pdfs(
+    archive: zipfile.ZipFile,
+    invoices: List[str],
+    print_format: str,
+    lang: str,
+    user: str,
+    concurrency: int,
+) -> List[str]:
+    """
+    Prints and converts [invoices] with [concurrency] worker threads and writes the PDFs to [archive] in the order they
+    complete. Returns the errors of the invoices that couldn't be exported
+    """
+    tasks: queue.Queue = queue.Queue()
+    for invoice in invoices:
+        tasks.put(invoice)
+    # Bounded, so workers wait for the archive to catch up instead of piling up PDFs in memory
+    results: queue.Queue = queue.Queue(maxsize=concurrency * 2)
+
+    workers = [
+        threading.Thread(
+            target=_work,
+            args=(frappe.local.site, user, tasks, results, print_format, lang),
+            name=f"zatca-pdf-export-{i}",
+            daemon=True,
+        )
+        for i in range(min(concurrency, len(invoices)))
+    ]
+    for worker in workers:
+        worker.start()
+
+    errors = []
+    last_percent = -1
+    for done in range(1, len(invoices) + 1):
+        result: ExportedPdf = results.get()
+        if result.error:
+            errors.append(f"{result.sales_invoice}: {result.error}")
+        else:
+            archive.writestr(f"{result.sales_invoice.replace('/', '-')}_a3b.pdf", result.content)
+
+        percent = done * 100 // len(invoices)
+        if percent != last_percent:
+            last_percent = percent
+            frappe.publish_progress(
+                percent,
+                title=_("Exporting ZATCA PDF/A-3b"),
+                description=_("{0} of {1} invoices").format(done, len(invoices)),
+            )
+
+    for worker in workers:
+        worker.join()
+    return errors
+
+
+def _work(
+    site: str,
+    user: str,
+    tasks: queue.Queue,
+    results: queue.Queue,
+    print_format: str,
+    lang: str,
+) -> None:
+    # frappe keeps the database connection and the CLI workspace per thread, so every worker needs its own
+    init_error = None
+    try:
+        frappe.init(site=site)
+        frappe.connect()
+        frappe.set_user(user)
+    except Exception as e:
+        logger.error("Failed to start ZATCA PDF export worker", exc_info=e)
+        init_error = str(e)
+
+    try:
+        while True:
+            try:
+                invoice = tasks.get_nowait()
+            except queue.Empty:
+                return
+
+            if init_error:
+                results.put(ExportedPdf(invoice, None, init_error))
+                continue
+
+            try:
+                results.put(ExportedPdf(invoice, _render(invoice, print_format, lang), None))
+            except Exception as e:
+                logger.warning(f"Failed to export ZATCA PDF/A-3b for {invoice}", exc_info=e)
+                results.put(ExportedPdf(invoice, None, str(e) or type(e).__name__))
+            finally:
+                frappe.local.message_log = []
+                clear_print_contexts()
+    finally:
+        frappe.destroy()
+
+
+def _render(invoice: str, print_format: str, lang: str) -> bytes:
+    siaf_id = frappe.db.get_value(
+        "Sales Invoice Additional Fields", {"sales_invoice": invoice, "is_latest": 1}
+    )
+    if not siaf_id:
+        fthrow(
+            ft("No Sales Invoice Additional Fields found for invoice $invoice", invoice=invoice)
+        )
+    siaf = frappe.get_doc("Sales Invoice Additional Fields", siaf_id)
+    return render_zatca_pdf(siaf, print_format, lang)
@@ -0,0 +1,68 @@
+"""
+Rendering of invoice QR codes for print formats.
+
+A QR image only depends on its payload (the TLV string for phase 1 or the signed invoice's QR for phase 2), so rendered
+images are cached by a hash of the payload. Lookups go through a small per-process LRU first, then Redis, whose
+allkeys-lru policy (the bench default for the cache instance) evicts the least used images once it fills up. Bulk
+printing and email batches then encode each QR once instead of every time a print format renders it.
+
+Images are PNG by default. Setting the 'zatca_qr_image_format' site config key to 'svg' renders SVG instead, which
+skips PNG encoding altogether.
+"""
+
+import base64
+import hashlib
+from functools import lru_cache
+from io import BytesIO
+from typing import Literal, Optional
+
+import frappe
+import pyqrcode
+
+ImageFormat = Literal["png", "svg"]
+
+_CACHE_KEY_PREFIX = "zatca_qr_image"
+_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+_SCALE = 7
+_MIME_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def get_image_format() -> ImageFormat:
+    image_format = frappe.conf.get("zatca_qr_image_format") or "png"
+    return "svg" if image_format == "svg" else "png"
+
+
+def get_qr_base64(payload: str, image_format: Optional[ImageFormat] = None) -> Optional[str]:
+    """Returns the base64-encoded QR image for [payload], or None if there's no payload"""
+    if not payload:
+        return None
+    return _get_cached(payload, image_format or get_image_format())
+
+
+def get_qr_data_uri(payload: str, image_format: Optional[ImageFormat] = None) -> Optional[str]:
+    """Returns the QR image for [payload] as a data URI that can be used as an image source"""
+    if not payload:
+        return None
+    image_format = image_format or get_image_format()
+    return f"data:{_MIME_TYPES[image_format]};base64,{_get_cached(payload, image_format)}"
+
+
+@lru_cache(maxsize=512)
+def _get_cached(payload: str, image_format: ImageFormat) -> str:
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    key = f"{_CACHE_KEY_PREFIX}:{image_format}:{digest}"
+    image = frappe.cache().get_value(key)
+    if image is None:
+        image = _render(payload, image_format)
+        frappe.cache().set_value(key, image, expires_in_sec=_CACHE_TTL_SECONDS)
+    return image
+
+
+def _render(payload: str, image_format: ImageFormat) -> str:
+    qr = pyqrcode.create(payload)
+    with BytesIO() as buffer:
+        if image_format == "svg":
+            qr.svg(buffer, scale=_SCALE, background="#fff")
+        else:
+            qr.png(buffer, scale=_SCALE)
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
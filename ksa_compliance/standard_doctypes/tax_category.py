@@ -1,37 +1,99 @@
 from dataclasses import dataclass
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, Iterable, Literal, Optional, Tuple
 
 import frappe
 
 
-@dataclass
+@dataclass(frozen=True)
 class ZatcaTaxCategory:
-    """Holds ZATCA tax category code, reason and reason code"""
+    """
+    Holds ZATCA tax category code, reason and reason code. Mapped categories are cached and shared between callers,
+    so they're immutable
+    """
 
     tax_category_code: str = None
     reason_code: Optional[str] = None
     arabic_reason: Optional[str] = None
 
 
+TaxCategorySource = Tuple[Literal["Tax Category", "Item Tax Template"], str]
+
+# Maps each tax category and item tax template to its (ZATCA category, custom reason). Both doctypes are small and
+# rarely change, so the whole index is loaded in one go and cleared by their doc events
+_INDEX_CACHE_KEY = "zatca_tax_category_index"
+
+
 def map_tax_category(
     tax_category_id: Optional[str] = None, item_tax_template_id: Optional[str] = None
 ) -> ZatcaTaxCategory:
     if tax_category_id:
-        zatca_category, custom_category_reason = frappe.get_value(
-            "Tax Category",
-            {"name": tax_category_id},
-            ["custom_zatca_category", "custom_category_reason"],
-        )
+        source = ("Tax Category", tax_category_id)
     elif item_tax_template_id:
-        zatca_category, custom_category_reason = frappe.get_value(
-            "Item Tax Template",
-            {"name": item_tax_template_id},
-            ["custom_zatca_item_tax_category", "custom_category_reason"],
-        )
+        source = ("Item Tax Template", item_tax_template_id)
     else:
-        zatca_category = "Standard rate"
-        custom_category_reason = None
+        return _to_zatca_tax_category(None, None)
+
+    return map_tax_categories([source])[source]
+
+
+def map_tax_categories(
+    sources: Iterable[TaxCategorySource],
+) -> Dict[TaxCategorySource, ZatcaTaxCategory]:
+    """
+    Maps tax categories and item tax templates, given as (doctype, name) pairs, to their ZATCA tax categories. This
+    needs at most one index load no matter how many sources are passed, so a whole invoice can be resolved at once.
+    """
+    sources = set(sources)
+    index = _get_index()
+    if not sources.issubset(index):
+        # Records written without doc events (e.g. direct database inserts) aren't in the index, so reload it once
+        clear_tax_category_index()
+        index = _get_index()
+
+    result = {}
+    for source in sources:
+        if source not in index:
+            frappe.throw(
+                frappe._("{0} {1} not found").format(frappe._(source[0]), source[1]),
+                frappe.DoesNotExistError,
+            )
+        result[source] = _to_zatca_tax_category(*index[source])
+    return result
+
+
+def clear_tax_category_index(doc=None, method=None) -> None:
+    """Clears the tax category index. Hooked to Tax Category and Item Tax Template changes"""
+    frappe.cache().delete_value(_INDEX_CACHE_KEY)
 
+
+def _get_index() -> Dict[TaxCategorySource, Tuple[Optional[str], Optional[str]]]:
+    index = frappe.cache().get_value(_INDEX_CACHE_KEY)
+    if index is not None:
+        return index
+
+    index = {}
+    for row in frappe.get_all(
+        "Tax Category", fields=["name", "custom_zatca_category", "custom_category_reason"]
+    ):
+        index[("Tax Category", row.name)] = (row.custom_zatca_category, row.custom_category_reason)
+    for row in frappe.get_all(
+        "Item Tax Template",
+        fields=["name", "custom_zatca_item_tax_category", "custom_category_reason"],
+    ):
+        index[("Item Tax Template", row.name)] = (
+            row.custom_zatca_item_tax_category,
+            row.custom_category_reason,
+        )
+
+    frappe.cache().set_value(_INDEX_CACHE_KEY, index)
+    return index
+
+
+@lru_cache(maxsize=256)
+def _to_zatca_tax_category(
+    zatca_category: Optional[str], custom_category_reason: Optional[str]
+) -> ZatcaTaxCategory:
     zatca_category = zatca_category if zatca_category else "Standard rate"
     if zatca_category == "Standard rate":
         return ZatcaTaxCategory(_category_to_code(zatca_category))
@@ -46,85 +108,90 @@ def map_tax_category(
     )
 
 
+_CATEGORY_CODES = {
+    "Standard rate": "S",
+    "Exempt from Tax": "E",
+    "Zero rated goods": "Z",
+    "Services outside scope of tax / Not subject to VAT": "O",
+}
+
+# TODO: Update the lookup to use reason code instead of text decoded from the select field in tax category doctype.
+_REASONS = {
+    "Financial services mentioned in Article 29 of the VAT Regulations": {
+        "reason_code": "VATEX-SA-29",
+        "arabic_reason": "عقد تأمين على الحياة",
+    },
+    "Life insurance services mentioned in Article 29 of the VAT Regulations": {
+        "reason_code": "VATEX-SA-29-7",
+        "arabic_reason": "الخدمات المالية",
+    },
+    "Real estate transactions mentioned in Article 30 of the VAT Regulations": {
+        "reason_code": "VATEX-SA-30",
+        "arabic_reason": "التوريدات العقارية المعفاة من الضريبة",
+    },
+    "Export of goods": {
+        "reason_code": "VATEX-SA-32",
+        "arabic_reason": "صادرات السلع من المملكة",
+    },
+    "Export of services": {
+        "reason_code": "VATEX-SA-33",
+        "arabic_reason": "صادرات الخدمات من المملكة",
+    },
+    "The international transport of Goods": {
+        "reason_code": "VATEX-SA-34-1",
+        "arabic_reason": "النقل الدولي للسلع",
+    },
+    "International transport of passengers": {
+        "reason_code": "VATEX-SA-34-2",
+        "arabic_reason": "النقل الدولي للركاب",
+    },
+    "Services directly connected and incidental to a Supply of international passenger transport": {
+        "reason_code": "VATEX-SA-34-3",
+        "arabic_reason": "الخدمات المرتبطة مباشرة او عرضيًا بتوريد النقل الدولي للركاب",
+    },
+    "Supply of a qualifying means of transport": {
+        "reason_code": "VATEX-SA-34-4",
+        "arabic_reason": "توريد وسائل النقل المؤهلة",
+    },
+    "Any services relating to Goods or passenger transportation as defined in article twenty five of these "
+    "Regulations": {
+        "reason_code": "VATEX-SA-34-5",
+        "arabic_reason": "الخدمات ذات الصلة بنقل السلع او الركاب، وفقاً للتعريف الوارد بالمادة الخامسة و العشرين "
+        "من اللائحة التنفيذية لنظام ضريبة القيمة المضافة",
+    },
+    "Medicines and medical equipment": {
+        "reason_code": "VATEX-SA-35",
+        "arabic_reason": "الادوية والمعدات الطبية",
+    },
+    "Qualifying metals": {
+        "reason_code": "VATEX-SA-36",
+        "arabic_reason": "المعادن المؤهلة",
+    },
+    "Private education to citizen": {
+        "reason_code": "VATEX-SA-EDU",
+        "arabic_reason": "الخدمات التعليمية الخاصة للمواطنين",
+    },
+    "Private healthcare to citizen": {
+        "reason_code": "VATEX-SA-HEA",
+        "arabic_reason": "الخدمات الصحية الخاصة للمواطنين",
+    },
+    "Supply of qualified military goods": {
+        "reason_code": "VATEX-SA-MLTRY",
+        "arabic_reason": "توريد السلع العسكرية المؤهلة",
+    },
+    "{manual entry}": {"reason_code": "VATEX-SA-OOS", "arabic_reason": None},
+    "Qualified Supply of Goods in Duty Free area": {
+        "reason_code": "VATEX-SA-DUTYFREE",
+        "arabic_reason": "التوريد المؤهل للسلع في الأسواق الحرة",
+    },
+}
+
+
 def _category_to_code(category: str) -> str:
-    categories = {
-        "Standard rate": "S",
-        "Exempt from Tax": "E",
-        "Zero rated goods": "Z",
-        "Services outside scope of tax / Not subject to VAT": "O",
-    }
-    return categories[category]
+    return _CATEGORY_CODES[category]
 
 
 def _reason_to_code_and_arabic(reason: str, input_reason: Optional[str] = None) -> dict:
-    # TODO: Update the lookup to use reason code instead of text decoded from the select field in tax category doctype.
-    reasons = {
-        "Financial services mentioned in Article 29 of the VAT Regulations": {
-            "reason_code": "VATEX-SA-29",
-            "arabic_reason": "عقد تأمين على الحياة",
-        },
-        "Life insurance services mentioned in Article 29 of the VAT Regulations": {
-            "reason_code": "VATEX-SA-29-7",
-            "arabic_reason": "الخدمات المالية",
-        },
-        "Real estate transactions mentioned in Article 30 of the VAT Regulations": {
-            "reason_code": "VATEX-SA-30",
-            "arabic_reason": "التوريدات العقارية المعفاة من الضريبة",
-        },
-        "Export of goods": {
-            "reason_code": "VATEX-SA-32",
-            "arabic_reason": "صادرات السلع من المملكة",
-        },
-        "Export of services": {
-            "reason_code": "VATEX-SA-33",
-            "arabic_reason": "صادرات الخدمات من المملكة",
-        },
-        "The international transport of Goods": {
-            "reason_code": "VATEX-SA-34-1",
-            "arabic_reason": "النقل الدولي للسلع",
-        },
-        "International transport of passengers": {
-            "reason_code": "VATEX-SA-34-2",
-            "arabic_reason": "النقل الدولي للركاب",
-        },
-        "Services directly connected and incidental to a Supply of international passenger transport": {
-            "reason_code": "VATEX-SA-34-3",
-            "arabic_reason": "الخدمات المرتبطة مباشرة او عرضيًا بتوريد النقل الدولي للركاب",
-        },
-        "Supply of a qualifying means of transport": {
-            "reason_code": "VATEX-SA-34-4",
-            "arabic_reason": "توريد وسائل النقل المؤهلة",
-        },
-        "Any services relating to Goods or passenger transportation as defined in article twenty five of these "
-        "Regulations": {
-            "reason_code": "VATEX-SA-34-5",
-            "arabic_reason": "الخدمات ذات الصلة بنقل السلع او الركاب، وفقاً للتعريف الوارد بالمادة الخامسة و العشرين "
-            "من اللائحة التنفيذية لنظام ضريبة القيمة المضافة",
-        },
-        "Medicines and medical equipment": {
-            "reason_code": "VATEX-SA-35",
-            "arabic_reason": "الادوية والمعدات الطبية",
-        },
-        "Qualifying metals": {
-            "reason_code": "VATEX-SA-36",
-            "arabic_reason": "المعادن المؤهلة",
-        },
-        "Private education to citizen": {
-            "reason_code": "VATEX-SA-EDU",
-            "arabic_reason": "الخدمات التعليمية الخاصة للمواطنين",
-        },
-        "Private healthcare to citizen": {
-            "reason_code": "VATEX-SA-HEA",
-            "arabic_reason": "الخدمات الصحية الخاصة للمواطنين",
-        },
-        "Supply of qualified military goods": {
-            "reason_code": "VATEX-SA-MLTRY",
-            "arabic_reason": "توريد السلع العسكرية المؤهلة",
-        },
-        "{manual entry}": {"reason_code": "VATEX-SA-OOS", "arabic_reason": input_reason},
-        "Qualified Supply of Goods in Duty Free area": {
-            "reason_code": "VATEX-SA-DUTYFREE",
-            "arabic_reason": "التوريد المؤهل للسلع في الأسواق الحرة",
-        },
-    }
-    return reasons[reason]
+    if reason == "{manual entry}":
+        return {**_REASONS[reason], "arabic_reason": input_reason}
+    return _REASONS[reason]
@@ -0,0 +1,252 @@
+"""
+Bulk export of signed invoice XMLs for audit and archival.
+
+[download_xml] only serves one Sales Invoice Additional Fields at a time. [export_signed_xmls] enqueues a job that
+writes the signed XML of every Sales Invoice Additional Fields matching a filter (invoice type, company, posting date
+range, integration status) to a zip or gzipped tar archive, along with a 'manifest.csv' listing the UUID, invoice
+counter, invoice hash and previous invoice hash (PIH) of each entry.
+
+Rows are read in keyset batches and each XML is written to the archive as soon as it's read, so only one batch is held
+in memory. The manifest is spooled to a temporary file and added at the end. XMLs are read from ZATCA Signed XML with
+one query per batch. Older documents may still have the XML in the invoice_xml field, or, if created before that
+field was added, as an attachment, which is read from disk with one attachment lookup per batch.
+"""
+
+import csv
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from typing import IO, Iterator, List, Optional
+
+import frappe
+import frappe.utils.background_jobs
+from frappe import _
+from frappe.utils import cint, getdate
+
+from ksa_compliance import logger
+from ksa_compliance.exports import export_path, publish_export
+from ksa_compliance.ksa_compliance.doctype.sales_invoice_additional_fields.sales_invoice_additional_fields import (
+    get_attached_signed_xmls,
+)
+from ksa_compliance.ksa_compliance.doctype.zatca_signed_xml.zatca_signed_xml import (
+    load_signed_xmls,
+)
+
+ARCHIVE_FORMATS = ("zip", "tar.gz")
+INVOICE_DOCTYPES = ("Sales Invoice", "POS Invoice", "Payment Entry")
+
+# Rows read per query. Signed XMLs are a few KB to a few hundred KB each
+BATCH_SIZE = 200
+
+# Exporting years of invoices takes far longer than the long queue's default timeout
+EXPORT_TIMEOUT_SECONDS = 6 * 60 * 60
+
+MANIFEST_COLUMNS = [
+    "file",
+    "additional_fields",
+    "invoice_doctype",
+    "invoice",
+    "posting_date",
+    "integration_status",
+    "uuid",
+    "invoice_counter",
+    "invoice_hash",
+    "previous_invoice_hash",
+]
+
+
+class ArchiveWriter:
+    """Writes entries to a zip or gzipped tar archive one at a time"""
+
+    def __init__(self, path: str, archive_format: str):
+        self.archive_format = archive_format
+        if archive_format == "zip":
+            self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            self._tar = tarfile.open(path, "w:gz")
+
+    def add(self, name: str, content: bytes) -> None:
+        if self.archive_format == "zip":
+            self._zip.writestr(name, content)
+        else:
+            self._add_tar(name, io.BytesIO(content), len(content))
+
+    def add_file(self, name: str, file: IO[bytes]) -> None:
+        """Adds the contents of an open binary [file], read from the start"""
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(0)
+        if self.archive_format == "zip":
+            with self._zip.open(name, "w") as entry:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    entry.write(chunk)
+        else:
+            self._add_tar(name, file, size)
+
+    def _add_tar(self, name: str, file: IO[bytes], size: int) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        self._tar.addfile(info, file)
+
+    def close(self) -> None:
+        if self.archive_format == "zip":
+            self._zip.close()
+        else:
+            self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@frappe.whitelist()
+def export_signed_xmls(filters: str, archive_format: str = "zip") -> None:
+    """Exports the signed XML of every Sales Invoice Additional Fields matching [filters] to an archive"""
+    filters = frappe._dict(json.loads(filters) if isinstance(filters, str) else filters)
+    if not frappe.has_permission("Sales Invoice Additional Fields", "export"):
+        frappe.throw(_("Not permitted"), frappe.PermissionError)
+    validate_filters(filters)
+    if archive_format not in ARCHIVE_FORMATS:
+        frappe.throw(_("Unsupported archive format: {0}").format(archive_format))
+
+    frappe.utils.background_jobs.enqueue(
+        _export_signed_xmls,
+        queue="long",
+        timeout=EXPORT_TIMEOUT_SECONDS,
+        filters=filters,
+        archive_format=archive_format,
+        user=frappe.session.user,
+    )
+    frappe.msgprint(_("The export has started. You'll be notified when the file is ready"))
+
+
+def validate_filters(filters) -> None:
+    if filters.get("invoice_doctype") not in INVOICE_DOCTYPES:
+        frappe.throw(_("Unsupported invoice type: {0}").format(filters.get("invoice_doctype")))
+    if not filters.get("from_date") or not filters.get("to_date"):
+        frappe.throw(_("From date and To date are required"))
+    if getdate(filters["to_date"]) < getdate(filters["from_date"]):
+        frappe.throw(_("To date must be after From date"))
+
+
+def _export_signed_xmls(filters: dict, archive_format: str, user: str) -> None:
+    with export_path("zatca-signed-xml", archive_format) as (file_name, path):
+        with ArchiveWriter(path, archive_format) as archive:
+            count, missing = write_signed_xmls(archive, filters)
+
+    logger.info(f"Exported {count} signed XMLs ({missing} missing)")
+    message = _("ZATCA signed XML export is ready: {0}")
+    if missing:
+        message += "<br>" + _(
+            "{0} documents have no signed XML. They're listed in manifest.csv without a file"
+        ).format(missing)
+    publish_export(file_name, user, message)
+
+
+def write_signed_xmls(archive: ArchiveWriter, filters) -> tuple[int, int]:
+    """
+    Writes the signed XML of every row matching [filters] and the manifest to [archive]. Returns the number of XMLs
+    written and the number of rows without one
+    """
+    count, missing = 0, 0
+    with tempfile.TemporaryFile() as manifest_file:
+        manifest_text = io.TextIOWrapper(manifest_file, encoding="utf-8", newline="")
+        manifest = csv.writer(manifest_text)
+        manifest.writerow(MANIFEST_COLUMNS)
+
+        for batch in iter_signed_xml_batches(filters):
+            stored = load_signed_xmls([row.signed_xml for row in batch if row.signed_xml])
+            attached = get_attached_signed_xmls(
+                [row.name for row in batch if not row.signed_xml and not row.invoice_xml]
+            )
+            for row in batch:
+                xml = stored.get(row.signed_xml) or row.invoice_xml or attached.get(row.name)
+                entry = ""
+                if xml:
+                    entry = f"{row.name}.xml"
+                    archive.add(entry, xml.encode("utf-8"))
+                    count += 1
+                else:
+                    missing += 1
+                manifest.writerow(
+                    [
+                        entry,
+                        row.name,
+                        filters["invoice_doctype"],
+                        row.sales_invoice,
+                        row.posting_date,
+                        row.integration_status,
+                        row.uuid,
+                        row.invoice_counter,
+                        row.invoice_hash,
+                        row.previous_invoice_hash,
+                    ]
+                )
+
+        manifest_text.flush()
+        archive.add_file("manifest.csv", manifest_file)
+        manifest_text.detach()
+    return count, missing
+
+
+def iter_signed_xml_batches(filters, batch_size: int = BATCH_SIZE) -> Iterator[List[dict]]:
+    """Yields the rows matching [filters] in batches, ordered by (posting date, additional fields name)"""
+    after = None
+    while True:
+        rows = get_signed_xml_rows(filters, after=after, limit=batch_size)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1].posting_date, rows[-1].name)
+
+
+def get_signed_xml_rows(filters, after: Optional[tuple] = None, limit: int = BATCH_SIZE):
+    invoice_doctype = filters["invoice_doctype"]
+    if invoice_doctype not in INVOICE_DOCTYPES:
+        frappe.throw(_("Unsupported invoice type: {0}").format(invoice_doctype))
+
+    conditions = []
+    if filters.get("company"):
+        conditions.append("AND inv.company = %(company)s")
+    if filters.get("integration_status") and filters["integration_status"] != "All":
+        conditions.append("AND siaf.integration_status = %(integration_status)s")
+    if cint(filters.get("latest_only", 1)):
+        conditions.append("AND siaf.is_latest = 1")
+    if after:
+        conditions.append("""AND (inv.posting_date > %(after_date)s
+                OR (inv.posting_date = %(after_date)s AND siaf.name > %(after_name)s))""")
+
+    return frappe.db.sql(
+        f"""
+            SELECT siaf.name, siaf.sales_invoice, inv.posting_date, siaf.integration_status, siaf.uuid,
+            siaf.invoice_counter, siaf.invoice_hash, siaf.previous_invoice_hash, siaf.signed_xml,
+            siaf.invoice_xml
+            FROM `tabSales Invoice Additional Fields` siaf
+            JOIN `tab{invoice_doctype}` inv ON inv.name = siaf.sales_invoice
+            WHERE siaf.invoice_doctype = %(invoice_doctype)s
+            AND siaf.docstatus < 2
+            AND inv.posting_date BETWEEN %(from_date)s AND %(to_date)s
+            {" ".join(conditions)}
+            ORDER BY inv.posting_date, siaf.name
+            LIMIT %(limit)s
+        """,
+        {
+            "invoice_doctype": invoice_doctype,
+            "company": filters.get("company"),
+            "integration_status": filters.get("integration_status"),
+            "from_date": filters["from_date"],
+            "to_date": filters["to_date"],
+            "after_date": after[0] if after else None,
+            "after_name": after[1] if after else None,
+            "limit": limit,
+        },
+        as_dict=True,
+    )
@@ -6,12 +6,11 @@ from enum import Enum
 from typing import Callable, Dict, List, Optional, Tuple, TypeVar, cast
 from urllib.parse import urljoin
 
-import requests
-from requests import HTTPError, JSONDecodeError, Response
+from requests import HTTPError, Response
 from requests.auth import HTTPBasicAuth
 from result import Err, Ok, Result
 
-from ksa_compliance import logger
+from ksa_compliance import logger, zatca_circuit_breaker, zatca_http, zatca_rate_limit
 
 
 class ZatcaSendMode(Enum):
@@ -168,15 +167,7 @@ def report_invoice(
     mode: ZatcaSendMode,
 ) -> Tuple[Result[ReportOrClearInvoiceResult, ReportOrClearInvoiceError], int]:
     """Reports a simplified invoice to ZATCA"""
-    b64_xml = base64.b64encode(invoice_xml.encode()).decode()
-    body = {"invoiceHash": invoice_hash, "uuid": invoice_uuid, "invoice": b64_xml}
-    headers = {
-        "Accept-Version": "V2",
-    }
-
-    url = (
-        "invoices/reporting/single" if mode == ZatcaSendMode.Production else "compliance/invoices"
-    )
+    url, headers, body = build_report_request(invoice_xml, invoice_uuid, invoice_hash, mode)
     return api_call(
         server,
         url,
@@ -185,9 +176,26 @@ def report_invoice(
         ReportOrClearInvoiceResult.from_json,
         try_get_report_or_clear_error,
         auth=HTTPBasicAuth(security_token, secret),
+        rate_limit_key=zatca_rate_limit.get_bucket_key(security_token),
     )
 
 
+def build_report_request(
+    invoice_xml: str, invoice_uuid: str, invoice_hash: str, mode: ZatcaSendMode
+) -> Tuple[str, Dict[str, str], Dict[str, str]]:
+    """Returns the path, headers and body for reporting a simplified invoice"""
+    b64_xml = base64.b64encode(invoice_xml.encode()).decode()
+    body = {"invoiceHash": invoice_hash, "uuid": invoice_uuid, "invoice": b64_xml}
+    headers = {
+        "Accept-Version": "V2",
+    }
+
+    url = (
+        "invoices/reporting/single" if mode == ZatcaSendMode.Production else "compliance/invoices"
+    )
+    return url, headers, body
+
+
 def clear_invoice(
     server: str,
     invoice_xml: str,
@@ -216,9 +224,16 @@ def clear_invoice(
         ReportOrClearInvoiceResult.from_json,
         try_get_report_or_clear_error,
         auth=HTTPBasicAuth(security_token, secret),
+        rate_limit_key=zatca_rate_limit.get_bucket_key(security_token),
     )
 
 
+def build_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    final_headers = headers.copy()
+    final_headers.update({"accept": "application/json", "accept-language": "en"})
+    return final_headers
+
+
 TOk = TypeVar("TOk")
 TError = TypeVar("TError")
 
@@ -231,10 +246,14 @@ def api_call(
     result_builder: Callable[[dict, str], TOk],
     error_builder: Callable[[Response | None, Exception | None], TError],
     auth=None,
+    rate_limit_key: Optional[str] = None,
 ) -> Tuple[Result[TOk, TError], int]:
     """
     Performs a ZATCA API call and builds a success result using [result_builder]. In case of 400 errors, the
-    response is parsed and a combined error is returned.
+    response is parsed and a combined error is returned. Calls go through the pooled, retrying transport in
+    [zatca_http], paced by the [zatca_rate_limit] bucket at [rate_limit_key] if given. If the
+    [zatca_circuit_breaker] of [server] is open or the bucket has no token in time, nothing is sent and the status
+    code is [zatca_circuit_breaker.STATUS_CODE].
 
     Never throws an exception
     """
@@ -243,12 +262,19 @@ def api_call(
 
     url = urljoin(server, path)
 
-    final_headers = headers.copy()
-    final_headers.update({"accept": "application/json", "accept-language": "en"})
+    final_headers = build_headers(headers)
 
     response: Response | None = None
     try:
-        response = requests.post(url, headers=final_headers, json=body, auth=auth)
+        response = zatca_http.post(
+            server,
+            path,
+            url,
+            rate_limit_key=rate_limit_key,
+            headers=final_headers,
+            json=body,
+            auth=auth,
+        )
         response.raise_for_status()
         return Ok(result_builder(response.json(), response.text)), response.status_code
     except HTTPError as e:
@@ -258,6 +284,13 @@ def api_call(
             logger.info(f"Response: {e.response.text}")
 
         return Err(error), response.status_code
+    except zatca_rate_limit.RateLimited as e:
+        logger.warning(str(e))
+        # Nothing was sent, so the invoice is left for the batch sync like when the circuit is open
+        return Err(error_builder(None, e)), zatca_circuit_breaker.STATUS_CODE
+    except zatca_circuit_breaker.CircuitOpen as e:
+        logger.warning(str(e))
+        return Err(error_builder(None, e)), zatca_circuit_breaker.STATUS_CODE
     except Exception as e:
         error = error_builder(response, e)
         logger.error(f"An unexpected error occurred: {error}", exc_info=e)
@@ -292,7 +325,7 @@ def try_get_csid_error(response: Response | None, exception: Exception | None) -
             return data["message"]
 
         return response.text
-    except JSONDecodeError:
+    except ValueError:
         # If the response is not JSON, we return the content itself as the error
         return response.text
 
@@ -323,7 +356,7 @@ def try_get_report_or_clear_error(
 
         if response.status_code == 500 and data.get("message"):
             return ReportOrClearInvoiceError(response.text, data["message"])
-    except JSONDecodeError:
+    except ValueError:
         # If the response is not JSON, we return the content itself as the error
         pass
 
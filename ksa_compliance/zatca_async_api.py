@@ -0,0 +1,174 @@
+"""
+Async client for reporting simplified invoices in bulk.
+
+[zatca_api.report_invoice] sends one invoice per call, so a batch of N invoices costs N round trips back to back.
+[report_invoices] keeps up to [concurrency] reporting calls in flight over a single pooled connection set and returns
+exactly what [zatca_api.report_invoice] would have returned for each invoice, in the same order. It follows the same
+timeouts, retry policy, stats, [zatca_rate_limit] pacing and [zatca_circuit_breaker] as [zatca_http]. Their Redis
+calls run in worker threads, so a slow Redis doesn't stall the other calls in flight.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from urllib.parse import urljoin
+
+import frappe
+import httpx
+from frappe.utils import cint, flt
+from result import Err, Ok, Result
+
+from ksa_compliance import logger, zatca_circuit_breaker, zatca_http, zatca_rate_limit
+from ksa_compliance.zatca_api import (
+    ReportOrClearInvoiceError,
+    ReportOrClearInvoiceResult,
+    ZatcaSendMode,
+    build_headers,
+    build_report_request,
+    try_get_report_or_clear_error,
+)
+
+DEFAULT_CONCURRENCY = 10
+
+ReportResponse = Tuple[Result[ReportOrClearInvoiceResult, ReportOrClearInvoiceError], int]
+
+
+@dataclass
+class ReportInvoiceRequest:
+    invoice_xml: str
+    invoice_uuid: str
+    invoice_hash: str
+    security_token: str
+    secret: str
+    mode: ZatcaSendMode
+
+
+def report_invoices_sync(
+    server: str, requests: List[ReportInvoiceRequest], concurrency: int = DEFAULT_CONCURRENCY
+) -> List[ReportResponse]:
+    """Runs [report_invoices] to completion from synchronous code, e.g. a background job"""
+    return asyncio.run(report_invoices(server, requests, concurrency))
+
+
+async def report_invoices(
+    server: str, requests: List[ReportInvoiceRequest], concurrency: int = DEFAULT_CONCURRENCY
+) -> List[ReportResponse]:
+    """
+    Reports simplified invoices to ZATCA concurrently. Returns a (result, status code) tuple for each request, in
+    the same order as [requests].
+
+    Never throws an exception
+    """
+    if not server.endswith("/"):
+        server = server + "/"
+
+    timeout = httpx.Timeout(
+        flt(frappe.conf.get("zatca_http_read_timeout") or 60),
+        connect=flt(frappe.conf.get("zatca_http_connect_timeout") or 10),
+    )
+    max_retries = cint(frappe.conf.get("zatca_http_max_retries", 3))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+
+        async def report(request: ReportInvoiceRequest) -> ReportResponse:
+            async with semaphore:
+                return await _report_invoice(client, server, request, max_retries)
+
+        return list(await asyncio.gather(*[report(r) for r in requests]))
+
+
+async def _report_invoice(
+    client: httpx.AsyncClient, server: str, request: ReportInvoiceRequest, max_retries: int
+) -> ReportResponse:
+    path, headers, body = build_report_request(
+        request.invoice_xml, request.invoice_uuid, request.invoice_hash, request.mode
+    )
+    response: httpx.Response | None = None
+    try:
+        response = await _post(
+            client,
+            server,
+            path,
+            urljoin(server, path),
+            max_retries,
+            zatca_rate_limit.get_bucket_key(request.security_token),
+            headers=build_headers(headers),
+            json=body,
+            auth=(request.security_token, request.secret),
+        )
+        if response.is_error:
+            error = try_get_report_or_clear_error(response, None)
+            logger.error(f"An HTTP error occurred: {error}")
+            if response.text:
+                logger.info(f"Response: {response.text}")
+            return Err(error), response.status_code
+
+        result = ReportOrClearInvoiceResult.from_json(response.json(), response.text)
+        return Ok(result), response.status_code
+    except zatca_rate_limit.RateLimited as e:
+        logger.warning(str(e))
+        return Err(try_get_report_or_clear_error(None, e)), zatca_circuit_breaker.STATUS_CODE
+    except zatca_circuit_breaker.CircuitOpen as e:
+        logger.warning(str(e))
+        return Err(try_get_report_or_clear_error(None, e)), zatca_circuit_breaker.STATUS_CODE
+    except Exception as e:
+        error = try_get_report_or_clear_error(response, e)
+        logger.error(f"An unexpected error occurred: {error}", exc_info=e)
+        status_code = 0
+        if response is not None:
+            logger.info(f"Response: {response.text}")
+            status_code = response.status_code
+        return Err(error), status_code
+
+
+async def _post(
+    client: httpx.AsyncClient,
+    server: str,
+    path: str,
+    url: str,
+    max_retries: int,
+    rate_limit_key: Optional[str],
+    **kwargs,
+) -> httpx.Response:
+    attempt = 0
+    while True:
+        response: httpx.Response | None = None
+        # The circuit breaker and rate limiter talk to Redis, so they run in a worker thread. to_thread copies the
+        # context, so frappe.local (the site config and Redis connection) is the same there
+        probe_id = await asyncio.to_thread(zatca_circuit_breaker.before_call, server)
+        await zatca_rate_limit.acquire_async(rate_limit_key)
+        start = time.monotonic()
+        try:
+            response = await client.post(url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            zatca_http.record_call(path, 0, time.monotonic() - start, retry=attempt > 0)
+            await asyncio.to_thread(zatca_circuit_breaker.record_result, server, 0, probe_id)
+            if attempt >= max_retries:
+                raise
+            logger.warning(f"Connection to ZATCA failed for {path}, retrying: {e}")
+        except httpx.TransportError:
+            # As with the sync transport, anything past connecting may have reached ZATCA, so it's not retried
+            zatca_http.record_call(path, 0, time.monotonic() - start, retry=attempt > 0)
+            await asyncio.to_thread(zatca_circuit_breaker.record_result, server, 0, probe_id)
+            raise
+        else:
+            zatca_http.record_call(
+                path, response.status_code, time.monotonic() - start, retry=attempt > 0
+            )
+            await asyncio.to_thread(_record_response, server, probe_id, rate_limit_key, response)
+            if response.status_code not in zatca_http.RETRY_STATUS_CODES or attempt >= max_retries:
+                return response
+            logger.warning(f"ZATCA responded with {response.status_code} for {path}, retrying")
+
+        await asyncio.sleep(zatca_http.get_backoff(attempt, response))
+        attempt += 1
+
+
+def _record_response(
+    server: str, probe_id: int, rate_limit_key: Optional[str], response: httpx.Response
+) -> None:
+    zatca_circuit_breaker.record_result(server, response.status_code, probe_id)
+    zatca_rate_limit.record_response(rate_limit_key, response)
@@ -0,0 +1,212 @@
+"""
+Circuit breaker for ZATCA servers.
+
+Every attempt against a Fatoora server is recorded in a Redis state shared by all workers, keyed by the server URL.
+Connection failures, timeouts and gateway errors (502/503/504) count as failures. Once a window of
+'zatca_circuit_breaker_window' seconds has at least 'zatca_circuit_breaker_failures' failures, making up at least
+[FAILURE_RATE] of its attempts, the circuit opens. While it's open, calls fail with [CircuitOpen] before anything is
+sent, so live submissions don't block on a gateway that's down. Callers get [STATUS_CODE] back and leave the invoice
+"Ready For Batch".
+
+After 'zatca_circuit_breaker_open_seconds' the next call goes through as a probe, and all other calls keep failing
+fast while it's in flight. The probe gets an id that it reports its result with, so only its own outcome decides
+whether the circuit closes; late results of calls that started before the circuit opened are ignored. A successful
+probe closes the circuit and queues the batch sync to send the backlog, skipping partitions a running sync already
+holds. The [zatca_rate_limit] buckets pace that backlog per CSID. A failed probe keeps the circuit open for twice as
+long, up to [MAX_OPEN_SECONDS].
+
+The following site config keys tune the behaviour:
+
+    zatca_circuit_breaker_failures: failures that open the circuit (default 5, 0 disables the breaker)
+    zatca_circuit_breaker_window: seconds over which failures are counted (default 60)
+    zatca_circuit_breaker_open_seconds: how long the circuit stays open before the first probe (default 30)
+
+If Redis can't be reached, the circuit is treated as closed.
+"""
+
+import time
+
+import frappe
+from frappe.utils import cint, flt
+
+from ksa_compliance import logger
+
+# What API calls return as status code when nothing was sent, because the circuit was open or the call was rate limited
+STATUS_CODE = -1
+
+FAILURE_STATUS_CODES = {0, 502, 503, 504}
+FAILURE_RATE = 0.5
+DEFAULT_FAILURES = 5
+DEFAULT_WINDOW_SECONDS = 60
+DEFAULT_OPEN_SECONDS = 30
+MAX_OPEN_SECONDS = 600
+
+# A probe that hasn't reported back by then (e.g. its worker died) lets the next call probe instead
+PROBE_TIMEOUT_SECONDS = 120
+
+_STATE_TTL_SECONDS = 24 * 60 * 60
+
+# Returns 0 if a call can go through, -1 if it can't and the probe id if it goes through as the probe of an open
+# circuit
+_ALLOW_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'state', 'open_until', 'probe_until')
+if state[1] ~= 'open' then
+    return 0
+end
+local now = tonumber(ARGV[1])
+if now < (tonumber(state[2]) or 0) or now < (tonumber(state[3]) or 0) then
+    return -1
+end
+local probe_id = redis.call('HINCRBY', KEYS[1], 'probe_seq', 1)
+redis.call('HMSET', KEYS[1], 'probe_id', probe_id, 'probe_until', now + tonumber(ARGV[2]))
+return probe_id
+"""
+
+# Records the outcome of an attempt. Returns 1 if it opened the circuit, 2 if it closed it and 0 otherwise
+_RECORD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local failed = ARGV[2] == '1'
+local state = redis.call('HMGET', KEYS[1], 'state', 'probe_id', 'open_seconds', 'window_start', 'calls', 'failures',
+    'probe_seq')
+-- Probe ids keep counting across open periods, so a hung probe from an earlier one can't pass for the current probe
+local probe_seq = tonumber(state[7]) or 0
+if state[1] == 'open' then
+    -- Anything but the probe in flight is a call that started before the circuit opened (or a probe that timed out)
+    local probe_id = tonumber(ARGV[9])
+    if probe_id == 0 or probe_id ~= (tonumber(state[2]) or 0) then
+        return 0
+    end
+    if failed then
+        local open_seconds = math.min(tonumber(ARGV[7]), (tonumber(state[3]) or tonumber(ARGV[6])) * 2)
+        redis.call('HMSET', KEYS[1], 'open_until', now + open_seconds, 'open_seconds', open_seconds, 'probe_id', 0,
+            'probe_until', 0)
+        return 0
+    end
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[1], 'probe_seq', probe_seq)
+    redis.call('EXPIRE', KEYS[1], ARGV[8])
+    return 2
+end
+
+local window_start = tonumber(state[4]) or now
+local calls = tonumber(state[5]) or 0
+local failures = tonumber(state[6]) or 0
+if now - window_start >= tonumber(ARGV[3]) then
+    window_start, calls, failures = now, 0, 0
+end
+calls = calls + 1
+if failed then
+    failures = failures + 1
+end
+if failures >= tonumber(ARGV[4]) and failures >= calls * tonumber(ARGV[5]) then
+    redis.call('DEL', KEYS[1])
+    redis.call('HMSET', KEYS[1], 'state', 'open', 'open_until', now + tonumber(ARGV[6]), 'open_seconds', ARGV[6],
+        'probe_id', 0, 'probe_until', 0, 'probe_seq', probe_seq)
+    redis.call('EXPIRE', KEYS[1], ARGV[8])
+    return 1
+end
+redis.call('HMSET', KEYS[1], 'window_start', window_start, 'calls', calls, 'failures', failures)
+redis.call('EXPIRE', KEYS[1], ARGV[8])
+return 0
+"""
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a ZATCA server whose circuit is open"""
+
+    def __init__(self, server: str):
+        super().__init__(
+            f"ZATCA server {server} is unreachable, calls are paused until it recovers"
+        )
+        self.server = server
+
+
+def get_circuit_key(server: str) -> str:
+    return frappe.cache().make_key(f"zatca_circuit|{server.rstrip('/')}")
+
+
+def before_call(server: str) -> int:
+    """
+    Raises [CircuitOpen] if calls to [server] are paused. Called before every attempt, retries included. Returns the
+    probe id if the attempt probes an open circuit and 0 otherwise, to be passed back to [record_result]
+    """
+    if _get_failures() <= 0:
+        return 0
+
+    probe_id = cint(
+        _run_script(_ALLOW_SCRIPT, get_circuit_key(server), 0, time.time(), PROBE_TIMEOUT_SECONDS)
+    )
+    if probe_id < 0:
+        raise CircuitOpen(server)
+    if probe_id:
+        logger.info(f"Probing ZATCA server {server}")
+    return probe_id
+
+
+def record_result(server: str, status_code: int, probe_id: int = 0) -> None:
+    """
+    Records an attempt against [server]. A status code of 0 means no response was received. [probe_id] is what
+    [before_call] returned for the attempt
+    """
+    if _get_failures() <= 0:
+        return
+
+    open_seconds = flt(
+        frappe.conf.get("zatca_circuit_breaker_open_seconds") or DEFAULT_OPEN_SECONDS
+    )
+    transition = cint(
+        _run_script(
+            _RECORD_SCRIPT,
+            get_circuit_key(server),
+            0,
+            time.time(),
+            1 if status_code in FAILURE_STATUS_CODES else 0,
+            flt(frappe.conf.get("zatca_circuit_breaker_window") or DEFAULT_WINDOW_SECONDS),
+            _get_failures(),
+            FAILURE_RATE,
+            open_seconds,
+            max(open_seconds, MAX_OPEN_SECONDS),
+            _STATE_TTL_SECONDS,
+            probe_id,
+        )
+    )
+    if transition == 1:
+        logger.warning(f"ZATCA server {server} is failing, pausing calls for {open_seconds}s")
+    elif transition == 2:
+        logger.info(f"ZATCA server {server} recovered, resuming calls")
+        _send_backlog()
+
+
+def reset(server: str) -> None:
+    """Closes the circuit of [server]"""
+    frappe.cache().delete(get_circuit_key(server))
+
+
+def _send_backlog() -> None:
+    # Invoices submitted while the circuit was open were left for the batch sync. Run it now rather than at its next
+    # hourly run. It can overlap the hourly sync, which is fine: each partition is locked while it syncs (see
+    # [background_jobs.sync_partitions]), so partitions the other sync is sending are skipped rather than reported twice
+    try:
+        frappe.enqueue(
+            "ksa_compliance.background_jobs.sync_e_invoices",
+            queue="long",
+            timeout=3480,  # 58 minutes, like the hourly sync
+            job_name="Sync E-Invoices",
+            deduplicate=True,
+            job_id="Sync E-Invoices after ZATCA recovery",
+        )
+    except Exception as e:
+        logger.error("An error occurred queueing the sync after ZATCA recovered", exc_info=e)
+
+
+def _get_failures() -> int:
+    failures = frappe.conf.get("zatca_circuit_breaker_failures")
+    return DEFAULT_FAILURES if failures is None else cint(failures)
+
+
+def _run_script(script: str, key: str, default: int, *args):
+    try:
+        return frappe.cache().register_script(script)(keys=[key], args=args)
+    except Exception as e:
+        logger.warning(f"ZATCA circuit breaker unavailable, treating the circuit as closed: {e}")
+        return default
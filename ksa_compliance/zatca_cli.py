@@ -14,7 +14,7 @@ import semantic_version
 from frappe import _
 from result import is_err
 
-from ksa_compliance import logger
+from ksa_compliance import logger, zatca_cli_daemon, zatca_workspace
 from ksa_compliance.throw import fthrow
 from ksa_compliance.translation import ft
 from ksa_compliance.zatca_cli_setup import download_with_progress, extract_archive
@@ -68,10 +68,18 @@ class SigningResult:
     """Result for an invoice signing invocation to lava-zatca CLI"""
 
     signed_invoice_xml: str
-    signed_invoice_path: str
+    signed_invoice_path: Optional[str]
     invoice_hash: str
     qr_code: str
 
+    def get_signed_invoice_path(self) -> str:
+        """Returns the path of the signed invoice, writing it to a temp file first if it's only in memory"""
+        if self.signed_invoice_path is None:
+            self.signed_invoice_path = write_temp_file(
+                self.signed_invoice_xml, "signed_invoice.xml"
+            )
+        return self.signed_invoice_path
+
 
 @dataclass
 class ValidationDetails:
@@ -220,13 +228,14 @@ def generate_csr(
     """
     Generates a CSR. The given prefix is used to name the resulting CSR and private key files.
     """
-    config_path = write_temp_file(config, f"{file_prefix}-csr.properties")
     csr_path = get_csr_path(file_prefix)
     private_key_path = get_private_key_path(file_prefix)
-    args = ["csr", "-c", config_path, "-o", csr_path, "-k", private_key_path]
-    if simulation:
-        args.append("-s")
-    result = run_command(zatca_cli_path, args, java_home=java_home)
+    with zatca_workspace.scope():
+        config_path = write_temp_file(config, f"{file_prefix}-csr.properties")
+        args = ["csr", "-c", config_path, "-o", csr_path, "-k", private_key_path]
+        if simulation:
+            args.append("-s")
+        result = run_command(zatca_cli_path, args, java_home=java_home)
     logger.info(result.msg)
     result.throw_if_failure()
     with open(csr_path, "rt") as file:
@@ -237,29 +246,34 @@ def generate_csr(
 def sign_invoice(
     zatca_cli_path: str, java_home: str, invoice_xml: str, cert_path: str, private_key_path: str
 ) -> SigningResult:
+    """
+    Signs [invoice_xml]. Within a [zatca_workspace.scope], the signed invoice path stays valid until the scope exits
+    """
     base_path = os.path.normpath(os.path.join(os.path.dirname(zatca_cli_path), "../"))
-    invoice_path = write_temp_file(invoice_xml, "invoice.xml")
-    signed_invoice_path = get_temp_path("signed_invoice.xml")
-    result = run_command(
-        zatca_cli_path,
-        [
-            "sign",
-            "-b",
-            base_path,
-            "-o",
-            signed_invoice_path,
-            "-c",
-            cert_path,
-            "-k",
-            private_key_path,
-            invoice_path,
-        ],
-        java_home=java_home,
-    )
-    logger.info(result.msg)
-    result.throw_if_failure()
-    with open(signed_invoice_path, "rt") as file:
-        signed_invoice = file.read()
+    with zatca_workspace.measure("Signing invoice"):
+        invoice_path = write_temp_file(invoice_xml, "invoice.xml")
+        signed_invoice_path = get_temp_path("signed_invoice.xml")
+        result = run_command(
+            zatca_cli_path,
+            [
+                "sign",
+                "-b",
+                base_path,
+                "-o",
+                signed_invoice_path,
+                "-c",
+                cert_path,
+                "-k",
+                private_key_path,
+                invoice_path,
+            ],
+            java_home=java_home,
+        )
+        logger.info(result.msg)
+        result.throw_if_failure()
+        with open(signed_invoice_path, "rt") as file:
+            signed_invoice = file.read()
+        _track(signed_invoice_path)
     return SigningResult(
         signed_invoice, signed_invoice_path, result.data["hash"], result.data["qrCode"]
     )
@@ -273,11 +287,19 @@ def validate_invoice(
     previous_invoice_hash: str,
 ) -> ValidationResult:
     base_path = os.path.normpath(os.path.join(os.path.dirname(zatca_cli_path), "../"))
-    result = run_command(
-        zatca_cli_path,
-        ["validate", "-b", base_path, "-c", cert_path, "-p", previous_invoice_hash, invoice_path],
-        java_home=java_home,
-    )
+    args = [
+        "validate",
+        "-b",
+        base_path,
+        "-c",
+        cert_path,
+        "-p",
+        previous_invoice_hash,
+        invoice_path,
+    ]
+    # Temp files written while validating are deleted when it returns, unless the caller has a workspace open
+    with zatca_workspace.scope():
+        result = run_command(zatca_cli_path, args, java_home=java_home)
     logger.info(result.msg)
     result.throw_if_failure()
     return ValidationResult.from_json(result.data)
@@ -295,10 +317,27 @@ def run_command(zatca_cli_path: str, args: List[str], java_home: Optional[str])
     Note that currently there are no error codes or the like, because there's no automatic action that can be performed
     in response to failures. The user has to apply the recommended fixes manually, so we just show the messages and
     errors as is.
+
+    If a signing worker is configured (see [zatca_cli_daemon]), the command is sent to it. Otherwise, or if the worker
+    can't be reached, the CLI is spawned as a one-shot process.
     """
     if not os.path.isfile(zatca_cli_path):
         fthrow(_("{0} does not exist or is not a file").format(zatca_cli_path))
 
+    daemon_result = zatca_cli_daemon.run(args, java_home)
+    if daemon_result is not None:
+        logger.info(f"Running through signing worker: {args}")
+        returncode, result = daemon_result
+        return _to_zatca_result(returncode, result)
+
+    returncode, result = spawn_command(zatca_cli_path, args, java_home)
+    return _to_zatca_result(returncode, result)
+
+
+def spawn_command(
+    zatca_cli_path: str, args: List[str], java_home: Optional[str]
+) -> tuple[int, dict]:
+    """Runs a ZATCA command as a one-shot CLI process. Returns a tuple of (exit code, parsed output)"""
     full_args = [zatca_cli_path] + args
     env = os.environ.copy()
     if java_home:
@@ -312,7 +351,11 @@ def run_command(zatca_cli_path: str, args: List[str], java_home: Optional[str])
     except Exception as e:
         result = {"msg": "An unexpected error occurred", "errors": [str(e)]}
 
-    if proc.returncode != 0:
+    return proc.returncode, result
+
+
+def _to_zatca_result(returncode: int, result: dict) -> ZatcaResult:
+    if returncode != 0:
         return ZatcaResult(
             is_success=False, msg=result["msg"], errors=result.get("errors", []), data=None
         )
@@ -321,7 +364,14 @@ def run_command(zatca_cli_path: str, args: List[str], java_home: Optional[str])
 
 
 def write_temp_file(content: str, name: str) -> str:
-    """Writes the given text [content] into a temporary file named [name]"""
+    """
+    Writes the given text [content] into a temporary file named [name]. Inside a [zatca_workspace.scope], the file
+    is deleted when the scope exits. Otherwise, it's left for the caller to clean up.
+    """
+    workspace = zatca_workspace.current()
+    if workspace:
+        return workspace.write_text(content, name)
+
     path = get_temp_path(name)
     with open(path, "wt+") as file:
         file.write(content)
@@ -329,6 +379,10 @@ def write_temp_file(content: str, name: str) -> str:
 
 
 def write_binary_temp_file(content: bytes, name: str) -> str:
+    workspace = zatca_workspace.current()
+    if workspace:
+        return workspace.write_bytes(content, name)
+
     path = get_temp_path(name)
     with open(path, "wb+") as file:
         file.write(content)
@@ -336,6 +390,10 @@ def write_binary_temp_file(content: bytes, name: str) -> str:
 
 
 def get_temp_path(name: str) -> str:
+    workspace = zatca_workspace.current()
+    if workspace:
+        return workspace.new_path(name)
+
     tmp = tempfile.NamedTemporaryFile(suffix="-" + name, delete=False)
     try:
         tmp.flush()
@@ -354,15 +412,26 @@ def convert_to_pdf_a3_b(
     invoice_id: str,
     pdf_content: bytes,
     xml_content: str,
-) -> str:
-    pdf = write_binary_temp_file(pdf_content, f"{invoice_id}.pdf")
-    invoice_xml = write_temp_file(xml_content, f"{invoice_id}.xml")
-
-    result = run_command(
-        zatca_cli_path,
-        ["convert-pdf", "-i", invoice_id, "-x", invoice_xml, pdf],
-        java_home=java_home,
-    )
-    logger.info(result.msg)
-    result.throw_if_failure()
-    return result.data["filePath"]
+) -> bytes:
+    """Converts [pdf_content] into a PDF/A-3b with [xml_content] embedded, and returns the converted PDF"""
+    with zatca_workspace.scope() as workspace, zatca_workspace.measure("Converting to PDF/A-3b"):
+        pdf = workspace.write_bytes(pdf_content, f"{invoice_id}.pdf")
+        invoice_xml = workspace.write_text(xml_content, f"{invoice_id}.xml")
+
+        result = run_command(
+            zatca_cli_path,
+            ["convert-pdf", "-i", invoice_id, "-x", invoice_xml, pdf],
+            java_home=java_home,
+        )
+        logger.info(result.msg)
+        result.throw_if_failure()
+        output_path = result.data["filePath"]
+        workspace.track(output_path)
+        with open(output_path, "rb") as file:
+            return file.read()
+
+
+def _track(path: str) -> None:
+    workspace = zatca_workspace.current()
+    if workspace:
+        workspace.track(path)
@@ -0,0 +1,140 @@
+"""
+Client for a ZATCA CLI signing worker.
+
+When a signing worker is running for the bench (configured through the 'zatca_cli_daemon_socket' site config key),
+CLI commands are sent to it over a local unix socket instead of being spawned by the web or background worker that
+needs them. The protocol uses newline-delimited JSON frames:
+
+    request:  {"args": ["sign", "-b", "...", ...], "javaHome": "..."}
+    response: {"exitCode": 0, "msg": "...", "errors": [...], "data": {...}}
+
+The response body (minus 'exitCode') is exactly what the CLI writes to stdout when run as a one-shot process, so
+callers parse both paths the same way. If the worker can't be reached, [run] returns None and the caller falls back
+to spawning the CLI. Once a command was sent, though, the worker may be running it, so a failure to get its answer
+(e.g. a timeout) is returned as a failed command rather than running it a second time. The worker itself is [zatca_cli_worker], started with 'bench zatca-cli-worker'. It still
+runs the CLI once per command, so this doesn't save JVM startup time.
+"""
+
+import json
+import socket
+import threading
+from typing import List, Optional
+
+import frappe
+
+from ksa_compliance import logger
+
+DEFAULT_TIMEOUT_SECONDS = 120
+
+
+class NoResponse(Exception):
+    """Raised when a command was sent to the signing worker but no answer came back"""
+
+
+class _DaemonConnection:
+    """A persistent connection to the signing worker. Guarded by a lock so that threads in the same worker process
+    don't interleave frames"""
+
+    def __init__(self, socket_path: str, timeout: float):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+
+    def _connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+
+    def close(self) -> None:
+        if self._reader:
+            self._reader.close()
+        if self._sock:
+            self._sock.close()
+        self._sock, self._reader = None, None
+
+    def request(self, payload: dict) -> dict:
+        frame = json.dumps(payload).encode("utf-8") + b"\n"
+        with self._lock:
+            self._send(frame)
+            # Once the frame is out, the worker may already be running the command, so a failure from here on is
+            # raised rather than retried. Sending it again could run the command twice and wait twice as long
+            try:
+                line = self._reader.readline()
+                if not line:
+                    raise ConnectionError("Signing worker closed the connection")
+                return json.loads(line)
+            except Exception as e:
+                self.close()
+                raise NoResponse(str(e) or type(e).__name__) from e
+
+    def _send(self, frame: bytes) -> None:
+        # A stale connection (e.g. the worker was restarted) fails when the frame is sent, before the worker gets any
+        # of it, so we reconnect and send it once more
+        for attempt in range(2):
+            reused = self._sock is not None
+            try:
+                if not reused:
+                    self._connect()
+                self._sock.sendall(frame)
+                return
+            except socket.timeout:
+                self.close()
+                raise
+            except OSError:
+                self.close()
+                if not reused or attempt == 1:
+                    raise
+
+
+# Connections are per thread: a connection handles one request at a time, so threads that convert in parallel (e.g.
+# the bulk PDF export pool) each get their own instead of queueing behind a shared one. A thread's connections are
+# dropped along with it
+_local = threading.local()
+
+
+def get_socket_path() -> Optional[str]:
+    """Returns the configured signing worker socket, if any"""
+    return frappe.conf.get("zatca_cli_daemon_socket")
+
+
+def _get_connection(socket_path: str) -> _DaemonConnection:
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    connection = connections.get(socket_path)
+    if not connection:
+        timeout = frappe.conf.get("zatca_cli_daemon_timeout") or DEFAULT_TIMEOUT_SECONDS
+        connection = _DaemonConnection(socket_path, timeout)
+        connections[socket_path] = connection
+    return connection
+
+
+def run(args: List[str], java_home: Optional[str]) -> Optional[tuple[int, dict]]:
+    """
+    Runs a CLI command through the signing worker. Returns a tuple of (exit code, parsed output), or None if no
+    worker is configured or it cannot be reached. A command the worker got but didn't answer returns a failure, so the
+    caller doesn't run it again.
+    """
+    socket_path = get_socket_path()
+    if not socket_path:
+        return None
+
+    try:
+        response = _get_connection(socket_path).request({"args": args, "javaHome": java_home})
+    except NoResponse as e:
+        logger.error(f"ZATCA signing worker at {socket_path} didn't answer {args[:1]}: {e}")
+        return 1, {"msg": "The ZATCA signing worker didn't answer in time", "errors": [str(e)]}
+    except Exception as e:
+        logger.warning(f"ZATCA signing worker at {socket_path} is unavailable: {e}")
+        return None
+
+    exit_code = int(response.pop("exitCode", 1))
+    return exit_code, response
@@ -0,0 +1,70 @@
+"""
+Signing worker for [zatca_cli_daemon].
+
+Serves the newline-delimited JSON protocol described in [zatca_cli_daemon] on a unix socket and runs each command with
+the ZATCA CLI at the given path, replying with its exit code and output. Web and background workers then only exchange
+frames with it instead of spawning the CLI themselves. Each connection is served by its own thread, so workers that
+sign in parallel don't queue behind each other.
+
+Every command still starts the CLI, and with it a JVM. Keeping one JVM warm would need the CLI to serve commands
+itself, which it doesn't, so the worker only relays.
+
+Start one per bench with 'bench zatca-cli-worker --socket <path> --cli-path <path>' (e.g. as a supervisor program)
+and set 'zatca_cli_daemon_socket' to the same path in the site config.
+"""
+
+import json
+import os
+import socketserver
+import stat
+
+from ksa_compliance import logger
+from ksa_compliance.zatca_cli import spawn_command
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                exit_code, result = spawn_command(
+                    self.server.zatca_cli_path, list(request["args"]), request.get("javaHome")
+                )
+            except Exception as e:
+                exit_code, result = 1, {"msg": "An unexpected error occurred", "errors": [str(e)]}
+            try:
+                self.wfile.write(
+                    json.dumps({"exitCode": exit_code, **result}).encode("utf-8") + b"\n"
+                )
+            except OSError:
+                # The client gave up waiting (e.g. timed out) and closed the connection
+                logger.warning("ZATCA signing worker client left before its command finished")
+                return
+
+
+class WorkerServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, zatca_cli_path: str):
+        self.socket_path = socket_path
+        self.zatca_cli_path = zatca_cli_path
+        # A socket left behind by a worker that didn't shut down cleanly would make binding fail
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o600)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def serve(socket_path: str, zatca_cli_path: str) -> None:
+    """Serves CLI commands on [socket_path] until interrupted"""
+    with WorkerServer(socket_path, zatca_cli_path) as server:
+        logger.info(f"ZATCA signing worker listening on {socket_path}, running {zatca_cli_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,155 @@
+"""
+HTTP transport for ZATCA API calls.
+
+Every Fatoora server gets its own pooled [requests.Session], so consecutive calls from the same worker reuse the
+TCP/TLS connection instead of doing a fresh handshake per invoice. Calls have connect/read timeouts and are retried
+with jittered exponential backoff on connection errors, 429 and gateway errors (502/503/504). Other 5xx responses
+are not retried because ZATCA uses them to report processing errors for the invoice itself.
+
+The following site config keys tune the behaviour:
+
+    zatca_http_connect_timeout: seconds to wait for a connection (default 10)
+    zatca_http_read_timeout: seconds to wait for a response (default 60)
+    zatca_http_max_retries: retries after the first attempt (default 3)
+    zatca_http_backoff: base backoff in seconds, doubled on every retry (default 0.5)
+
+Per-endpoint latency and status code counters are kept in-process and can be read through [get_stats].
+
+Calls given a [rate_limit_key] also take a token from the shared [zatca_rate_limit] bucket before every attempt,
+including retries, and feed each response back into it. Every attempt is checked against and recorded in the
+[zatca_circuit_breaker] of its server.
+"""
+
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import frappe
+import requests
+from frappe.utils import cint, flt
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+from ksa_compliance import logger, zatca_circuit_breaker, zatca_rate_limit
+
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+MAX_BACKOFF_SECONDS = 30
+
+
+@dataclass
+class EndpointStats:
+    calls: int = 0
+    retries: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    status_codes: Dict[int, int] = field(default_factory=dict)
+
+    def record(self, status_code: int, seconds: float) -> None:
+        self.calls += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+
+    def to_json(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "avg_seconds": self.total_seconds / self.calls if self.calls else 0.0,
+            "max_seconds": self.max_seconds,
+            "status_codes": dict(self.status_codes),
+        }
+
+
+_sessions: Dict[str, requests.Session] = {}
+_stats: Dict[str, EndpointStats] = {}
+_lock = threading.Lock()
+
+
+def get_session(server: str) -> requests.Session:
+    """Returns the pooled session for [server], creating it on first use"""
+    with _lock:
+        session = _sessions.get(server)
+        if session is None:
+            session = requests.Session()
+            # Retries are handled by [post] so that they're counted and backed off consistently
+            session.mount(
+                "https://", HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+            )
+            _sessions[server] = session
+        return session
+
+
+def get_stats() -> Dict[str, dict]:
+    """Returns per-endpoint call counts, latencies and status codes for this process"""
+    with _lock:
+        return {path: stats.to_json() for path, stats in _stats.items()}
+
+
+def reset_stats() -> None:
+    with _lock:
+        _stats.clear()
+
+
+def record_call(path: str, status_code: int, seconds: float, retry: bool) -> None:
+    """Records a single attempt against [path]. A status code of 0 means no response was received"""
+    with _lock:
+        stats = _stats.setdefault(path, EndpointStats())
+        stats.record(status_code, seconds)
+        if retry:
+            stats.retries += 1
+
+
+def get_backoff(attempt: int, response) -> float:
+    """Returns how long to wait before retrying. [response] can be a requests or an httpx response, or None"""
+    base = flt(frappe.conf.get("zatca_http_backoff") or 0.5)
+    delay = base * (2**attempt)
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        delay = max(delay, int(response.headers["Retry-After"]))
+
+    # Full jitter, so that parallel sync jobs don't retry in lockstep
+    return random.uniform(0, min(delay, MAX_BACKOFF_SECONDS))
+
+
+def post(
+    server: str, path: str, url: str, rate_limit_key: Optional[str] = None, **kwargs
+) -> Response:
+    """
+    Posts to [url] using the pooled session for [server]. [path] identifies the endpoint in the stats. Returns the
+    last response, which may be an error response; raises the last exception if no response was ever received,
+    [zatca_rate_limit.RateLimited] if the rate limit bucket at [rate_limit_key] has no token in time, or
+    [zatca_circuit_breaker.CircuitOpen] if calls to [server] are paused.
+    """
+    timeout = (
+        flt(frappe.conf.get("zatca_http_connect_timeout") or 10),
+        flt(frappe.conf.get("zatca_http_read_timeout") or 60),
+    )
+    max_retries = cint(frappe.conf.get("zatca_http_max_retries", 3))
+    session = get_session(server)
+
+    attempt = 0
+    while True:
+        response: Optional[Response] = None
+        probe_id = zatca_circuit_breaker.before_call(server)
+        zatca_rate_limit.acquire(rate_limit_key)
+        start = time.monotonic()
+        try:
+            response = session.post(url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            record_call(path, 0, time.monotonic() - start, retry=attempt > 0)
+            zatca_circuit_breaker.record_result(server, 0, probe_id)
+            # A read timeout may mean ZATCA received the invoice, so only connection failures are retried
+            if isinstance(e, requests.ReadTimeout) or attempt >= max_retries:
+                raise
+            logger.warning(f"Connection to ZATCA failed for {path}, retrying: {e}")
+        else:
+            record_call(path, response.status_code, time.monotonic() - start, retry=attempt > 0)
+            zatca_circuit_breaker.record_result(server, response.status_code, probe_id)
+            zatca_rate_limit.record_response(rate_limit_key, response)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+                return response
+            logger.warning(f"ZATCA responded with {response.status_code} for {path}, retrying")
+
+        time.sleep(get_backoff(attempt, response))
+        attempt += 1
@@ -0,0 +1,331 @@
+"""
+Native (in-process) signing of ZATCA invoices.
+
+This mirrors what `zatca-cli sign` does, following the ZATCA "Security Features Implementation Standards":
+
+1. Add the signature skeleton to the invoice: the XAdES extension (ext:UBLExtensions), the QR document reference and
+   cac:Signature
+2. Compute the invoice hash: remove the three elements above, canonicalize (C14N) and hash with SHA-256
+3. Sign the invoice hash with the EGS private key (ECDSA/SHA-256)
+4. Build xades:SignedProperties (signing time, certificate digest and issuer/serial) and hash it
+5. Generate the phase 2 QR code (TLV, tags 1-9) and fill in the skeleton
+
+The CLI output is the reference implementation. See test_zatca_native_signer for the conformance tests.
+"""
+
+import base64
+import datetime
+import hashlib
+import re
+from typing import List, Optional
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509 import Certificate, load_der_x509_certificate
+from lxml import etree
+
+from ksa_compliance.zatca_cli import SigningResult
+
+NAMESPACES = {
+    "inv": "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2",
+    "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+    "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+    "ext": "urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2",
+}
+
+# Elements excluded from the invoice hash, as specified by the XPath transforms in the signature
+_HASH_EXCLUDED_ELEMENTS = [
+    "//ext:UBLExtensions",
+    "//cac:Signature",
+    "//cac:AdditionalDocumentReference[cbc:ID='QR']",
+]
+
+# QR code values have a one-byte length
+MAX_TLV_VALUE_LENGTH = 255
+
+# QR code fields by tag, as named in ZATCA's spec
+QR_FIELD_NAMES = {
+    1: "Seller Name",
+    2: "VAT Registration Number",
+    3: "Invoice Timestamp",
+    4: "Invoice Total",
+    5: "VAT Total",
+    6: "Invoice Hash",
+    7: "Signature",
+    8: "Public Key",
+    9: "Certificate Signature",
+}
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+_UBL_EXTENSIONS_TEMPLATE = """
+    <ext:UBLExtensions>
+        <ext:UBLExtension>
+            <ext:ExtensionURI>urn:oasis:names:specification:ubl:dsig:enveloped:xades</ext:ExtensionURI>
+            <ext:ExtensionContent>
+                <sig:UBLDocumentSignatures xmlns:sig="urn:oasis:names:specification:ubl:schema:xsd:CommonSignatureComponents-2" xmlns:sac="urn:oasis:names:specification:ubl:schema:xsd:SignatureAggregateComponents-2" xmlns:sbc="urn:oasis:names:specification:ubl:schema:xsd:SignatureBasicComponents-2">
+                    <sac:SignatureInformation>
+                        <cbc:ID>urn:oasis:names:specification:ubl:signature:1</cbc:ID>
+                        <sbc:ReferencedSignatureID>urn:oasis:names:specification:ubl:signature:Invoice</sbc:ReferencedSignatureID>
+                        <ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#" Id="signature">
+                            <ds:SignedInfo>
+                                <ds:CanonicalizationMethod Algorithm="http://www.w3.org/2006/12/xml-c14n11"/>
+                                <ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"/>
+                                <ds:Reference Id="invoiceSignedData" URI="">
+                                    <ds:Transforms>
+                                        <ds:Transform Algorithm="http://www.w3.org/TR/1999/REC-xpath-19991116">
+                                            <ds:XPath>not(//ancestor-or-self::ext:UBLExtensions)</ds:XPath>
+                                        </ds:Transform>
+                                        <ds:Transform Algorithm="http://www.w3.org/TR/1999/REC-xpath-19991116">
+                                            <ds:XPath>not(//ancestor-or-self::cac:Signature)</ds:XPath>
+                                        </ds:Transform>
+                                        <ds:Transform Algorithm="http://www.w3.org/TR/1999/REC-xpath-19991116">
+                                            <ds:XPath>not(//ancestor-or-self::cac:AdditionalDocumentReference[cbc:ID='QR'])</ds:XPath>
+                                        </ds:Transform>
+                                        <ds:Transform Algorithm="http://www.w3.org/2006/12/xml-c14n11"/>
+                                    </ds:Transforms>
+                                    <ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>
+                                    <ds:DigestValue>{invoice_hash}</ds:DigestValue>
+                                </ds:Reference>
+                                <ds:Reference Type="http://www.w3.org/2000/09/xmldsig#SignatureProperties" URI="#xadesSignedProperties">
+                                    <ds:DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>
+                                    <ds:DigestValue>{signed_properties_hash}</ds:DigestValue>
+                                </ds:Reference>
+                            </ds:SignedInfo>
+                            <ds:SignatureValue>{signature}</ds:SignatureValue>
+                            <ds:KeyInfo>
+                                <ds:X509Data>
+                                    <ds:X509Certificate>{certificate}</ds:X509Certificate>
+                                </ds:X509Data>
+                            </ds:KeyInfo>
+                            <ds:Object>
+                                <xades:QualifyingProperties xmlns:xades="http://uri.etsi.org/01903/v1.3.2#" Target="signature">
+                                    {signed_properties}
+                                </xades:QualifyingProperties>
+                            </ds:Object>
+                        </ds:Signature>
+                    </sac:SignatureInformation>
+                </sig:UBLDocumentSignatures>
+            </ext:ExtensionContent>
+        </ext:UBLExtension>
+    </ext:UBLExtensions>"""
+
+# The signed properties hash is computed over this exact text, so whitespace and namespace declarations matter. It
+# must be inserted into the document verbatim
+_SIGNED_PROPERTIES_TEMPLATE = """<xades:SignedProperties xmlns:xades="http://uri.etsi.org/01903/v1.3.2#" Id="xadesSignedProperties">
+                                        <xades:SignedSignatureProperties>
+                                            <xades:SigningTime>{signing_time}</xades:SigningTime>
+                                            <xades:SigningCertificate>
+                                                <xades:Cert>
+                                                    <xades:CertDigest>
+                                                        <ds:DigestMethod xmlns:ds="http://www.w3.org/2000/09/xmldsig#" Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>
+                                                        <ds:DigestValue xmlns:ds="http://www.w3.org/2000/09/xmldsig#">{certificate_hash}</ds:DigestValue>
+                                                    </xades:CertDigest>
+                                                    <xades:IssuerSerial>
+                                                        <ds:X509IssuerName xmlns:ds="http://www.w3.org/2000/09/xmldsig#">{issuer_name}</ds:X509IssuerName>
+                                                        <ds:X509SerialNumber xmlns:ds="http://www.w3.org/2000/09/xmldsig#">{serial_number}</ds:X509SerialNumber>
+                                                    </xades:IssuerSerial>
+                                                </xades:Cert>
+                                            </xades:SigningCertificate>
+                                        </xades:SignedSignatureProperties>
+                                    </xades:SignedProperties>"""
+
+_QR_AND_SIGNATURE_TEMPLATE = """
+    <cac:AdditionalDocumentReference>
+        <cbc:ID>QR</cbc:ID>
+        <cac:Attachment>
+            <cbc:EmbeddedDocumentBinaryObject mimeCode="text/plain">{qr_code}</cbc:EmbeddedDocumentBinaryObject>
+        </cac:Attachment>
+    </cac:AdditionalDocumentReference>
+    <cac:Signature>
+        <cbc:ID>urn:oasis:names:specification:ubl:signature:Invoice</cbc:ID>
+        <cbc:SignatureMethod>urn:oasis:names:specification:ubl:dsig:enveloped:xades</cbc:SignatureMethod>
+    </cac:Signature>"""
+
+_INVOICE_START_TAG = re.compile(r"<Invoice\b[^>]*>")
+_PIH_REFERENCE = re.compile(
+    r"<cac:AdditionalDocumentReference>\s*<cbc:ID>PIH</cbc:ID>.*?</cac:AdditionalDocumentReference>",
+    re.DOTALL,
+)
+
+
+def sign_invoice(invoice_xml: str, cert_path: str, private_key_path: str) -> SigningResult:
+    """Signs [invoice_xml] (as generated from the e_invoice.xml template) using the given certificate and key"""
+    cert_body = read_certificate_body(cert_path)
+    certificate = load_der_x509_certificate(base64.b64decode(cert_body))
+    private_key = load_private_key(private_key_path)
+
+    # The signature, QR and UBL extensions are excluded from the invoice hash, so we can compute it (and read the QR
+    # values) using a skeleton with unfilled placeholders
+    invoice_xml = _strip_xml_declaration(invoice_xml)
+    skeleton = _insert_signature_elements(
+        invoice_xml, _UBL_EXTENSIONS_TEMPLATE, _QR_AND_SIGNATURE_TEMPLATE
+    )
+    invoice_hash = get_invoice_hash(skeleton)
+    signature = base64.b64encode(
+        private_key.sign(base64.b64decode(invoice_hash), ec.ECDSA(hashes.SHA256()))
+    ).decode()
+
+    signed_properties = _SIGNED_PROPERTIES_TEMPLATE.format(
+        signing_time=datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S"),
+        certificate_hash=_hex_digest_b64(cert_body.encode()),
+        issuer_name=get_issuer_name(certificate),
+        serial_number=certificate.serial_number,
+    )
+    qr_code = generate_qr_code(skeleton, invoice_hash, signature, certificate)
+
+    ubl_extensions = _UBL_EXTENSIONS_TEMPLATE.format(
+        invoice_hash=invoice_hash,
+        signed_properties_hash=_hex_digest_b64(signed_properties.encode()),
+        signature=signature,
+        certificate=cert_body,
+        signed_properties=signed_properties,
+    )
+    signed_xml = (
+        _XML_DECLARATION
+        + "\n"
+        + _insert_signature_elements(
+            invoice_xml, ubl_extensions, _QR_AND_SIGNATURE_TEMPLATE.format(qr_code=qr_code)
+        )
+    )
+    return SigningResult(signed_xml, None, invoice_hash, qr_code)
+
+
+def get_invoice_hash(invoice_xml: str | bytes) -> str:
+    """
+    Returns the base64-encoded SHA-256 hash of an invoice, signed or not. The signature, QR and UBL extensions are
+    excluded, and the rest of the document is canonicalized.
+    """
+    if isinstance(invoice_xml, str):
+        invoice_xml = invoice_xml.encode("utf-8")
+    root = etree.fromstring(invoice_xml)
+    for xpath in _HASH_EXCLUDED_ELEMENTS:
+        for element in root.xpath(xpath, namespaces=NAMESPACES):
+            _remove_keeping_tail(element)
+
+    canonical = etree.tostring(root, method="c14n", exclusive=False, with_comments=False)
+    return base64.b64encode(hashlib.sha256(canonical).digest()).decode()
+
+
+def generate_qr_code(
+    invoice_xml: str, invoice_hash: str, signature: str, certificate: Certificate
+) -> str:
+    """Generates the phase 2 QR code (base64 TLV) for an invoice"""
+    root = etree.fromstring(invoice_xml.encode("utf-8"))
+
+    def text(xpath: str) -> str:
+        values = root.xpath(xpath, namespaces=NAMESPACES)
+        return values[0].text.strip() if values and values[0].text else ""
+
+    values: List[bytes] = [
+        text(
+            "/inv:Invoice/cac:AccountingSupplierParty/cac:Party/cac:PartyLegalEntity/cbc:RegistrationName"
+        ).encode(),
+        text(
+            "/inv:Invoice/cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID"
+        ).encode(),
+        f"{text('/inv:Invoice/cbc:IssueDate')}T{text('/inv:Invoice/cbc:IssueTime')}".encode(),
+        text("/inv:Invoice/cac:LegalMonetaryTotal/cbc:TaxInclusiveAmount").encode(),
+        text("/inv:Invoice/cac:TaxTotal[1]/cbc:TaxAmount").encode(),
+        invoice_hash.encode(),
+        signature.encode(),
+        certificate.public_key().public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+        ),
+    ]
+
+    # The certificate signature is only included for simplified invoices (transaction code 02xxxxx)
+    type_code = root.xpath("/inv:Invoice/cbc:InvoiceTypeCode", namespaces=NAMESPACES)
+    if type_code and (type_code[0].get("name") or "").startswith("02"):
+        values.append(certificate.signature)
+
+    return base64.b64encode(_encode_tlv(values)).decode()
+
+
+class QrFieldTooLong(ValueError):
+    """Raised when a QR code value doesn't fit in the one-byte length of its TLV entry"""
+
+    def __init__(self, tag: int, length: int):
+        self.tag = tag
+        self.field = QR_FIELD_NAMES.get(tag, str(tag))
+        self.length = length
+        super().__init__(
+            f"QR code field {tag} ({self.field}) is {length} bytes long, but ZATCA's QR code allows "
+            f"at most {MAX_TLV_VALUE_LENGTH} bytes per field"
+        )
+
+
+def _encode_tlv(values: List[bytes]) -> bytes:
+    """Encodes [values] as tags 1, 2, ... Each is a one-byte tag, a one-byte length and the value, per ZATCA's spec"""
+    tlv = b""
+    for tag, value in enumerate(values, 1):
+        if len(value) > MAX_TLV_VALUE_LENGTH:
+            raise QrFieldTooLong(tag, len(value))
+        tlv += bytes([tag, len(value)]) + value
+    return tlv
+
+
+def get_issuer_name(certificate: Certificate) -> str:
+    """Formats the certificate issuer the way Java does (most specific RDN first, separated by ', ')"""
+    return ", ".join(rdn.rfc4514_string() for rdn in reversed(certificate.issuer.rdns))
+
+
+def read_certificate_body(cert_path: str) -> str:
+    """Returns the base64 body of a PEM certificate (without the BEGIN/END lines)"""
+    with open(cert_path, "rt") as file:
+        content = file.read()
+    return "".join(line.strip() for line in content.splitlines() if "-----" not in line)
+
+
+def load_private_key(private_key_path: str) -> ec.EllipticCurvePrivateKey:
+    """Loads a private key in PEM or in headerless base64 form (as generated by the CLI)"""
+    with open(private_key_path, "rb") as file:
+        content = file.read()
+    if b"-----BEGIN" in content:
+        return serialization.load_pem_private_key(content, password=None)
+    return serialization.load_der_private_key(base64.b64decode(content), password=None)
+
+
+def _insert_signature_elements(
+    invoice_xml: str, ubl_extensions: str, qr_and_signature: str
+) -> str:
+    """Inserts the UBL extensions as the first child of the invoice, and the QR and signature after the PIH"""
+    start_tag = _INVOICE_START_TAG.search(invoice_xml)
+    pih_reference = _PIH_REFERENCE.search(invoice_xml)
+    if not start_tag or not pih_reference:
+        raise ValueError("Invoice XML is missing the Invoice element or the PIH reference")
+
+    return (
+        invoice_xml[: start_tag.end()]
+        + ubl_extensions
+        + invoice_xml[start_tag.end() : pih_reference.end()]
+        + qr_and_signature
+        + invoice_xml[pih_reference.end() :]
+    )
+
+
+def _strip_xml_declaration(invoice_xml: str) -> str:
+    invoice_xml = invoice_xml.lstrip()
+    if invoice_xml.startswith("<?xml"):
+        invoice_xml = invoice_xml[invoice_xml.index("?>") + 2 :].lstrip()
+    return invoice_xml
+
+
+def _remove_keeping_tail(element: etree._Element) -> None:
+    """
+    Removes an element from its parent. lxml drops the element's tail (the text following it) on removal, whereas the
+    XPath transforms used by ZATCA only drop the element itself, so we move the tail to the preceding node.
+    """
+    parent = element.getparent()
+    if element.tail:
+        previous: Optional[etree._Element] = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or "") + element.tail
+        else:
+            parent.text = (parent.text or "") + element.tail
+    parent.remove(element)
+
+
+def _hex_digest_b64(content: bytes) -> str:
+    """ZATCA digests for certificates and signed properties are base64-encoded hex strings, not raw digests"""
+    return base64.b64encode(hashlib.sha256(content).hexdigest().encode()).decode()
@@ -0,0 +1,202 @@
+"""
+Shared rate limiter for reporting and clearance calls.
+
+Each CSID gets a token bucket in Redis, so every worker sending with that CSID draws from the same budget: live
+submissions, the batch sync (one invoice at a time or concurrently) and compliance checks. A call takes a token
+before each attempt and waits for one when the bucket is empty.
+
+The bucket learns from ZATCA's answers. A 429 halves its rate, down to [MIN_RATE], and a Retry-After header (or
+[DEFAULT_RETRY_AFTER_SECONDS] for a 429 without one) holds every sender off until it passes. Each successful call
+then adds back a tenth of the configured rate, so throughput recovers gradually once ZATCA stops throttling.
+
+The following site config keys tune the behaviour:
+
+    zatca_rate_limit_per_second: calls per second per CSID (default 10, 0 disables the limiter)
+    zatca_rate_limit_burst: calls that can go out back to back after an idle period (default: the rate)
+    zatca_rate_limit_max_wait: longest a call waits for a token, in seconds (default 60)
+
+A call that would have to wait longer than that fails with [RateLimited] without being sent. Callers return
+[zatca_circuit_breaker.STATUS_CODE] for it, so the invoice stays "Ready For Batch" without an integration log and the
+next batch sync sends it. If Redis can't be reached, calls go through unlimited.
+"""
+
+import asyncio
+import email.utils
+import hashlib
+import time
+from typing import Optional
+
+import frappe
+from frappe.utils import flt
+
+from ksa_compliance import logger
+
+DEFAULT_RATE = 10
+DEFAULT_MAX_WAIT_SECONDS = 60
+DEFAULT_RETRY_AFTER_SECONDS = 1
+MIN_RATE = 0.2
+
+# Buckets of CSIDs that stop sending are dropped after a day
+_BUCKET_TTL_SECONDS = 24 * 60 * 60
+
+# Takes a token if one is available. Returns how long to wait before trying again, 0 if a token was taken. Refills
+# at the bucket's current rate, which starts at the configured one
+_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'rate', 'blocked_until')
+local rate = tonumber(state[3]) or max_rate
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+local blocked_until = tonumber(state[4]) or 0
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if now < blocked_until then
+    wait = blocked_until - now
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'updated', now, 'rate', rate, 'blocked_until', blocked_until)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+# Adjusts the bucket after a response: blocked for [retry_after] seconds if given, rate halved when throttled and
+# raised by a tenth of the configured rate otherwise
+_FEEDBACK_SCRIPT = """
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[2])
+local throttled = ARGV[3] == '1'
+local retry_after = tonumber(ARGV[4])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or max_rate
+if not throttled and retry_after == 0 and rate >= max_rate then
+    return 0
+end
+if retry_after > 0 then
+    local blocked_until = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+    redis.call('HSET', KEYS[1], 'blocked_until', math.max(blocked_until, now + retry_after))
+end
+if throttled then
+    redis.call('HMSET', KEYS[1], 'tokens', 0, 'rate', math.max(tonumber(ARGV[5]), rate / 2))
+elseif rate < max_rate then
+    redis.call('HSET', KEYS[1], 'rate', math.min(max_rate, rate + max_rate / 10))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return 1
+"""
+
+
+class RateLimited(Exception):
+    """Raised when a call would wait longer than the configured maximum for a token"""
+
+    def __init__(self, wait: float):
+        super().__init__(
+            f"ZATCA rate limit reached for this CSID, next call possible in {wait:.1f}s"
+        )
+        self.wait = wait
+
+
+def get_bucket_key(security_token: str) -> str:
+    """Buckets are keyed by a digest of the CSID, so the token itself isn't written to Redis"""
+    digest = hashlib.sha256(security_token.encode("utf-8")).hexdigest()[:32]
+    return frappe.cache().make_key(f"zatca_rate_limit|{digest}")
+
+
+def get_rate() -> float:
+    rate = frappe.conf.get("zatca_rate_limit_per_second")
+    return DEFAULT_RATE if rate is None else flt(rate)
+
+
+def acquire(key: Optional[str]) -> None:
+    """Waits for a token from the bucket at [key]. Raises [RateLimited] instead of waiting past the maximum wait"""
+    deadline = time.monotonic() + _get_max_wait()
+    while True:
+        wait = _take(key)
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimited(wait)
+        time.sleep(wait)
+
+
+async def acquire_async(key: Optional[str]) -> None:
+    """Like [acquire], without blocking the event loop while waiting or talking to Redis"""
+    deadline = time.monotonic() + _get_max_wait()
+    while True:
+        wait = await asyncio.to_thread(_take, key)
+        if not wait:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimited(wait)
+        await asyncio.sleep(wait)
+
+
+def record_response(key: Optional[str], response) -> None:
+    """
+    Feeds a ZATCA [response] (requests or httpx) back into the bucket at [key]. A 429 slows the bucket down, a
+    Retry-After header holds it off and anything else below 500 lets it speed back up
+    """
+    if not key or response is None or get_rate() <= 0:
+        return
+
+    throttled = response.status_code == 429
+    retry_after = get_retry_after(response)
+    if throttled and not retry_after:
+        retry_after = DEFAULT_RETRY_AFTER_SECONDS
+    if not throttled and not retry_after and response.status_code >= 500:
+        return
+
+    if throttled:
+        logger.warning(f"ZATCA throttled calls, holding off for {retry_after}s")
+    _run_script(
+        _FEEDBACK_SCRIPT,
+        key,
+        time.time(),
+        get_rate(),
+        1 if throttled else 0,
+        retry_after,
+        min(MIN_RATE, get_rate()),
+        _BUCKET_TTL_SECONDS,
+    )
+
+
+def get_retry_after(response) -> float:
+    """Returns the seconds in the Retry-After header of [response], which can be a number or an HTTP date"""
+    value = (response.headers.get("Retry-After") or "").strip()
+    if not value:
+        return 0
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0
+
+
+def reset(security_token: str) -> None:
+    """Forgets what the bucket of [security_token] learned. Meant for tests and for after a CSID is renewed"""
+    frappe.cache().delete(get_bucket_key(security_token))
+
+
+def _take(key: Optional[str]) -> float:
+    rate = get_rate()
+    if not key or rate <= 0:
+        return 0
+    burst = max(1.0, flt(frappe.conf.get("zatca_rate_limit_burst")) or rate)
+    return flt(_run_script(_TAKE_SCRIPT, key, time.time(), rate, burst, _BUCKET_TTL_SECONDS))
+
+
+def _get_max_wait() -> float:
+    return flt(frappe.conf.get("zatca_rate_limit_max_wait") or DEFAULT_MAX_WAIT_SECONDS)
+
+
+def _run_script(script: str, key: str, *args):
+    try:
+        return frappe.cache().register_script(script)(keys=[key], args=args)
+    except Exception as e:
+        # Pacing is an optimization, so a Redis outage shouldn't stop invoices from being sent
+        logger.warning(f"ZATCA rate limiter unavailable, sending without it: {e}")
+        return 0
@@ -0,0 +1,115 @@
+"""
+Scratch space for the files exchanged with ZATCA CLI.
+
+The CLI only works with file paths, so every sign, validate and PDF conversion needs the invoice on disk. Files are
+created inside a workspace directory that lives for a [scope] and is deleted when the outermost scope exits, so
+nothing is left behind in the temp directory. Scopes nest: a scope opened while another is active shares it, which
+lets a caller keep paths returned by one CLI call (e.g. the signed invoice) alive for the next one (validation).
+
+Workspaces are created under the 'zatca_workspace_dir' site config key if set, otherwise under /dev/shm when it's
+available (a tmpfs, so the files never hit the disk), otherwise under the system temp directory. Each workspace counts
+the files and bytes written to it, which [measure] reports per CLI call.
+"""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import frappe
+
+from ksa_compliance import logger
+
+_SHARED_MEMORY_DIR = "/dev/shm"
+
+
+class Workspace:
+    def __init__(self, path: str):
+        self.path = path
+        self.files = 0
+        self.bytes = 0
+        self._external_paths: List[str] = []
+
+    def new_path(self, name: str) -> str:
+        """Returns a new, empty file in the workspace whose name ends with [name]"""
+        fd, path = tempfile.mkstemp(suffix="-" + name, dir=self.path)
+        os.close(fd)
+        return path
+
+    def write_text(self, content: str, name: str) -> str:
+        return self.write_bytes(content.encode("utf-8"), name)
+
+    def write_bytes(self, content: bytes, name: str) -> str:
+        path = self.new_path(name)
+        with open(path, "wb") as file:
+            file.write(content)
+        self.files += 1
+        self.bytes += len(content)
+        return path
+
+    def track(self, path: str) -> None:
+        """Counts a file written by someone else (e.g. CLI output), and deletes it with the workspace"""
+        if not os.path.isfile(path):
+            return
+        self.files += 1
+        self.bytes += os.path.getsize(path)
+        if os.path.dirname(os.path.abspath(path)) != self.path:
+            self._external_paths.append(path)
+
+    def cleanup(self) -> None:
+        for path in self._external_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def current() -> Optional[Workspace]:
+    """Returns the workspace of the active scope, if any"""
+    return getattr(frappe.local, "zatca_workspace", None)
+
+
+@contextmanager
+def scope() -> Iterator[Workspace]:
+    """Runs the enclosed block with a workspace, deleting it once the outermost scope exits"""
+    workspace = current()
+    if workspace:
+        yield workspace
+        return
+
+    workspace = Workspace(os.path.abspath(tempfile.mkdtemp(prefix="zatca-", dir=_get_base_dir())))
+    frappe.local.zatca_workspace = workspace
+    try:
+        yield workspace
+    finally:
+        frappe.local.zatca_workspace = None
+        workspace.cleanup()
+
+
+@contextmanager
+def measure(label: str) -> Iterator[None]:
+    """Logs the files and bytes the enclosed block added to the current workspace"""
+    workspace = current()
+    if not workspace:
+        yield
+        return
+
+    files, size = workspace.files, workspace.bytes
+    try:
+        yield
+    finally:
+        logger.info(
+            f"{label}: {workspace.files - files} temp files, {workspace.bytes - size} bytes"
+        )
+
+
+def _get_base_dir() -> Optional[str]:
+    configured = frappe.conf.get("zatca_workspace_dir")
+    if configured:
+        os.makedirs(configured, exist_ok=True)
+        return configured
+    if os.path.isdir(_SHARED_MEMORY_DIR) and os.access(_SHARED_MEMORY_DIR, os.W_OK):
+        return _SHARED_MEMORY_DIR
+    return None